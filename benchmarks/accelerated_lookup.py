@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Simulates lookups in a network of nodes whose routing tables use different
+symbol sizes (b, see section 4.2 of the Kademlia paper) to show the reduction
+in the number of hops needed to find a node against the increase in the size
+of each node's routing table.
+
+Every node learns about every other node (in a random order) and each lookup
+greedily asks the closest node it knows about for the nodes closest to the
+target until the target is found.
+
+Run with: python -m benchmarks.accelerated_lookup
+"""
+import random
+from p4p2p.dht.contact import PeerNode
+from p4p2p.dht.routingtable import RoutingTable
+
+
+def make_network(contacts, b, rand):
+    """
+    Returns a dict mapping each contact's network id (as an integer) to a
+    routing table (with symbol size b) that knows about all the other
+    contacts.
+    """
+    network = {}
+    for contact in contacts:
+        others = [c for c in contacts if c is not contact]
+        rand.shuffle(others)
+        routing_table = RoutingTable(contact.network_id_int, b=b)
+        routing_table.add_contacts(others)
+        network[contact.network_id_int] = routing_table
+    return network
+
+
+def lookup(network, source, target):
+    """
+    Returns the number of hops (requests) needed for the source node to find
+    the target node.
+    """
+    hops = 0
+    current = source
+    while True:
+        closest = network[current].find_close_nodes(target)[0]
+        hops += 1
+        if closest.network_id_int == target:
+            return hops
+        current = closest.network_id_int
+
+
+def main(nodes=2000, lookups=2000, symbol_sizes=(1, 2, 3, 4)):
+    rand = random.Random(42)
+    contacts = []
+    for i in range(nodes):
+        contact = PeerNode(str(i), '10.0.%d.%d' % divmod(i, 256), 9999, '0.1')
+        contacts.append(contact)
+    ids = [c.network_id_int for c in contacts]
+    pairs = [rand.sample(ids, 2) for i in range(lookups)]
+    print('%d nodes, %d lookups' % (nodes, lookups))
+    print(' b  mean hops  max hops  mean contacts  mean buckets')
+    for b in symbol_sizes:
+        network = make_network(contacts, b, rand)
+        hops = [lookup(network, source, target) for source, target in pairs]
+        tables = list(network.values())
+        contact_count = sum(len(bucket) for r in tables
+                            for bucket in r._buckets)
+        bucket_count = sum(len(r._buckets) for r in tables)
+        print('%2d  %9.2f  %8d  %13.1f  %12.1f' % (
+            b, sum(hops) / len(hops), max(hops), contact_count / nodes,
+            bucket_count / nodes))
+
+
+if __name__ == '__main__':
+    main()
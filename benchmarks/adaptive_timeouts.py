@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Simulates lookups in a network where peers usually respond quickly but now
+and then fail to respond at all, to compare the latency of lookups that give
+every peer the fixed RPC_TIMEOUT with those that use adaptive (per peer)
+timeouts.
+
+The local node's routing table first learns the round trip times of the
+peers during some warm up lookups. The measured lookups then run
+concurrently (in real time, so this takes a little while).
+
+Run with: python -m benchmarks.adaptive_timeouts
+"""
+import asyncio
+import random
+import time
+from p4p2p.dht import constants
+from p4p2p.dht.contact import PeerNode
+from p4p2p.dht.lookup import NodeLookup, Transport
+from p4p2p.dht.metrics import Metrics
+from p4p2p.dht.routingtable import RoutingTable
+from p4p2p.dht.utils import sort_peer_nodes
+
+
+class SimulatedTransport(Transport):
+    """
+    Each peer has a typical round trip time (a few tens of milliseconds) and
+    fails to respond to a proportion of requests. Peers answer with fresh
+    PeerNode instances for the K peers closest to the key.
+    """
+
+    def __init__(self, peers, stall_rate, rand):
+        self.peers = peers
+        self.stall_rate = stall_rate
+        self.rand = rand
+        self.latencies = dict((p.network_id_int,
+                               rand.lognormvariate(-3.2, 0.5)) for p in peers)
+
+    async def find_node(self, contact, key):
+        if self.rand.random() < self.stall_rate:
+            await asyncio.sleep(3600)
+        latency = self.latencies[contact.network_id_int]
+        await asyncio.sleep(latency * self.rand.uniform(0.8, 1.5))
+        closest = sort_peer_nodes([p for p in self.peers if p != contact],
+                                  key)
+        return [PeerNode(p.public_key, p.ip_address, p.port, p.version)
+                for p in closest]
+
+
+def percentile(values, fraction):
+    """
+    Returns the value at the given fraction of the sorted values.
+    """
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+async def run_lookups(routing_table, transport, keys, adaptive_timeouts,
+                      concurrency):
+    """
+    Runs a lookup for each key with up to concurrency lookups running at
+    once. Returns a list of how long each took (in seconds).
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def timed_lookup(key):
+        async with semaphore:
+            lookup = NodeLookup(key, routing_table, transport,
+                                adaptive_timeouts=adaptive_timeouts)
+            start = time.monotonic()
+            await lookup.run()
+            return time.monotonic() - start
+    return await asyncio.gather(*[timed_lookup(key) for key in keys])
+
+
+def main(nodes=500, warm_up=100, lookups=200, stall_rate=0.05,
+         concurrency=25):
+    rand = random.Random(42)
+    peers = [PeerNode(str(i), '10.0.%d.%d' % divmod(i, 256), 9999, '0.1')
+             for i in range(nodes)]
+    print('%d nodes, %d lookups, %.0f%% of requests unanswered' % (
+        nodes, lookups, stall_rate * 100))
+    print('RPC_TIMEOUT %ss, RPC_TIMEOUT_MIN %ss, RPC_TIMEOUT_K %s' % (
+        constants.RPC_TIMEOUT, constants.RPC_TIMEOUT_MIN,
+        constants.RPC_TIMEOUT_K))
+    print('timeouts  p50 (s)  p90 (s)  p99 (s)  max (s)  evictions')
+    for adaptive_timeouts in (False, True):
+        transport = SimulatedTransport(peers, stall_rate, rand)
+        metrics = Metrics()
+        routing_table = RoutingTable(hex(rand.getrandbits(512)), metrics)
+        routing_table.add_contacts(rand.sample(peers, 50))
+        keys = [rand.getrandbits(512) for i in range(warm_up)]
+        asyncio.run(run_lookups(routing_table, transport, keys,
+                                adaptive_timeouts, concurrency))
+        keys = [rand.getrandbits(512) for i in range(lookups)]
+        durations = asyncio.run(run_lookups(routing_table, transport, keys,
+                                            adaptive_timeouts, concurrency))
+        print('%8s  %7.3f  %7.3f  %7.3f  %7.3f  %9d' % (
+            'adaptive' if adaptive_timeouts else 'fixed',
+            percentile(durations, 0.5), percentile(durations, 0.9),
+            percentile(durations, 0.99), max(durations),
+            metrics.report()['counters'].get('evictions', 0)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Measures the throughput of verify_items with process pools of different
+sizes (1, 2, 4... up to the number of CPUs) against verifying the same batch
+of items one by one with verify_item. Each pool verifies the batch without
+the verification cache, with the (default) cache starting empty and then
+again with the cache holding every item (as when replicas arrive again).
+
+Run with: python -m benchmarks.batch_verify
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from Crypto.PublicKey import RSA
+from p4p2p.dht.crypto import (get_signed_item, verify_item, verify_items,
+                              verification_cache)
+
+
+def make_items(count, publishers=10):
+    """
+    Returns a list of count items signed by the given number of publishers.
+    """
+    keys = []
+    for i in range(publishers):
+        key = RSA.generate(2048)
+        keys.append((key.publickey().exportKey('PEM').decode('ascii'),
+                     key.exportKey('PEM').decode('ascii')))
+    items = []
+    for i in range(count):
+        public_key, private_key = keys[i % publishers]
+        item = {'value': 'item %d' % i, 'tags': ['a', 'b', 'c']}
+        items.append(get_signed_item(item, public_key, private_key))
+    return items
+
+
+def rate(items, executor, **kwargs):
+    """
+    Returns how many of the items verify_items verifies per second.
+    """
+    start = time.perf_counter()
+    assert all(verified for _, verified in
+               verify_items(items, executor, **kwargs))
+    return len(items) / (time.perf_counter() - start)
+
+
+def main(count=2000):
+    items = make_items(count)
+    cpus = os.cpu_count()
+    print('%d items, %d CPUs' % (count, cpus))
+    print('  workers  no cache/s  speedup  empty cache/s  full cache/s')
+    start = time.perf_counter()
+    assert all(verify_item(item, cache=None) for item in items)
+    serial = count / (time.perf_counter() - start)
+    print('%9s  %10.0f  %7.2f' % ('serial', serial, 1))
+    workers = 1
+    while True:
+        with ProcessPoolExecutor(workers) as executor:
+            # Start the workers before timing.
+            list(verify_items(items[:workers], executor, chunksize=1,
+                              cache=None))
+            uncached = rate(items, executor, cache=None)
+            verification_cache.clear()
+            empty = rate(items, executor)
+            full = rate(items, executor)
+        print('%9d  %10.0f  %7.2f  %13.0f  %12.0f' % (
+            workers, uncached, uncached / serial, empty, full))
+        if workers >= cpus:
+            break
+        workers = min(workers * 2, cpus)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Compares the time taken to find the bucket responsible for a key in a routing
+table containing 512 buckets using a binary search over the bucket ranges
+against the original linear scan through all the buckets.
+
+Run with: python -m benchmarks.bucket_index
+"""
+import random
+import timeit
+from p4p2p.dht.routingtable import RoutingTable
+
+
+def linear_bucket_index(routing_table, key):
+    """
+    The original implementation of RoutingTable._bucket_index: check each
+    bucket in turn until one is found whose range contains the key.
+    """
+    if isinstance(key, str):
+        key = int(key, 0)
+    for i, bucket in enumerate(routing_table._buckets):
+        if bucket.key_in_range(key):
+            return i
+    raise ValueError('Key out of range.')
+
+
+def make_routing_table(bucket_count):
+    """
+    Returns a routing table split into bucket_count buckets in the same way
+    a full table is split (always splitting the bucket containing the parent
+    node's ID).
+    """
+    r = RoutingTable('0xdeadbeef')
+    while len(r._buckets) < bucket_count:
+        r._split_bucket(r._bucket_index('0xdeadbeef'))
+    return r
+
+
+def main(bucket_count=512, lookups=10000):
+    r = make_routing_table(bucket_count)
+    # Pick a key from each bucket so lookups are spread across the table.
+    keys = [hex(random.randrange(b.range_min, b.range_max))
+            for b in r._buckets]
+    keys = [random.choice(keys) for i in range(lookups)]
+    for key in keys[:100]:
+        assert r._bucket_index(key) == linear_bucket_index(r, key)
+    linear = timeit.timeit(
+        lambda: [linear_bucket_index(r, k) for k in keys], number=1)
+    bisected = timeit.timeit(
+        lambda: [r._bucket_index(k) for k in keys], number=1)
+    print('%d buckets, %d lookups' % (len(r._buckets), lookups))
+    print('linear scan:   %.4fs (%.2fus per lookup)' % (
+        linear, linear / lookups * 1e6))
+    print('binary search: %.4fs (%.2fus per lookup)' % (
+        bisected, bisected / lookups * 1e6))
+    print('speedup:       %.1fx' % (linear / bisected))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+Compares the throughput of version 1 (recursive, hex digest strings) and
+version 2 (iterative, binary digests) of the canonical hash of items of
+different shapes.
+
+Run with: python -m benchmarks.canonical_hash
+"""
+import time
+from p4p2p.dht.crypto import _get_hash, _get_hash_v2
+
+
+def make_items():
+    """
+    Returns a list of (description, item) tuples.
+    """
+    small = {'name': 'value', 'count': 3, 'tags': ['a', 'b']}
+    records = {
+        'records': [{'id': i, 'name': 'record %d' % i, 'score': i / 7,
+                     'tags': ['x', 'y', i % 2 == 0]}
+                    for i in range(1000)],
+    }
+    flat = {'values': list(range(10000))}
+    deep = []
+    # Much deeper and version 1 reaches Python's recursion limit.
+    for i in range(200):
+        deep = {'child': deep, 'depth': i}
+    return [('small dict', small), ('1,000 records', records),
+            ('list of 10,000 ints', flat), ('nested 200 deep', deep)]
+
+
+def count_nodes(obj):
+    """
+    Returns the number of nodes (containers, keys and values) in the object.
+    """
+    count = 0
+    stack = [obj]
+    while stack:
+        node = stack.pop()
+        count += 1
+        if type(node) is dict:
+            count += len(node)
+            stack.extend(node.values())
+        elif type(node) is list:
+            stack.extend(node)
+    return count
+
+
+def throughput(get_hash, item, duration=1.0):
+    """
+    Returns the number of nodes of the item hashed per second.
+    """
+    nodes = count_nodes(item)
+    hashed = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        get_hash(item)
+        hashed += nodes
+    return hashed / (time.perf_counter() - start)
+
+
+def main():
+    print('                item    nodes  v1 nodes/s  v2 nodes/s  speedup')
+    for description, item in make_items():
+        v1 = throughput(_get_hash, item)
+        v2 = throughput(_get_hash_v2, item)
+        print('%20s  %7d  %10.0f  %10.0f  %7.2f' % (
+            description, count_nodes(item), v1, v2, v2 / v1))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Compares the memory used by 100,000 contacts (from 20,000 distinct peers, as
+happens when a PeerNode is created for every message received) using the
+compact, slotted PeerNode against the original representation with a
+per-instance __dict__ holding the hex network id, its integer and bytes forms
+and an un-interned copy of the public key.
+
+Run with: python -m benchmarks.contact_memory
+"""
+import base64
+import os
+import random
+import tracemalloc
+from hashlib import sha512
+from p4p2p.dht.contact import PeerNode
+
+
+class DictPeerNode(object):
+    """
+    The original representation of a contact.
+    """
+
+    def __init__(self, public_key, ip_address, port, version, last_seen=0):
+        digest = sha512(public_key.encode('ascii')).digest()
+        self.network_id = '0x' + digest.hex()
+        self.network_id_int = int.from_bytes(digest, 'big')
+        self.network_id_bytes = digest
+        self.public_key = public_key
+        self.ip_address = ip_address
+        self.port = port
+        self.version = version
+        self.last_seen = last_seen
+        self.failed_RPCs = 0
+
+
+def make_public_key():
+    """
+    Returns a string the size of a PEM encoded 1024-bit RSA public key.
+    """
+    body = base64.encodebytes(os.urandom(162)).decode('ascii')
+    return ('-----BEGIN PUBLIC KEY-----\n' + body +
+            '-----END PUBLIC KEY-----')
+
+
+def measure(cls, messages):
+    """
+    Returns the number of bytes allocated to create a contact of the
+    specified class for each (public_key, ip_address, port) message.
+    """
+    tracemalloc.start()
+    # Each message is decoded into a new public key string.
+    contacts = [cls(''.join(list(key)), ip_address, port, '0.1', 0)
+                for key, ip_address, port in messages]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del contacts
+    return size
+
+
+def main(contacts=100000, peers=20000):
+    peer_details = [(make_public_key(), '10.0.%d.%d' % divmod(i, 256), 9999)
+                    for i in range(peers)]
+    messages = [random.choice(peer_details) for i in range(contacts)]
+    original = measure(DictPeerNode, messages)
+    compact = measure(PeerNode, messages)
+    print('%d contacts from %d peers' % (contacts, peers))
+    print('original: %.1fMB (%d bytes per contact)' % (
+        original / 2 ** 20, original / contacts))
+    print('compact:  %.1fMB (%d bytes per contact)' % (
+        compact / 2 ** 20, compact / contacts))
+    print('saving:   %.1fx' % (original / compact))
+
+
+if __name__ == '__main__':
+    main()
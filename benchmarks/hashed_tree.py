@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Compares the time taken to change one field of a large index document and
+re-sign it by hashing the whole document again against using a HashedTree
+(which only hashes the changed path again).
+
+Run with: python -m benchmarks.hashed_tree
+"""
+import random
+import time
+from Crypto.PublicKey import RSA
+from p4p2p.dht.crypto import HashedTree, get_signed_item
+
+
+def make_index(entries):
+    """
+    Returns an index document with the given number of entries.
+    """
+    return {
+        'name': 'index',
+        'entries': dict(('document %d' % i, {
+            'title': 'Document number %d' % i,
+            'size': i * 1024,
+            'tags': ['tag%d' % (i % 10), 'tag%d' % (i % 7)],
+            'updated': float(i),
+        }) for i in range(entries)),
+    }
+
+
+def main(sizes=(1000, 10000), updates=20):
+    rand = random.Random(42)
+    key = RSA.generate(2048)
+    public_key = key.publickey().exportKey('PEM').decode('ascii')
+    private_key = key.exportKey('PEM').decode('ascii')
+    print(' entries  full rehash (ms)  hashed tree (ms)  speedup')
+    for size in sizes:
+        index = make_index(size)
+        names = list(index['entries'])
+        start = time.perf_counter()
+        for i in range(updates):
+            name = rand.choice(names)
+            index['entries'][name]['updated'] = time.time()
+            get_signed_item(index, public_key, private_key, hash_version=2)
+        full = (time.perf_counter() - start) / updates
+        tree = HashedTree(make_index(size))
+        get_signed_item(tree, public_key, private_key, hash_version=2)
+        start = time.perf_counter()
+        for i in range(updates):
+            name = rand.choice(names)
+            tree.set(('entries', name, 'updated'), time.time())
+            get_signed_item(tree, public_key, private_key, hash_version=2)
+        hashed = (time.perf_counter() - start) / updates
+        print('%8d  %16.1f  %16.1f  %7.1f' % (
+            size, full * 1000, hashed * 1000, full / hashed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Measures the size of inclusion proofs (see get_inclusion_proof) for one
+record of items with more and more records (of about 1KiB each), along with
+the time taken to verify them, against the size of the whole item and the
+time taken to verify it with verify_item.
+
+Proofs hold the digests on the path through the Merkle tree of each
+container on the path, so their size grows with the logarithm of the number
+of records (and not with their size).
+
+Run with: python -m benchmarks.inclusion_proofs
+"""
+import json
+import time
+from Crypto.PublicKey import RSA
+from p4p2p.dht.crypto import (get_signed_item, verify_item, HashedTree,
+                              get_inclusion_proof, verify_inclusion_proof)
+
+
+def make_value(records):
+    """
+    Returns a value with the given number of records.
+    """
+    return {
+        'name': 'records',
+        'records': [{'id': i, 'title': 'Record %d' % i, 'body': 'x' * 1000}
+                    for i in range(records)],
+    }
+
+
+def timed(function, *args, **kwargs):
+    """
+    Returns the result of calling the function with the arguments and how
+    long (in milliseconds) it took.
+    """
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def main(sizes=(10, 100, 1000, 10000)):
+    key = RSA.generate(2048)
+    public_key = key.publickey().exportKey('PEM').decode('ascii')
+    private_key = key.exportKey('PEM').decode('ascii')
+    print('records  item (KiB)  verify (ms)  proof (KiB)  prove (ms)  '
+          'prove with tree (ms)  verify proof (ms)')
+    for size in sizes:
+        tree = HashedTree(make_value(size))
+        signed_item = get_signed_item(tree, public_key, private_key,
+                                      hash_version=2)
+        path = ('records', size // 2, 'title')
+        verified, verify_time = timed(verify_item, signed_item,
+                                      cache=None)
+        assert verified
+        proof, prove_time = timed(get_inclusion_proof, signed_item, path)
+        proof, tree_time = timed(get_inclusion_proof, signed_item, path, tree)
+        proof = json.loads(json.dumps(proof))
+        verified, proof_time = timed(verify_inclusion_proof, proof)
+        assert verified
+        print('%7d  %10.1f  %11.1f  %11.1f  %10.1f  %20.1f  %17.1f' % (
+            size, len(json.dumps(signed_item)) / 1024, verify_time,
+            len(json.dumps(proof)) / 1024, prove_time, tree_time,
+            proof_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Compares the throughput of verify_item with the cache of parsed public keys
+against the throughput when every public key has to be parsed (the cache is
+cleared before each item is verified). The items are signed by a small number
+of publishers, as happens when the same peers store values over and over.
+
+Run with: python -m benchmarks.key_cache
+"""
+import random
+import time
+from Crypto.PublicKey import RSA
+from p4p2p.dht.crypto import (get_signed_item, verify_item, key_cache_info,
+                              clear_key_cache)
+
+
+def make_items(publishers, count, rand):
+    """
+    Returns a list of count items each signed by one of the publishers (a
+    list of (public_key, private_key) tuples).
+    """
+    items = []
+    for i in range(count):
+        public_key, private_key = rand.choice(publishers)
+        item = {'value': 'item %d' % i, 'tags': ['a', 'b', 'c']}
+        items.append(get_signed_item(item, public_key, private_key))
+    return items
+
+
+def verify_all(items, cached):
+    """
+    Verifies the items and returns how long it took (in seconds).
+    """
+    start = time.perf_counter()
+    for item in items:
+        if not cached:
+            clear_key_cache()
+        assert verify_item(item, cache=None)
+    return time.perf_counter() - start
+
+
+def main(publishers=20, items=2000, key_size=2048):
+    rand = random.Random(42)
+    keys = []
+    for i in range(publishers):
+        key = RSA.generate(key_size)
+        keys.append((key.publickey().exportKey('PEM').decode('ascii'),
+                     key.exportKey('PEM').decode('ascii')))
+    signed_items = make_items(keys, items, rand)
+    print('%d items from %d publishers (%d bit keys)' % (
+        items, publishers, key_size))
+    print(' cache  verifies/s  hit rate')
+    for cached in (False, True):
+        clear_key_cache()
+        duration = verify_all(signed_items, cached)
+        print('%6s  %10.0f  %8.3f' % (
+            'on' if cached else 'off', items / duration,
+            key_cache_info()['verifiers']['hit_rate']))
+
+
+if __name__ == '__main__':
+    main()
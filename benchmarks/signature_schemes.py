@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Compares the RSA (2048 bit) and Ed25519 signature schemes: how many small
+items each can sign and verify per second and the size of their public keys,
+signatures and signed items.
+
+Run with: python -m benchmarks.signature_schemes
+"""
+import json
+import time
+from Crypto.PublicKey import ECC, RSA
+from p4p2p.dht.crypto import get_signed_item, verify_item
+
+
+def make_keys(scheme):
+    """
+    Returns a (public_key, private_key) tuple of PEM strings for the scheme.
+    """
+    if scheme == 'rsa':
+        key = RSA.generate(2048)
+        return (key.publickey().exportKey('PEM').decode('ascii'),
+                key.exportKey('PEM').decode('ascii'))
+    key = ECC.generate(curve='Ed25519')
+    return (key.public_key().export_key(format='PEM'),
+            key.export_key(format='PEM'))
+
+
+def rate(function, duration=1.0):
+    """
+    Returns how many times per second the function can be called.
+    """
+    calls = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        function()
+        calls += 1
+    return calls / (time.perf_counter() - start)
+
+
+def main():
+    item = {'name': 'value', 'count': 3, 'tags': ['a', 'b']}
+    print(' scheme  signs/s  verifies/s  public key  signature  item (bytes)')
+    for scheme in ('rsa', 'ed25519'):
+        public_key, private_key = make_keys(scheme)
+        signed_item = get_signed_item(item, public_key, private_key,
+                                      scheme=scheme)
+        signs = rate(lambda: get_signed_item(item, public_key, private_key,
+                                             scheme=scheme))
+        verifies = rate(lambda: verify_item(signed_item, cache=None))
+        print('%7s  %7.0f  %10.0f  %10d  %9d  %12d' % (
+            scheme, signs, verifies, len(public_key),
+            len(signed_item['_p4p2p']['signature']),
+            len(json.dumps(signed_item))))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Compares the throughput of verify_item with and without the cache of
+successful verifications when, as with replication, republishing and
+FIND_VALUE responses from different peers, each item arrives several times.
+
+Run with: python -m benchmarks.verification_cache
+"""
+import copy
+import random
+import time
+from Crypto.PublicKey import RSA
+from p4p2p.dht.crypto import (get_signed_item, verify_item,
+                              verification_cache)
+
+
+def main(items=500, arrivals=5, publishers=10):
+    rand = random.Random(42)
+    keys = []
+    for i in range(publishers):
+        key = RSA.generate(2048)
+        keys.append((key.publickey().exportKey('PEM').decode('ascii'),
+                     key.exportKey('PEM').decode('ascii')))
+    signed_items = []
+    for i in range(items):
+        public_key, private_key = keys[i % publishers]
+        item = {'value': 'item %d' % i, 'tags': ['a', 'b', 'c']}
+        signed_items.append(get_signed_item(item, public_key, private_key))
+    # Each arrival is a fresh (but identical) copy of the item, as if it had
+    # been decoded from a message.
+    received = [copy.deepcopy(item) for item in signed_items
+                for i in range(arrivals)]
+    rand.shuffle(received)
+    print('%d items each received %d times' % (items, arrivals))
+    print(' cache  verifies/s  hit rate')
+    for cache in (None, verification_cache):
+        verification_cache.clear()
+        start = time.perf_counter()
+        assert all(verify_item(item, cache=cache) for item in received)
+        rate = len(received) / (time.perf_counter() - start)
+        print('%6s  %10.0f  %8.3f' % ('off' if cache is None else 'on', rate,
+                                      verification_cache.info()['hit_rate']))
+
+
+if __name__ == '__main__':
+    main()
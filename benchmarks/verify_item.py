@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Compares the time taken and peak memory allocated by verify_item (which
+hashes the item in place) against the original implementation (which made a
+deep copy of the item just to remove the signature before hashing it) for
+items with thousands of nested entries.
+
+Run with: python -m benchmarks.verify_item
+"""
+import base64
+import copy
+import time
+import tracemalloc
+from functools import partial
+from Crypto.PublicKey import RSA
+from Crypto.Signature import PKCS1_v1_5
+from p4p2p.dht.crypto import get_signed_item, verify_item, _get_hash
+
+
+def deepcopy_verify_item(item):
+    """
+    The original implementation of verify_item.
+    """
+    item_no_sig = copy.deepcopy(item)
+    raw_sig = item_no_sig['_p4p2p']['signature']
+    signature = base64.decodebytes(raw_sig.encode('utf-8'))
+    public_key = RSA.importKey(item_no_sig['_p4p2p']['public_key'])
+    del item_no_sig['_p4p2p']['signature']
+    root_hash = _get_hash(item_no_sig)
+    verifier = PKCS1_v1_5.new(public_key)
+    return verifier.verify(root_hash, signature)
+
+
+def make_item(entries):
+    """
+    Returns an item with the given number of nested entries.
+    """
+    return {
+        'records': [{'id': i, 'name': 'record %d' % i, 'score': i / 7,
+                     'tags': ['x', 'y', i % 2 == 0]}
+                    for i in range(entries)],
+    }
+
+
+def measure(verify, item, repeat=3):
+    """
+    Returns the mean time (in seconds) taken to verify the item and the peak
+    memory (in bytes) allocated while verifying it.
+    """
+    assert verify(item)
+    tracemalloc.start()
+    verify(item)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    start = time.perf_counter()
+    for i in range(repeat):
+        verify(item)
+    return (time.perf_counter() - start) / repeat, peak
+
+
+def main(sizes=(1000, 5000)):
+    key = RSA.generate(2048)
+    public_key = key.publickey().exportKey('PEM').decode('ascii')
+    private_key = key.exportKey('PEM').decode('ascii')
+    print(' entries  implementation  time (ms)  peak memory (KiB)')
+    for size in sizes:
+        item = get_signed_item(make_item(size), public_key, private_key,
+                               hash_version=1)
+        for name, verify in (('deepcopy', deepcopy_verify_item),
+                             ('in place', partial(verify_item, cache=None))):
+            duration, peak = measure(verify, item)
+            print('%8d  %14s  %9.1f  %17.1f' % (size, name, duration * 1000,
+                                                peak / 1024))
+
+
+if __name__ == '__main__':
+    main()
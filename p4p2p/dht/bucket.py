@@ -3,9 +3,23 @@
 Buckets in the routing table that contain peer nodes.
 """
 
+from collections import OrderedDict
+from itertools import islice
 from .constants import K
 
 
+def _key(network_id):
+    """
+    Returns the integer form of a network_id expressed as a hex string, an
+    integer or a PeerNode.
+    """
+    if isinstance(network_id, str):
+        return int(network_id, 0)
+    elif isinstance(network_id, int):
+        return network_id
+    return network_id.network_id_int
+
+
 class BucketFull(Exception):
     """ Raised when the bucket is full. """
     pass
@@ -39,8 +53,14 @@ class Bucket(object):
         """
         self.range_min = range_min
         self.range_max = range_max
-        # Holds the contacts contained within the bucket.
-        self._contacts = []
+        # Holds the contacts contained within the bucket keyed by the integer
+        # form of their network_id. The ordering of the dictionary is the
+        # order in which the contacts were last seen (least-recently seen at
+        # the head, most-recently seen at the tail).
+        self._contacts = OrderedDict()
+        # Holds contacts eligible to replace stale contacts in the bucket,
+        # keyed and ordered in the same way as _contacts.
+        self._replacement_cache = OrderedDict()
         # Indicates when the bucket was last accessed. Used to make sure the
         # bucket doesn't become stale and out of date given changing
         # conditions in the network of contacts.
@@ -49,28 +69,41 @@ class Bucket(object):
     def add_contact(self, contact):
         """
         Adds a contact to the bucket. If this is a new contact then it will
-        be appended to the _contacts list. If the contact is already in the
-        bucket then it is moved to the end of the _contacts list. The most
-        recently seen contact is always at the end of the _contacts list. If
-        the size of the bucket exceeds the constant k then a BucketFull
-        exception is raised.
-        """
-        if contact in self._contacts:
-            self._contacts.remove(contact)
-            self._contacts.append(contact)
+        be appended to the end of the _contacts. If the contact is already in
+        the bucket then it is moved to the end of the _contacts. The most
+        recently seen contact is always at the end of the _contacts. If the
+        size of the bucket exceeds the constant k then a BucketFull exception
+        is raised.
+
+        If an existing contact is replaced by a new instance with no round
+        trip time estimate then the existing estimate (and timeout backoff)
+        is kept.
+        """
+        key = contact.network_id_int
+        if key in self._contacts:
+            old_contact = self._contacts[key]
+            if contact.srtt is None:
+                # Keep what is known about the peer's round trip time.
+                contact.srtt = old_contact.srtt
+                contact.rttvar = old_contact.rttvar
+                contact.timeouts = old_contact.timeouts
+            self._contacts[key] = contact
+            self._contacts.move_to_end(key)
         elif len(self._contacts) < K:
-            self._contacts.append(contact)
+            self._contacts[key] = contact
         else:
             raise BucketFull("No space in bucket to insert contact.")
 
     def get_contact(self, network_id):
         """
-        Returns a contact stored in the bucket with the given network_id. Will
-        raise a ValueError if the contact is not in the bucket (the default
-        behaviour of calling ``index`` with a value that's not in the list).
+        Returns a contact stored in the bucket with the given network_id
+        (expressed as a hex string, an integer or a PeerNode). Will raise a
+        ValueError if the contact is not in the bucket.
         """
-        index = self._contacts.index(network_id)
-        return self._contacts[index]
+        try:
+            return self._contacts[_key(network_id)]
+        except KeyError:
+            raise ValueError('Contact not in bucket.')
 
     def get_contacts(self, count=0, exclude_contact=None):
         """
@@ -83,26 +116,75 @@ class Bucket(object):
         str) then, if this is found within the list of returned values, it
         will be discarded before the result is returned.
         """
-        current_len = len(self._contacts)
         if count <= 0:
-            count = current_len
-
-        if not self._contacts:
-            contact_list = []
-        elif current_len < count:
-            contact_list = self._contacts[:current_len]
-        else:
-            contact_list = self._contacts[:count]
-
-        if exclude_contact in contact_list:
-            contact_list.remove(exclude_contact)
+            count = len(self._contacts)
+        contact_list = list(islice(self._contacts.values(), count))
+        if exclude_contact is not None:
+            key = _key(exclude_contact)
+            contact_list = [c for c in contact_list
+                            if c.network_id_int != key]
         return contact_list
 
     def remove_contact(self, network_id):
         """
-        Removes a contact with the given network_id from the bucket.
+        Removes a contact with the given network_id from the bucket. Will
+        raise a ValueError if the contact is not in the bucket.
+        """
+        try:
+            del self._contacts[_key(network_id)]
+        except KeyError:
+            raise ValueError('Contact not in bucket.')
+
+    def add_replacement(self, contact):
+        """
+        Adds a contact to the bucket's replacement cache (contacts that may
+        replace stale entries in the bucket). If the contact is already in the
+        cache then it is moved to the end (the most recently seen position).
+        The cache holds at most K contacts: if it is full then the least
+        recently seen contact is discarded.
+        """
+        key = contact.network_id_int
+        if key in self._replacement_cache:
+            self._replacement_cache.move_to_end(key)
+        elif len(self._replacement_cache) >= K:
+            self._replacement_cache.popitem(last=False)
+        self._replacement_cache[key] = contact
+
+    def get_replacements(self):
+        """
+        Returns a list of the contacts in the replacement cache ordered from
+        least to most recently seen.
+        """
+        return list(self._replacement_cache.values())
+
+    def remove_replacement(self, network_id):
+        """
+        Removes the contact with the given network_id from the replacement
+        cache (if it is there).
+        """
+        self._replacement_cache.pop(_key(network_id), None)
+
+    def pop_replacement(self):
+        """
+        Removes and returns the most recently seen contact in the replacement
+        cache. Returns None if the replacement cache is empty.
+        """
+        if self._replacement_cache:
+            return self._replacement_cache.popitem()[1]
+        return None
+
+    def copy(self):
+        """
+        Returns a new bucket covering the same range with the same contacts,
+        replacement cache and last_accessed timestamp. Changes made to the
+        copy do not affect this bucket (although the PeerNode instances are
+        shared).
         """
-        self._contacts.remove(network_id)
+        bucket = Bucket(self.range_min, self.range_max)
+        bucket._contacts = self._contacts.copy()
+        bucket._replacement_cache = self._replacement_cache.copy()
+        bucket.last_accessed = self.last_accessed
+        return bucket
 
     def key_in_range(self, key):
         """
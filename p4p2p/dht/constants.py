@@ -11,12 +11,30 @@ ALPHA = 3
 #: The maximum number of contacts stored in a bucket. Must be an even number.
 K = 20
 
+#: The number of bits of a key resolved by each step of a lookup (the symbol
+#: size "b" described in section 4.2 of the Kademlia paper). Values greater
+#: than 1 make lookups take fewer hops at the expense of a larger routing
+#: table.
+B = 1
+
 #: The default maximum time a NodeLookup is allowed to take (in seconds).
 LOOKUP_TIMEOUT = 600
 
-#: The timeout for network connections (in seconds).
+#: The timeout for network connections (in seconds). Also the longest
+#: adaptive timeout given to a peer (see PeerNode.rpc_timeout).
 RPC_TIMEOUT = 5
 
+#: The shortest adaptive timeout given to a peer (in seconds).
+RPC_TIMEOUT_MIN = 0.2
+
+#: The adaptive timeout given to a peer whose round trip time isn't yet known
+#: (in seconds). The same as the initial retransmission timeout of TCP.
+RPC_TIMEOUT_INITIAL = 1
+
+#: The number of round trip time variations added to a peer's smoothed round
+#: trip time to give its adaptive timeout (as for TCP, see RFC 6298).
+RPC_TIMEOUT_K = 4
+
 #: The timeout for receiving complete message once a connection is made (in
 #: seconds). Ensures there are no stale deferreds in the node's _pending
 #: dictionary.
@@ -25,6 +43,11 @@ RESPONSE_TIMEOUT = 1800  # half an hour
 #: How long to wait before an unused bucket is refreshed (in seconds).
 REFRESH_TIMEOUT = 3600  # 1 hour
 
+#: The maximum random delay (in seconds) added to the time a bucket is next
+#: due to be refreshed. Stops nodes that started at the same time from all
+#: refreshing their buckets at once.
+REFRESH_JITTER = int(REFRESH_TIMEOUT / 12)  # Up to 5 minutes.
+
 #: How long to wait before a node replicates any data it stores (in seconds).
 REPLICATE_INTERVAL = REFRESH_TIMEOUT
 
@@ -36,6 +59,18 @@ REFRESH_INTERVAL = int(REFRESH_TIMEOUT / 6)  # Every 10 minutes.
 #: is equalled or exceeded then the contact is removed from the routing table.
 ALLOWED_RPC_FAILS = 5
 
+#: The maximum number of public keys whose network IDs are remembered (so the
+#: SHA512 of a peer's public key isn't recalculated for every message).
+NETWORK_ID_CACHE_SIZE = 10000
+
+#: The maximum number of parsed RSA keys (and the signers or verifiers made
+#: from them) that are remembered so keys aren't parsed for every signature.
+KEY_CACHE_SIZE = 4096
+
+#: The maximum number of successfully verified signatures that are
+#: remembered so items that arrive again aren't verified again.
+VERIFICATION_CACHE_SIZE = 20000
+
 #: The number of nodes to attempt to use to store a value in the network.
 DUPLICATION_COUNT = K
 
@@ -2,14 +2,60 @@
 """
 Defines a peer node on the network.
 """
+from functools import lru_cache
 from hashlib import sha512
+from sys import intern
+from .constants import (NETWORK_ID_CACHE_SIZE, RPC_TIMEOUT, RPC_TIMEOUT_MIN,
+                        RPC_TIMEOUT_INITIAL, RPC_TIMEOUT_K)
+
+#: The weights given to each new round trip time when updating the smoothed
+#: round trip time (alpha) and its variation (beta) as recommended by RFC
+#: 6298.
+RTT_ALPHA = 1 / 8
+RTT_BETA = 1 / 4
+
+
+@lru_cache(maxsize=NETWORK_ID_CACHE_SIZE)
+def get_network_id(public_key):
+    """
+    Returns the network id (as an integer) derived from the public key: the
+    SHA512 of the key.
+
+    The results for the most recently used public keys are cached (use
+    get_network_id.cache_info() to see the number of hits and misses).
+    """
+    digest = sha512(public_key.encode('ascii')).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def is_valid_network_id(public_key, network_id):
+    """
+    Returns a boolean to indicate if the network id (expressed as a hex
+    string or an integer) claimed by a peer matches its public key.
+    """
+    if isinstance(network_id, str):
+        try:
+            network_id = int(network_id, 0)
+        except ValueError:
+            return False
+    return get_network_id(public_key) == network_id
 
 
 class PeerNode(object):
     """
     Represents another node on the network.
+
+    There may be tens of thousands of PeerNode instances so they are kept
+    compact: attributes are stored in slots (rather than a per-instance
+    __dict__), the network id is stored as an integer (the hex string and raw
+    bytes forms are derived from it when needed) and public keys are
+    interned so all the contacts for a peer share the same string.
     """
 
+    __slots__ = ('network_id_int', '_network_id', 'public_key', 'ip_address',
+                 'port', 'version', 'last_seen', 'failed_RPCs', 'srtt',
+                 'rttvar', 'timeouts')
+
     def __init__(self, public_key, ip_address, port, version, last_seen=0):
         """
         Initialise the peer node with a unique id within the network (derived
@@ -20,8 +66,11 @@ class PeerNode(object):
         The network id is created as the hexdigest of the SHA512 of the public
         key.
         """
-        hex_digest = sha512(public_key.encode('ascii')).hexdigest()
-        self.network_id = '0x' + hex_digest
+        public_key = intern(public_key)
+        self.network_id_int = get_network_id(public_key)
+        # Only set if the network id was set from a hex string that isn't in
+        # the canonical form (see the network_id property).
+        self._network_id = None
         self.public_key = public_key
         self.ip_address = ip_address
         self.port = port
@@ -31,16 +80,100 @@ class PeerNode(object):
         # If this number reaches a threshold then it is evicted from a
         # bucket and replaced with another node that is more reliable.
         self.failed_RPCs = 0
+        # The smoothed round trip time of RPCs to this peer and its variation
+        # (in seconds). Both are None until the first round trip time is
+        # recorded.
+        self.srtt = None
+        self.rttvar = None
+        # The number of consecutive RPCs to this peer that have timed out.
+        # Each doubles the peer's adaptive timeout (see rpc_timeout).
+        self.timeouts = 0
+
+    @property
+    def network_id(self):
+        """
+        The hex string representation of the contact's network id. Unless it
+        was set from a different hex string this is the canonical form: "0x"
+        followed by the 128 (zero padded) hex digits of the SHA512 digest.
+        """
+        if self._network_id is None:
+            return '0x%0128x' % self.network_id_int
+        return self._network_id
+
+    @network_id.setter
+    def network_id(self, value):
+        """
+        Sets the network id from a hex string representation.
+        """
+        network_id_int = int(value, 0)
+        self.network_id_int = network_id_int
+        if value == '0x%0128x' % network_id_int:
+            self._network_id = None
+        else:
+            self._network_id = value
+
+    @property
+    def network_id_bytes(self):
+        """
+        The network id as 64 raw (big endian) bytes.
+        """
+        return self.network_id_int.to_bytes(64, 'big')
+
+    def record_rtt(self, rtt):
+        """
+        Updates the smoothed round trip time and its variation with the round
+        trip time (in seconds) of a successful RPC to this peer. Uses the
+        method for estimating the round trip time of a TCP connection
+        described in RFC 6298. Also resets the peer's timeout backoff.
+        """
+        self.timeouts = 0
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = ((1 - RTT_BETA) * self.rttvar +
+                           RTT_BETA * abs(self.srtt - rtt))
+            self.srtt = (1 - RTT_ALPHA) * self.srtt + RTT_ALPHA * rtt
+
+    def rpc_timeout(self, maximum=RPC_TIMEOUT, minimum=RPC_TIMEOUT_MIN):
+        """
+        Returns how long (in seconds) to wait for this peer to respond to an
+        RPC. As for TCP (RFC 6298) this is the smoothed round trip time plus
+        RPC_TIMEOUT_K times its variation (but no less than the minimum) or
+        RPC_TIMEOUT_INITIAL if no round trip time has been recorded, doubled
+        for each consecutive timeout. The result is never more than the
+        maximum.
+        """
+        if self.srtt is None:
+            timeout = RPC_TIMEOUT_INITIAL
+        else:
+            timeout = max(self.srtt + RPC_TIMEOUT_K * self.rttvar, minimum)
+        return min(timeout * 2 ** self.timeouts, maximum)
+
+    def record_timeout(self, maximum=RPC_TIMEOUT, minimum=RPC_TIMEOUT_MIN):
+        """
+        Records that an RPC to this peer timed out (having waited for
+        rpc_timeout with the same arguments) so the next RPC waits twice as
+        long. Returns a boolean to indicate if the timeout should count as a
+        failed RPC: only once the peer has been given the maximum time to
+        respond.
+        """
+        if self.rpc_timeout(maximum, minimum) >= maximum:
+            return True
+        self.timeouts += 1
+        return False
 
     def __eq__(self, other):
         """
-        Override equals to work with a string representation of the contact's
-        id.
+        Override equals to work with a string (or integer) representation of
+        the contact's id.
         """
         if isinstance(other, PeerNode):
-            return self.network_id == other.network_id
+            return self.network_id_int == other.network_id_int
         elif isinstance(other, str):
             return self.network_id == other
+        elif isinstance(other, int):
+            return self.network_id_int == other
         else:
             return False
 
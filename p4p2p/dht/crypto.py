@@ -2,17 +2,447 @@
 """
 Functions for signing and verifying items sent between peers. Items are
 represented by dict objects.
+
+There are two versions of the canonical hash that is signed. Version 1 (the
+original, see _get_hash) is recursive and hashes strings of hex digests.
+Version 2 (see _get_hash_v2) is iterative, hashes length prefixed binary
+encodings and hashes the entries of each container as a binary Merkle tree.
+Items signed with version 2 say so in their metadata. A HashedTree keeps the
+version 2 digest of every part of an item so only the changed parts are
+hashed again when the item is updated and re-signed.
+Inclusion proofs (see get_inclusion_proof) allow part of a version 2 item to
+be verified against the item's signature without the rest of the item.
+
+The canonical hash is signed with one of the SCHEMES of signature: RSA (with
+PKCS1_v1_5, the original and default scheme) or Ed25519 (much faster, with
+much smaller keys and signatures). Items signed with a scheme other than RSA
+say so in their metadata. A Signer signs many items with the same keys.
 """
+import os
 import time
 import base64
-import copy
+import bisect
+import threading
+from collections import OrderedDict
+from concurrent.futures import (ProcessPoolExecutor, Future, wait,
+                                FIRST_COMPLETED)
+from functools import lru_cache
+from itertools import islice
+from hashlib import sha512
 from Crypto.Hash import SHA512
-from Crypto.Signature import PKCS1_v1_5
-from Crypto.PublicKey import RSA
+from Crypto.Signature import PKCS1_v1_5, eddsa
+from Crypto.PublicKey import ECC, RSA
 from ..version import get_version
+from .constants import KEY_CACHE_SIZE, VERIFICATION_CACHE_SIZE
+try:
+    # Optional: much faster Ed25519 signatures (backed by OpenSSL).
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives.serialization import (
+        load_pem_private_key, load_pem_public_key)
+    from cryptography.hazmat.primitives.asymmetric import ed25519
+except ImportError:  # pragma: no cover
+    ed25519 = None
+
+#: The version of the canonical hash used to sign new items (by default).
+#: Version 1 is kept until the nodes that can only verify version 1 items
+#: have been upgraded.
+HASH_VERSION = 1
+
+#: The versions of the canonical hash of items that can be verified.
+SUPPORTED_HASH_VERSIONS = (1, 2)
+
+
+class SignatureScheme(object):
+    """
+    Base class for the schemes used to sign the canonical hash of items.
+    Implementations should set the name (recorded in the metadata of items
+    signed with the scheme) and override the get_signer and get_verifier
+    methods.
+
+    A signer has a sign(root_hash) method that returns the signature (bytes)
+    of the root hash (a SHA512 object). A verifier has a verify(root_hash,
+    signature) method that returns a boolean to indicate if the signature is
+    valid.
+    """
+
+    name = None
+
+    def get_signer(self, private_key):
+        """
+        Returns a signer for the private key (a PEM string).
+        """
+        raise NotImplementedError('get_signer needs implementing.')
+
+    def get_verifier(self, public_key):
+        """
+        Returns a verifier for the public key (a PEM string).
+        """
+        raise NotImplementedError('get_verifier needs implementing.')
+
+
+class RSAScheme(SignatureScheme):
+    """
+    RSA signatures (using PKCS1_v1_5) of the SHA512 root hash.
+    """
+
+    name = 'rsa'
+
+    def get_signer(self, private_key):
+        return PKCS1_v1_5.new(RSA.importKey(private_key))
+
+    def get_verifier(self, public_key):
+        return PKCS1_v1_5.new(RSA.importKey(public_key))
+
+
+class Ed25519Signer(object):
+    """
+    Signs (and verifies) the digest of root hashes with an Ed25519 key (as
+    described in RFC 8032) using PyCryptodome.
+    """
+
+    def __init__(self, key):
+        self._scheme = eddsa.new(key, 'rfc8032')
+
+    def sign(self, root_hash):
+        return self._scheme.sign(root_hash.digest())
+
+    def verify(self, root_hash, signature):
+        try:
+            self._scheme.verify(root_hash.digest(), signature)
+        except ValueError:
+            return False
+        return True
+
+
+class FastEd25519Signer(object):
+    """
+    Signs (and verifies) the digest of root hashes with an Ed25519 key using
+    the cryptography package (if it is installed).
+    """
+
+    def __init__(self, key):
+        self._key = key
+
+    def sign(self, root_hash):
+        return self._key.sign(root_hash.digest())
+
+    def verify(self, root_hash, signature):
+        try:
+            self._key.verify(signature, root_hash.digest())
+        except InvalidSignature:
+            return False
+        return True
+
+
+class Ed25519Scheme(SignatureScheme):
+    """
+    Ed25519 signatures of the (64 byte) digest of the SHA512 root hash. Uses
+    the cryptography package if it is installed (it is many times faster),
+    otherwise PyCryptodome. Both give the same signatures.
+    """
+
+    name = 'ed25519'
+
+    def __init__(self, fast=ed25519 is not None):
+        """
+        The fast flag indicates if the cryptography package should be used.
+        """
+        self.fast = fast
+
+    def _import_key(self, encoded, private):
+        """
+        Returns the public or private key parsed from the encoded (PEM)
+        string. Raises a ValueError if it isn't an Ed25519 key.
+        """
+        if self.fast:
+            if private:
+                key = load_pem_private_key(encoded.encode('ascii'), None)
+                key_type = ed25519.Ed25519PrivateKey
+            else:
+                key = load_pem_public_key(encoded.encode('ascii'))
+                key_type = ed25519.Ed25519PublicKey
+            if not isinstance(key, key_type):
+                raise ValueError('Not an Ed25519 key.')
+            return FastEd25519Signer(key)
+        key = ECC.import_key(encoded)
+        if key.curve != 'Ed25519' or key.has_private() != private:
+            raise ValueError('Not an Ed25519 key.')
+        return Ed25519Signer(key)
+
+    def get_signer(self, private_key):
+        return self._import_key(private_key, True)
+
+    def get_verifier(self, public_key):
+        return self._import_key(public_key, False)
+
+
+#: The schemes of signature that can be used to sign and verify items, keyed
+#: by the name recorded in their metadata.
+SCHEMES = dict((scheme.name, scheme) for scheme in
+               (RSAScheme(), Ed25519Scheme()))
+
+#: The scheme used to sign items if no other scheme is given (and of items
+#: whose metadata doesn't name a scheme).
+DEFAULT_SCHEME = 'rsa'
+
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def _get_signer(private_key, scheme=DEFAULT_SCHEME):
+    """
+    Returns a signer for the private key using the named scheme. The signers
+    for the most recently used keys are cached so each key is only parsed
+    once.
+    """
+    return SCHEMES[scheme].get_signer(private_key)
+
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def _get_verifier(public_key, scheme=DEFAULT_SCHEME):
+    """
+    Returns a verifier for the public key using the named scheme. The
+    verifiers for the most recently used keys are cached so each key is only
+    parsed once.
+    """
+    return SCHEMES[scheme].get_verifier(public_key)
+
+
+def key_cache_info():
+    """
+    Returns a dict containing the number of hits and misses, the current and
+    maximum size and the hit rate of the caches of signers (keyed by private
+    key and scheme) and verifiers (keyed by public key and scheme).
+    """
+    info = {}
+    for name, cached in (('signers', _get_signer),
+                         ('verifiers', _get_verifier)):
+        hits, misses, maxsize, currsize = cached.cache_info()
+        total = hits + misses
+        info[name] = {
+            'hits': hits,
+            'misses': misses,
+            'size': currsize,
+            'maxsize': maxsize,
+            'hit_rate': hits / total if total else 0.0,
+        }
+    return info
+
+
+def clear_key_cache():
+    """
+    Empties the caches of signers and verifiers (and resets their stats).
+    """
+    _get_signer.cache_clear()
+    _get_verifier.cache_clear()
 
 
-def get_signed_item(item, public_key, private_key, expires=None):
+class VerificationCache(object):
+    """
+    Remembers the most recently used (up to maxsize) successful
+    verifications so an identical item that arrives again (through
+    replication, republishing or FIND_VALUE responses) only needs to be
+    hashed, not verified. Each verification is keyed by the scheme, public
+    key and signature of the item along with the digest of the item's root
+    hash. Safe to share between threads.
+
+    Verifications are stored by signature (the digest is the value) so the
+    digest of an item verified with a signature can be found without
+    hashing (see get_digest).
+    """
+
+    def __init__(self, maxsize=VERIFICATION_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._verified = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        """
+        Returns a boolean to indicate if the key (a (scheme, public_key,
+        signature, digest) tuple) is of a verification that succeeded
+        (counting a hit or miss).
+        """
+        with self._lock:
+            signature_key = key[:3]
+            if self._verified.get(signature_key) == key[3]:
+                self._verified.move_to_end(signature_key)
+                self.hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def get_digest(self, signature_key):
+        """
+        Returns the digest of the item that was verified with the
+        signature_key (a (scheme, public_key, signature) tuple) or None if
+        there isn't one. Doesn't count a hit or miss.
+        """
+        with self._lock:
+            return self._verified.get(signature_key)
+
+    def add(self, key):
+        """
+        Remembers that the verification with the given key (a (scheme,
+        public_key, signature, digest) tuple) succeeded. The least recently
+        used verification is forgotten if the cache is full.
+        """
+        with self._lock:
+            signature_key = key[:3]
+            self._verified[signature_key] = key[3]
+            self._verified.move_to_end(signature_key)
+            if len(self._verified) > self.maxsize:
+                self._verified.popitem(last=False)
+
+    def clear(self):
+        """
+        Forgets all the verifications (and resets the stats).
+        """
+        with self._lock:
+            self._verified.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        """
+        Returns a dict containing the number of hits and misses, the current
+        and maximum size and the hit rate of the cache.
+        """
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._verified),
+                'maxsize': self.maxsize,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+
+#: The cache of successful verifications used by verify_item.
+verification_cache = VerificationCache()
+
+
+class Signer(object):
+    """
+    Signs items with a key pair. The private key is parsed and the metadata
+    common to every item (the p4p2p version, public key, scheme and hash
+    version) is prepared only once, so a Signer is the quickest way to sign
+    many items (see sign_items).
+    """
+
+    def __init__(self, public_key, private_key, hash_version=HASH_VERSION,
+                 scheme=DEFAULT_SCHEME):
+        """
+        The keys, hash_version and scheme are as described for
+        get_signed_item. Raises a ValueError if the hash_version or scheme
+        isn't supported.
+        """
+        if scheme not in SCHEMES:
+            raise ValueError('Unsupported signature scheme.')
+        if hash_version not in (1, 2):
+            raise ValueError('Unsupported hash version.')
+        self.public_key = public_key
+        self.private_key = private_key
+        self.hash_version = hash_version
+        self.scheme = scheme
+        self._signer = _get_signer(private_key, scheme)
+        self._metadata = {
+            'version': get_version(),
+            'public_key': public_key,
+        }
+        if scheme != DEFAULT_SCHEME:
+            self._metadata['scheme'] = scheme
+        if hash_version != 1:
+            self._metadata['hash_version'] = hash_version
+
+    def sign(self, item, expires=None, timestamp=None):
+        """
+        Returns a signed copy of the item (a dict or HashedTree) as described
+        for get_signed_item. The timestamp defaults to the current time.
+        """
+        tree = None
+        if isinstance(item, HashedTree):
+            tree = item
+            item = tree.value
+        signed_item = item.copy()
+        if timestamp is None:
+            timestamp = time.time()
+        expires_at = 0.0  # it's a float, dammit
+        t = type(expires)
+        if expires and (t == int or t == float) and expires > 0:
+            expires_at = timestamp + expires
+        metadata = {
+            'timestamp': timestamp,
+            'expires': expires_at,
+        }
+        metadata.update(self._metadata)
+        signed_item['_p4p2p'] = metadata
+        if self.hash_version == 1:
+            root_hash = _get_hash(signed_item)
+        elif tree is None:
+            root_hash = _get_hash_v2(signed_item)
+        else:
+            root_hash = tree.root_hash({'_p4p2p': metadata})
+        sig = base64.encodebytes(self._signer.sign(root_hash)).decode('utf-8')
+        metadata['signature'] = sig
+        return signed_item
+
+    def sign_items(self, items, expires=None, executor=None, chunksize=64,
+                   max_pending=None, timestamp=None):
+        """
+        Signs the items (an iterable of dicts or HashedTrees). Returns an
+        iterator of the signed items in the same order. Every item in the
+        batch is given the same timestamp (by default the time sign_items
+        was called) and expiry.
+
+        If an executor (a concurrent.futures.Executor, such as a process
+        pool) is given then the items are sent to it to be signed in chunks
+        of chunksize items, with no more than max_pending chunks (by default
+        twice the number of CPUs) waiting to be signed at a time. Otherwise
+        they are signed (as they are needed) in this process.
+
+        Raises a TypeError if items isn't iterable or a ValueError if
+        chunksize or max_pending is less than 1 (straight away, rather than
+        when the first signed item is taken).
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        items = iter(items)
+        if chunksize < 1:
+            raise ValueError('The chunksize must be at least 1.')
+        if max_pending is not None and max_pending < 1:
+            raise ValueError('max_pending must be at least 1.')
+        if executor is None:
+            return (self.sign(item, expires, timestamp) for item in items)
+        return self._sign_items(items, expires, executor, chunksize,
+                                max_pending, timestamp)
+
+    def _sign_items(self, items, expires, executor, chunksize, max_pending,
+                    timestamp):
+        """
+        Yields the items signed by the executor (see sign_items).
+        """
+        args = (self.public_key, self.private_key, self.hash_version,
+                self.scheme, expires, timestamp)
+        for chunk, future in _submit_chunks(executor, _sign_chunk, items,
+                                            chunksize, max_pending,
+                                            args=args):
+            for signed_item in future.result():
+                yield signed_item
+
+
+def _sign_chunk(chunk, public_key, private_key, hash_version, scheme,
+                expires, timestamp):
+    """
+    Returns a list of the items in the chunk signed with the same timestamp
+    (run in the workers used by Signer.sign_items).
+    """
+    signer = Signer(public_key, private_key, hash_version, scheme)
+    return [signer.sign(item, expires, timestamp) for item in chunk]
+
+
+def get_signed_item(item, public_key, private_key, expires=None,
+                    hash_version=HASH_VERSION, scheme=DEFAULT_SCHEME):
     """
     Returns a copy of the passed in item that has been signed using the
     private_key and annotated with metadata under the "_p4p2p" key (a
@@ -23,44 +453,225 @@ def get_signed_item(item, public_key, private_key, expires=None):
     The expiration timestamp is derived by adding the (optional) expires
     number of seconds to the timestamp. If no expiration is specified then the
     "expires" value is set to 0.0 (expiration is expressed as a float).
+
+    The hash_version is the version of the canonical hash that is signed. For
+    version 2 (and later) it is recorded as "hash_version" in the metadata.
+    Version 1 items have no such entry (so older nodes can verify them).
+
+    The scheme is the name of the scheme of signature to use (see SCHEMES)
+    and the keys must be of the matching type. Unless it is the default
+    (RSA) it is recorded as "scheme" in the metadata.
+
+    The item may be a HashedTree, in which case its value is signed reusing
+    the digests it holds (for version 2 of the canonical hash).
+
+    To sign many items with the same keys use a Signer.
     """
-    signed_item = item.copy()
-    timestamp = time.time()
-    expires_at = 0.0  # it's a float, dammit
-    t = type(expires)
-    if expires and (t == int or t == float) and expires > 0:
-        expires_at = timestamp + expires
-    signed_item['_p4p2p'] = {
-        'timestamp': timestamp,
-        'expires': expires_at,
-        'version': get_version(),
-        'public_key': public_key
-    }
-    root_hash = _get_hash(signed_item)
-    key = RSA.importKey(private_key)
-    signer = PKCS1_v1_5.new(key)
-    sig = base64.encodebytes(signer.sign(root_hash)).decode('utf-8')
-    signed_item['_p4p2p']['signature'] = sig
-    return signed_item
+    signer = Signer(public_key, private_key, hash_version, scheme)
+    return signer.sign(item, expires)
+
+
+def verify_item(item, hash_versions=SUPPORTED_HASH_VERSIONS,
+                cache=verification_cache):
+    """
+    Returns a boolean to indicate if the message can be verified. Items
+    signed with a version of the canonical hash not in hash_versions are not
+    verified.
+
+    Successful verifications are remembered in the cache (a
+    VerificationCache) so an identical item is only hashed the next time it
+    is verified. Pass None to always verify the signature.
+    """
+    digest = None
+    if cache is not None:
+        try:
+            signature_key = _get_signature_key(item)
+        except Exception:
+            return False
+        digest = cache.get_digest(signature_key)
+    verified, digest = _verify_digest(item, hash_versions, digest)
+    if cache is not None:
+        _remember(cache, signature_key, digest, verified)
+    return verified
 
 
-def verify_item(item):
+def _get_signature_key(item):
     """
-    Returns a boolean to indicate if the message can be verified.
+    Returns the (scheme, public_key, signature) tuple of the item: the part
+    of the key of its verification in a VerificationCache that doesn't need
+    the item to be hashed.
+    """
+    metadata = item['_p4p2p']
+    return (metadata.get('scheme', DEFAULT_SCHEME), metadata['public_key'],
+            metadata['signature'])
+
+
+def _verify_digest(item, hash_versions=SUPPORTED_HASH_VERSIONS, digest=None):
+    """
+    Returns a (verified, digest) tuple for the item: a boolean to indicate if
+    it can be verified and the digest of its (unsigned) root hash (or None
+    if it can't be hashed). If the item's digest is the given digest (of an
+    item already verified with the same signature) then the signature isn't
+    checked again.
     """
     try:
-        item_no_sig = copy.deepcopy(item)
-        raw_sig = item_no_sig['_p4p2p']['signature']
+        metadata = item['_p4p2p']
+        if metadata.get('hash_version', 1) not in hash_versions:
+            return False, None
+        raw_sig = metadata['signature']
         signature = base64.decodebytes(raw_sig.encode('utf-8'))
-        public_key = RSA.importKey(item_no_sig['_p4p2p']['public_key'])
-        del item_no_sig['_p4p2p']['signature']
-        root_hash = _get_hash(item_no_sig)
-        verifier = PKCS1_v1_5.new(public_key)
-        return verifier.verify(root_hash, signature)
+        scheme = metadata.get('scheme', DEFAULT_SCHEME)
+        public_key = metadata['public_key']
+        root_hash = _get_unsigned_hash(item)
+        item_digest = root_hash.digest()
+        if digest is not None and item_digest == digest:
+            return True, item_digest
+        verifier = _get_verifier(public_key, scheme)
+        return verifier.verify(root_hash, signature), item_digest
     except:
         # TODO: do something with this..? (Probably not - tbc)
         pass
-    return False
+    return False, None
+
+
+def _remember(cache, signature_key, digest, verified):
+    """
+    Counts a hit or miss in the cache for the item with the signature_key
+    and digest (if it could be hashed) and, if it was verified, remembers
+    the verification.
+    """
+    if digest is None:
+        return
+    key = signature_key + (digest, )
+    if key not in cache and verified:
+        cache.add(key)
+
+
+def _verify_chunk(chunk):
+    """
+    Returns a list of (verified, digest) tuples (see _verify_digest) for the
+    (item, digest) tuples in the chunk (run in the workers used by
+    verify_items, which deals with the cache).
+    """
+    return [_verify_digest(item, digest=digest) for item, digest in chunk]
+
+
+def _submit_chunks(executor, function, items, chunksize, max_pending=None,
+                   ordered=True, args=(), prepare=None):
+    """
+    Submits the items (an iterable) to the executor in chunks of chunksize
+    items, each to be passed to the function (followed by the args). Returns
+    an iterator of (chunk, future) tuples in the order the chunks were
+    submitted if ordered is True, otherwise as each chunk completes.
+
+    If prepare is given it is called with each chunk and returns a
+    (context, work) tuple: only the work (a list) is submitted and the
+    context is returned in place of the chunk. Empty work isn't submitted.
+
+    The items are read and submitted as results are taken, with no more than
+    max_pending chunks (by default twice the number of CPUs) pending at a
+    time, so a large batch isn't held in memory all at once. Pending chunks
+    are cancelled if the iterator is closed early.
+    """
+    if max_pending is None:
+        max_pending = 2 * (os.cpu_count() or 1)
+    items = iter(items)
+    # Maps each pending future to its chunk (in the order submitted).
+    pending = OrderedDict()
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < max_pending:
+                chunk = list(islice(items, chunksize))
+                if not chunk:
+                    exhausted = True
+                    break
+                if prepare is None:
+                    context, work = chunk, chunk
+                else:
+                    context, work = prepare(chunk)
+                if work:
+                    future = executor.submit(function, work, *args)
+                else:
+                    future = Future()
+                    future.set_result([])
+                pending[future] = context
+            if not pending:
+                return
+            if ordered:
+                future, chunk = pending.popitem(last=False)
+                yield chunk, future
+            else:
+                done = wait(pending, return_when=FIRST_COMPLETED)[0]
+                for future in [f for f in pending if f in done]:
+                    yield pending.pop(future), future
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def verify_items(items, executor=None, ordered=True, chunksize=64,
+                 max_pending=None, cache=verification_cache):
+    """
+    Verifies the items (an iterable) in parallel. Returns an iterator of
+    (item, verified) tuples where verified is the boolean verify_item would
+    return for the item.
+
+    The items are verified in chunks of chunksize items by the executor (a
+    concurrent.futures.Executor). If no executor is given then a process
+    pool with a worker for each CPU is used (and shut down once all the items
+    are verified). If ordered is True the results are in the same order as
+    the items, otherwise they are returned as each chunk completes. Items
+    are read as results are returned, with no more than max_pending chunks
+    (by default twice the number of CPUs) waiting to be verified at a time.
+
+    Successful verifications are remembered in the cache (a
+    VerificationCache) as they would be by verify_item. Only the signature
+    of each item is looked up in this process: the items are hashed (once)
+    by the executor, which only checks the signature of an item if its
+    digest isn't the one remembered for the signature. Pass None to always
+    check the signatures.
+
+    A bad item only fails itself: if a chunk can't be verified by the
+    executor (for example, an item can't be sent to a worker process) then
+    the items in that chunk are verified one at a time in this process.
+    """
+    def prepare(chunk):
+        # Returns the signature key of each item (None if it can't be
+        # cached) and the (item, digest) tuples for the executor to verify.
+        keys = []
+        work = []
+        for item in chunk:
+            key = digest = None
+            if cache is not None:
+                try:
+                    key = _get_signature_key(item)
+                    digest = cache.get_digest(key)
+                except Exception:
+                    key = None
+            keys.append(key)
+            work.append((item, digest))
+        return (keys, work), work
+
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor()
+    try:
+        for (keys, work), future in _submit_chunks(
+                executor, _verify_chunk, items, chunksize, max_pending,
+                ordered, prepare=prepare):
+            try:
+                results = future.result()
+            except Exception:
+                results = _verify_chunk(work)
+            for key, (item, _), result in zip(keys, work, results):
+                verified, digest = result
+                if key is not None:
+                    _remember(cache, key, digest, verified)
+                yield item, verified
+    finally:
+        if own_executor:
+            executor.shutdown(cancel_futures=True)
 
 
 def _get_hash(obj):
@@ -71,11 +682,7 @@ def _get_hash(obj):
     """
     obj_type = type(obj)
     if obj_type is dict:
-        hash_list = []
-        for k in sorted(obj):
-            hash_list.append(_get_hash(k).hexdigest())
-            hash_list.append(_get_hash(obj[k]).hexdigest())
-        seed = ''.join(hash_list)
+        seed = _get_dict_seed(obj)
     elif obj_type is list:
         hash_list = []
         for item in obj:
@@ -90,3 +697,680 @@ def _get_hash(obj):
     else:
         seed = str(obj)
     return SHA512.new(seed.encode('utf-8'))
+
+
+def _get_dict_seed(obj, exclude=None):
+    """
+    Returns the seed hashed to give the hash of the dict: the hashes of its
+    sorted keys and their values. The exclude key (if given) is left out, as
+    if it wasn't in the dict.
+    """
+    hash_list = []
+    for k in sorted(obj):
+        if k == exclude:
+            continue
+        hash_list.append(_get_hash(k).hexdigest())
+        hash_list.append(_get_hash(obj[k]).hexdigest())
+    return ''.join(hash_list)
+
+
+def _get_unsigned_hash(item):
+    """
+    Returns the SHA512 object for a signed item as it was before the
+    signature was added to its metadata (the hash that was signed), using
+    the version of the canonical hash given in the metadata. Neither copies
+    nor changes the item.
+    """
+    metadata = item['_p4p2p']
+    hash_version = metadata.get('hash_version', 1)
+    if hash_version == 2:
+        return _get_hash_v2(item, (metadata, 'signature'))
+    elif hash_version != 1:
+        raise ValueError('Unsupported hash version.')
+    hash_list = []
+    for k in sorted(item):
+        hash_list.append(_get_hash(k).hexdigest())
+        if k == '_p4p2p':
+            seed = _get_dict_seed(item[k], 'signature')
+            hash_list.append(SHA512.new(seed.encode('utf-8')).hexdigest())
+        else:
+            hash_list.append(_get_hash(item[k]).hexdigest())
+    seed = ''.join(hash_list)
+    return SHA512.new(seed.encode('utf-8'))
+
+
+def _encode_length(length):
+    """
+    Returns the length (or count) as 8 big endian bytes.
+    """
+    return length.to_bytes(8, 'big')
+
+
+def _encode_scalar_v2(obj):
+    """
+    Returns the encoding (bytes) of a scalar for version 2 of the canonical
+    hash: the length of its tagged value followed by the value.
+    """
+    obj_type = type(obj)
+    if obj_type is bool:
+        data = b't' if obj else b'f'
+    elif obj is None:
+        data = b'n'
+    elif obj_type is int:
+        data = b'i' + str(obj).encode('utf-8')
+    elif obj_type is float:
+        data = b'r' + repr(obj).encode('utf-8')
+    else:
+        data = b's' + str(obj).encode('utf-8')
+    return _encode_length(len(data)) + data
+
+
+def _get_container_v2(obj, exclude):
+    """
+    Returns None for a scalar or, for a dict or list, a (header, key
+    digests, values) tuple: the type tag and number of entries, the digests
+    of the sorted keys of a dict (None for a list) and the values in order.
+
+    The exclude argument is a (dict, key) tuple: the key is left out of that
+    dict (identified by identity) as if it wasn't there.
+    """
+    obj_type = type(obj)
+    if obj_type is dict:
+        keys = sorted(obj)
+        if obj is exclude[0] and exclude[1] in obj:
+            keys.remove(exclude[1])
+        return (b'd' + _encode_length(len(keys)),
+                [_get_scalar_digest_v2(k) for k in keys],
+                [obj[k] for k in keys])
+    elif obj_type is list:
+        return b'l' + _encode_length(len(obj)), None, obj
+    return None
+
+
+def _get_entry_digest_v2(key_digest, value_digest):
+    """
+    Returns the digest (bytes) of a dict entry: the Merkle leaf for the key
+    and value.
+    """
+    return sha512(b'e' + key_digest + value_digest).digest()
+
+
+def _get_merkle_levels(leaves):
+    """
+    Returns the levels of the Merkle tree over the leaves (a list of
+    digests): the leaves first and the root (a list of one digest) last.
+    Each level pairs the digests of the level below, the last digest being
+    carried up unpaired if there is an odd number of them.
+    """
+    levels = [leaves]
+    while len(levels[-1]) > 1:
+        below = levels[-1]
+        level = [sha512(b'm' + below[i] + below[i + 1]).digest()
+                 for i in range(0, len(below) - 1, 2)]
+        if len(below) % 2:
+            level.append(below[-1])
+        levels.append(level)
+    return levels
+
+
+def _update_merkle_levels(levels, index, leaf):
+    """
+    Replaces the leaf at the index of the Merkle tree levels (see
+    _get_merkle_levels) and recalculates the digests above it.
+    """
+    levels[0][index] = leaf
+    for below, level in zip(levels, levels[1:]):
+        i = index - index % 2
+        if i + 1 < len(below):
+            digest = sha512(b'm' + below[i] + below[i + 1]).digest()
+        else:
+            digest = below[i]
+        index //= 2
+        level[index] = digest
+
+
+def _get_merkle_path(levels, index):
+    """
+    Returns a list of the digests (from the leaves up) needed with the leaf
+    at the index to recalculate the root of the Merkle tree levels.
+    """
+    path = []
+    for level in levels[:-1]:
+        sibling = index ^ 1
+        if sibling < len(level):
+            path.append(level[sibling])
+        index //= 2
+    return path
+
+
+def _get_merkle_root_from_path(leaf, index, count, path):
+    """
+    Returns the root of a Merkle tree of count leaves calculated from the
+    leaf at the index and the path of digests (see _get_merkle_path). Raises
+    a ValueError if the path doesn't fit the index and count.
+    """
+    if not 0 <= index < count:
+        raise ValueError('Leaf index out of range.')
+    path = iter(path)
+    digest = leaf
+    while count > 1:
+        if index % 2:
+            digest = sha512(b'm' + next(path) + digest).digest()
+        elif index + 1 < count:
+            digest = sha512(b'm' + digest + next(path)).digest()
+        index //= 2
+        count = (count + 1) // 2
+    if next(path, None) is not None:
+        raise ValueError('The path is too long.')
+    return digest
+
+
+def _get_container_data_v2(header, key_digests, digests):
+    """
+    Returns the encoding (bytes) of a dict or list for version 2 of the
+    canonical hash given its header and key digests (see _get_container_v2)
+    and the digests of its values: the header followed by the root of the
+    Merkle tree of its entries.
+    """
+    if key_digests is not None:
+        digests = [_get_entry_digest_v2(key_digest, digest)
+                   for key_digest, digest in zip(key_digests, digests)]
+    if not digests:
+        return header
+    return header + _get_merkle_levels(digests)[-1][0]
+
+
+def _get_hash_v2(obj, exclude=(None, None)):
+    """
+    Returns a SHA512 object for the given object using version 2 of the
+    canonical hash. Like version 1 it works in a similar fashion to a Merkle
+    tree but it:
+
+    * walks the object with an explicit stack (so deeply nested objects
+      don't reach Python's recursion limit),
+    * hashes binary digests and length prefixed encodings and,
+    * hashes the entries of each dict and list as a binary Merkle tree (so
+      an inclusion proof needs only a logarithmic number of digests for
+      each container, see get_inclusion_proof).
+
+    A scalar is encoded as the length of its tagged value followed by the
+    value: "t" or "f" for booleans, "n" for None, "i" and the digits of an
+    int, "r" and the repr of a float or "s" and the UTF-8 string of anything
+    else. A list is encoded as "l", its length and the root of the Merkle
+    tree of the digests of its items. A dict is encoded as "d", its length
+    and the root of the Merkle tree of its entries (in key order), each the
+    digest of "e", the digest of the key and the digest of the value. Each
+    node of a Merkle tree is the digest of "m" and its two children (a last
+    unpaired child is carried up). Lengths are 8 big endian bytes and empty
+    containers have no root.
+
+    The optional exclude argument is a (dict, key) tuple: the key is left out
+    of that dict as if it wasn't there (so the hash of a signed item can be
+    found without removing its signature).
+    """
+    container = _get_container_v2(obj, exclude)
+    if container is None:
+        return SHA512.new(_encode_scalar_v2(obj))
+    stack = [(container, iter(container[2]), [])]
+    while True:
+        container, values, digests = stack[-1]
+        for value in values:
+            child = _get_container_v2(value, exclude)
+            if child is not None:
+                # Finish the child (and its descendants) first.
+                stack.append((child, iter(child[2]), []))
+                break
+            digests.append(sha512(_encode_scalar_v2(value)).digest())
+        else:
+            stack.pop()
+            data = _get_container_data_v2(container[0], container[1],
+                                          digests)
+            if not stack:
+                return SHA512.new(data)
+            stack[-1][2].append(sha512(data).digest())
+
+
+def _get_scalar_digest_v2(obj):
+    """
+    Returns the digest (bytes) of a scalar using version 2 of the canonical
+    hash.
+    """
+    return sha512(_encode_scalar_v2(obj)).digest()
+
+
+class _HashNode(object):
+    """
+    A node in a HashedTree. The children of a dict node are a dict mapping
+    each key to a (key digest, node) tuple (with the keys also kept sorted
+    in keys). The children of a list node are a list of nodes. Scalars have
+    no children. The digest is None if it needs recalculating.
+
+    Containers also keep the levels of the Merkle tree of their entries
+    (None if it needs rebuilding) and the set of the indexes of the entries
+    that have changed since it was last calculated.
+    """
+
+    __slots__ = ('children', 'keys', 'digest', 'levels', 'changed')
+
+    def __init__(self):
+        self.children = None
+        self.keys = None
+        self.digest = None
+        self.levels = None
+        self.changed = None
+
+    def child_nodes(self):
+        """
+        Returns a list of the child nodes (in the order they're hashed).
+        """
+        if self.keys is not None:
+            return [self.children[k][1] for k in self.keys]
+        return self.children or []
+
+    def leaf(self, index):
+        """
+        Returns the Merkle leaf for the entry at the index.
+        """
+        if self.keys is not None:
+            key_digest, child = self.children[self.keys[index]]
+            return _get_entry_digest_v2(key_digest, child.digest)
+        return self.children[index].digest
+
+    def changed_entry(self, k):
+        """
+        Records that the value of the existing entry with the key (or
+        index) k has changed.
+        """
+        if self.levels is not None:
+            if self.keys is not None:
+                k = bisect.bisect_left(self.keys, k)
+            elif k < 0:
+                k += len(self.children)
+            if self.changed is None:
+                self.changed = set()
+            self.changed.add(k)
+
+
+class HashedTree(object):
+    """
+    Holds an item (a dict) along with the version 2 digest of each of its
+    parts (see _get_hash_v2) so that when part of the item is changed only
+    the digests of the parts containing it need to be recalculated: the
+    rest of the item isn't hashed again. Pass the tree to get_signed_item
+    (with a hash_version of 2) to sign the item.
+
+    The Merkle tree of the entries of each container is kept too, so
+    changing the value of an existing entry only recalculates the digests
+    above it (adding or deleting an entry rebuilds the container's Merkle
+    tree from the digests of its entries).
+
+    The item must only be changed via the set and delete methods (otherwise
+    the digests will be out of date). These never change a container in
+    place: each container on the path is replaced by a changed copy (so
+    items signed from the tree earlier, which share its containers, are
+    unaffected).
+    """
+
+    def __init__(self, value):
+        """
+        The value is the item (a dict) to hold. It is not copied (but is
+        never changed by the tree).
+        """
+        if type(value) is not dict:
+            raise TypeError('A HashedTree holds a dict.')
+        self.value = value
+        self._root = self._build(value)
+
+    def _build(self, obj):
+        """
+        Returns the root node of a new tree of nodes (with no digests
+        calculated for containers) for the object.
+        """
+        root = _HashNode()
+        stack = [(obj, root)]
+        while stack:
+            obj, node = stack.pop()
+            obj_type = type(obj)
+            if obj_type is dict:
+                node.children = {}
+                for k, v in obj.items():
+                    child = _HashNode()
+                    node.children[k] = (_get_scalar_digest_v2(k), child)
+                    stack.append((v, child))
+                node.keys = sorted(obj)
+            elif obj_type is list:
+                node.children = []
+                for v in obj:
+                    child = _HashNode()
+                    node.children.append(child)
+                    stack.append((v, child))
+            else:
+                node.digest = _get_scalar_digest_v2(obj)
+        return root
+
+    def _update_digests(self):
+        """
+        Calculates the digests of all the nodes that need recalculating.
+        """
+        stack = [(self._root, False)]
+        while stack:
+            node, children_done = stack.pop()
+            if node.digest is not None:
+                continue
+            if not children_done:
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.child_nodes()
+                             if child.digest is None)
+                continue
+            if node.keys is not None:
+                header = b'd' + _encode_length(len(node.keys))
+                count = len(node.keys)
+            else:
+                header = b'l' + _encode_length(len(node.children))
+                count = len(node.children)
+            if node.levels is None:
+                node.levels = _get_merkle_levels(
+                    [node.leaf(i) for i in range(count)])
+            else:
+                for i in node.changed or ():
+                    _update_merkle_levels(node.levels, i, node.leaf(i))
+            node.changed = None
+            if count:
+                header += node.levels[-1][0]
+            node.digest = sha512(header).digest()
+
+    def _find(self, path):
+        """
+        Returns the (object, node) tuple of the container holding the last
+        key (or index) in the path, marking it and the containers above it
+        as needing their digests recalculating. The containers on the path
+        are replaced by copies, so the object returned can be changed. Raises
+        a KeyError or IndexError if the path doesn't exist.
+        """
+        if not path:
+            raise KeyError('The path must not be empty.')
+        obj = self.value
+        node = self._root
+        objs = [obj]
+        nodes = [node]
+        for k in path[:-1]:
+            obj = obj[k]
+            child = node.children[k]
+            node = child[1] if node.keys is not None else child
+            if node.children is None:
+                raise KeyError('%r is not a dict or list.' % (k, ))
+            objs.append(obj)
+            nodes.append(node)
+        # Make sure the last key exists (for a list) before changing anything.
+        if node.keys is None:
+            obj[path[-1]]
+        copies = [container.copy() for container in objs]
+        for parent, k, copied in zip(copies, path, copies[1:]):
+            parent[k] = copied
+        self.value = copies[0]
+        for container, k in zip(nodes, path):
+            container.digest = None
+            if container is not node:
+                container.changed_entry(k)
+        return copies[-1], node
+
+    def get(self, path):
+        """
+        Returns the part of the item at the path (a sequence of dict keys and
+        list indexes).
+        """
+        obj = self.value
+        for k in path:
+            obj = obj[k]
+        return obj
+
+    def set(self, path, value):
+        """
+        Sets the part of the item at the path (a sequence of dict keys and
+        list indexes) to the value. New keys may be added to dicts but list
+        indexes must already exist.
+        """
+        obj, node = self._find(path)
+        k = path[-1]
+        child = self._build(value)
+        if node.keys is not None:
+            if k in node.children:
+                node.changed_entry(k)
+            else:
+                bisect.insort(node.keys, k)
+                node.levels = None
+            node.children[k] = (_get_scalar_digest_v2(k), child)
+        else:
+            node.changed_entry(k)
+            node.children[k] = child
+        obj[k] = value
+
+    def delete(self, path):
+        """
+        Deletes the part of the item at the path (a sequence of dict keys and
+        list indexes).
+        """
+        obj, node = self._find(path)
+        k = path[-1]
+        del obj[k]
+        del node.children[k]
+        if node.keys is not None:
+            node.keys.remove(k)
+        node.levels = None
+
+    def digest(self):
+        """
+        Returns the digest (bytes) of the item: the same as
+        _get_hash_v2(self.value).digest().
+        """
+        self._update_digests()
+        return self._root.digest
+
+    def root_hash(self, extra=None):
+        """
+        Returns a SHA512 object for the item (the same as
+        _get_hash_v2(self.value)). The optional extra dict contains entries
+        to hash as if they were (also) in the item, such as the metadata
+        added when the item is signed.
+        """
+        self._update_digests()
+        root = self._root
+        if not extra:
+            header = b'd' + _encode_length(len(root.keys))
+            if root.keys:
+                header += root.levels[-1][0]
+            return SHA512.new(header)
+        keys = sorted(set(root.keys).union(extra))
+        key_digests = []
+        digests = []
+        for k in keys:
+            if k in extra:
+                key_digests.append(_get_scalar_digest_v2(k))
+                digests.append(_get_hash_v2(extra[k]).digest())
+            else:
+                key_digest, child = root.children[k]
+                key_digests.append(key_digest)
+                digests.append(child.digest)
+        return SHA512.new(_get_container_data_v2(
+            b'd' + _encode_length(len(keys)), key_digests, digests))
+
+
+def _get_proof_level(obj, node, key, exclude):
+    """
+    Returns a dict describing the container (obj) on the path of an
+    inclusion proof: its type, its length, the index of the key's entry and
+    the path of digests from the entry to the root of the container's Merkle
+    tree. Uses the digests of the HashedTree node (if not None) rather than
+    hashing the children.
+
+    For the root (the signed item) it also contains the index of the
+    metadata's entry and the path of digests from it to the root.
+    """
+    if type(obj) is dict:
+        if key not in obj:
+            raise KeyError(key)
+        keys = sorted(obj)
+        root = obj.get('_p4p2p') is exclude[0]
+        if obj is exclude[0] and exclude[1] in obj:
+            keys.remove(exclude[1])
+        leaves = []
+        for k in keys:
+            # The metadata (at the root) is always hashed from the signed
+            # item since the tree may hold an earlier signature's metadata.
+            if (node is not None and k in node.children and
+                    obj[k] is not exclude[0]):
+                key_digest, child = node.children[k]
+                digest = child.digest
+            else:
+                key_digest = _get_scalar_digest_v2(k)
+                digest = _get_hash_v2(obj[k], exclude).digest()
+            leaves.append(_get_entry_digest_v2(key_digest, digest))
+        if node is not None and not root:
+            levels = node.levels
+        else:
+            levels = _get_merkle_levels(leaves)
+        index = bisect.bisect_left(keys, key)
+        level_type = 'd'
+    elif type(obj) is list:
+        if type(key) is not int or not 0 <= key < len(obj):
+            raise IndexError('List index out of range.')
+        root = False
+        if node is not None:
+            levels = node.levels
+        else:
+            levels = _get_merkle_levels(
+                [_get_hash_v2(child).digest() for child in obj])
+        index = key
+        level_type = 'l'
+    else:
+        raise KeyError('%r is not in a dict or list.' % (key, ))
+    result = {
+        'type': level_type,
+        'count': len(levels[0]),
+        'index': index,
+        'path': base64.b64encode(
+            b''.join(_get_merkle_path(levels, index))).decode('ascii'),
+    }
+    if root:
+        metadata_index = bisect.bisect_left(keys, '_p4p2p')
+        result['metadata_index'] = metadata_index
+        result['metadata_path'] = base64.b64encode(b''.join(
+            _get_merkle_path(levels, metadata_index))).decode('ascii')
+    return result
+
+
+def get_inclusion_proof(signed_item, path, tree=None):
+    """
+    Returns an inclusion proof (a dict that can be serialised as JSON) for
+    the part of the signed item at the path (a sequence of dict keys and
+    list indexes). The proof contains the part of the item, the item's
+    metadata (including the signature) and, for each container on the path,
+    the digests needed to calculate the root of the Merkle tree of the
+    container's entries from the entry on the path (and, for the item
+    itself, from the metadata's entry). It can be checked with
+    verify_inclusion_proof without the rest of the item.
+
+    Only items signed with version 2 of the canonical hash have proofs. The
+    path must not be empty or lead into the metadata.
+
+    If a HashedTree holding the item (without its metadata) is given then
+    the digests it holds are used rather than hashing the item again.
+
+    The size of a proof is 64 bytes for each level of the Merkle tree of
+    each container on the path (the base 2 logarithm of the number of
+    entries, rounded up), however many and however big the entries are.
+    """
+    metadata = signed_item['_p4p2p']
+    if metadata.get('hash_version', 1) != 2:
+        raise ValueError('Inclusion proofs need version 2 of the hash.')
+    path = list(path)
+    if not path or path[0] == '_p4p2p':
+        raise ValueError('The path must be to part of the item.')
+    exclude = (metadata, 'signature')
+    node = None
+    if tree is not None:
+        tree._update_digests()
+        node = tree._root
+    obj = signed_item
+    levels = []
+    for key in path:
+        levels.append(_get_proof_level(obj, node, key, exclude))
+        obj = obj[key]
+        if node is not None:
+            child = node.children[key]
+            node = child[1] if node.keys is not None else child
+    return {
+        'path': path,
+        'value': obj,
+        'metadata': metadata,
+        'levels': levels,
+    }
+
+
+def _split_digests(encoded):
+    """
+    Returns a list of the 64 byte digests in the base64 encoded string.
+    Raises a ValueError if it isn't a whole number of digests.
+    """
+    data = base64.b64decode(encoded)
+    if len(data) % 64:
+        raise ValueError('Not a whole number of digests.')
+    return [data[i:i + 64] for i in range(0, len(data), 64)]
+
+
+def verify_inclusion_proof(proof):
+    """
+    Returns a boolean to indicate if the inclusion proof (see
+    get_inclusion_proof) shows that the value at its path is part of an
+    item with a valid signature (as given in the proof's metadata).
+    """
+    try:
+        metadata = proof['metadata']
+        if metadata.get('hash_version', 1) != 2:
+            return False
+        path = proof['path']
+        levels = proof['levels']
+        if not path or len(path) != len(levels) or path[0] == '_p4p2p':
+            return False
+        digest = _get_hash_v2(proof['value']).digest()
+        for i in range(len(path) - 1, -1, -1):
+            key = path[i]
+            level = levels[i]
+            count = level['count']
+            index = level['index']
+            if type(count) is not int or type(index) is not int:
+                return False
+            if level['type'] == 'd':
+                leaf = _get_entry_digest_v2(_get_scalar_digest_v2(key),
+                                            digest)
+            elif level['type'] == 'l':
+                if type(key) is not int or key != index:
+                    return False
+                leaf = digest
+            else:
+                return False
+            root = _get_merkle_root_from_path(leaf, index, count,
+                                              _split_digests(level['path']))
+            data = level['type'].encode('ascii') + _encode_length(count)
+            data += root
+            if i:
+                digest = sha512(data).digest()
+        # The root must be a dict containing the metadata (without the
+        # signature) in another entry.
+        if level['type'] != 'd' or level['metadata_index'] == index:
+            return False
+        metadata_leaf = _get_entry_digest_v2(
+            _get_scalar_digest_v2('_p4p2p'),
+            _get_hash_v2(metadata, (metadata, 'signature')).digest())
+        metadata_root = _get_merkle_root_from_path(
+            metadata_leaf, level['metadata_index'], count,
+            _split_digests(level['metadata_path']))
+        if metadata_root != root:
+            return False
+        signature = base64.decodebytes(metadata['signature'].encode('utf-8'))
+        scheme = metadata.get('scheme', DEFAULT_SCHEME)
+        verifier = _get_verifier(metadata['public_key'], scheme)
+        return verifier.verify(SHA512.new(data), signature)
+    except Exception:
+        pass
+    return False
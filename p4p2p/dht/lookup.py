@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+Contains the asyncio based iterative lookup used to find the nodes closest to
+a key (FIND_NODE) or a value stored in the DHT (FIND_VALUE).
+"""
+import asyncio
+import bisect
+from . import constants
+from .routingtable import RoutingTableEmpty
+from .utils import sort_peer_nodes_by_latency
+
+
+class ValueNotFound(Exception):
+    """
+    Raised when a FIND_VALUE lookup finishes without any peer returning the
+    requested value.
+    """
+    pass
+
+
+class Transport(object):
+    """
+    Base class for the network used by a NodeLookup to send FIND_NODE and
+    FIND_VALUE requests to peers. Implementations should override the
+    find_node and find_value coroutines. A failed request should raise an
+    exception (the lookup deals with timeouts itself).
+    """
+
+    async def find_node(self, contact, key):
+        """
+        Asks the peer (PeerNode) for the nodes it knows closest to the key
+        (an integer). Returns a list of PeerNode instances.
+        """
+        raise NotImplementedError('find_node needs implementing.')
+
+    async def find_value(self, contact, key):
+        """
+        Asks the peer (PeerNode) for the value stored under the key (an
+        integer). Returns a (value, contacts) tuple: if the peer doesn't have
+        the value then value is None and contacts is a list of the PeerNode
+        instances it knows closest to the key.
+        """
+        raise NotImplementedError('find_value needs implementing.')
+
+
+class NodeLookup(object):
+    """
+    An iterative lookup for the K nodes closest to a key (FIND_NODE) or for
+    the value stored under a key (FIND_VALUE) as described in section 2.3 of
+    the Kademlia paper:
+
+    "The lookup initiator starts by picking alpha nodes from its closest
+    non-empty k-bucket... The initiator then sends parallel, asynchronous
+    FIND_NODE RPCs to the alpha nodes it has chosen... the initiator resends
+    the FIND_NODE to nodes it has learned about from previous RPCs."
+
+    The shortlist of candidate contacts is kept ordered by XOR distance from
+    the key. At most ALPHA requests are in flight at any time and the next
+    request is sent as soon as one completes. The lookup finishes (and any
+    outstanding requests are cancelled) once the K closest contacts in the
+    shortlist have all responded.
+
+    Peers that respond are added to the routing table (with their round trip
+    time recorded) and those that fail are reported to it via
+    remove_contact. Each peer is given an adaptive time to respond based on
+    its round trip time (see PeerNode.rpc_timeout). A peer that doesn't
+    respond in time is dropped from the lookup but only reported to the
+    routing table once it has been given the full rpc_timeout.
+    """
+
+    def __init__(self, key, routing_table, transport, find_value=False,
+                 timeout=constants.LOOKUP_TIMEOUT,
+                 rpc_timeout=constants.RPC_TIMEOUT, latency_aware=False,
+                 adaptive_timeouts=True):
+        """
+        The key (expressed as a hex string or an integer) is the target of the
+        lookup. The routing_table supplies the initial contacts and is updated
+        as peers respond (or fail to). Requests are sent via the transport (a
+        Transport instance). If find_value is True the lookup is for the value
+        stored under the key rather than the closest nodes.
+
+        The timeout is the maximum time the whole lookup is allowed to take
+        and rpc_timeout the maximum time allowed for each request (both in
+        seconds). If adaptive_timeouts is False then every request is allowed
+        the full rpc_timeout.
+
+        If latency_aware is True then, when choosing which of the K closest
+        contacts to ask next, contacts of the same distance rank are asked
+        fastest first (see utils.sort_peer_nodes_by_latency). The result is
+        unaffected.
+        """
+        if isinstance(key, str):
+            key = int(key, 0)
+        self.key = key
+        self.routing_table = routing_table
+        self.transport = transport
+        self.find_value = find_value
+        self.timeout = timeout
+        self.rpc_timeout = rpc_timeout
+        self.latency_aware = latency_aware
+        self.adaptive_timeouts = adaptive_timeouts
+        # (distance, contact) tuples ordered by XOR distance from the key. The
+        # distances are unique so the contacts themselves are never compared.
+        self._shortlist = []
+        # The network IDs (as integers) of all the contacts ever added to the
+        # shortlist, those that have been sent a request and those that have
+        # responded.
+        self._seen = set()
+        self._contacted = set()
+        self._responded = set()
+        # Maps outstanding request tasks to the contact being asked.
+        self._pending = {}
+
+    async def run(self):
+        """
+        Runs the lookup. Returns a list of the (up to) K closest contacts that
+        responded ordered from closest to furthest away from the key or, for a
+        FIND_VALUE lookup, the value found. Raises RoutingTableEmpty if there
+        is nobody to ask, ValueNotFound if a FIND_VALUE lookup fails and
+        asyncio.TimeoutError if the lookup takes too long.
+        """
+        return await asyncio.wait_for(self._lookup(), self.timeout)
+
+    def _add_to_shortlist(self, contact):
+        """
+        Adds the contact to the shortlist unless it has been seen before or is
+        the parent node of the routing table.
+        """
+        contact_id = contact.network_id_int
+        if contact_id in self._seen:
+            return
+        if contact_id == self.routing_table.parent_node_int:
+            return
+        self._seen.add(contact_id)
+        # Use the routing table's instance of a known contact since it holds
+        # the contact's round trip time estimate.
+        try:
+            contact = self.routing_table.get_contact(contact_id)
+        except ValueError:
+            pass
+        bisect.insort(self._shortlist, (contact_id ^ self.key, contact))
+
+    def _remove_from_shortlist(self, contact):
+        """
+        Removes the (unresponsive) contact from the shortlist.
+        """
+        entry = (contact.network_id_int ^ self.key, contact)
+        index = bisect.bisect_left(self._shortlist, entry)
+        del self._shortlist[index]
+
+    async def _request(self, contact):
+        """
+        Sends the appropriate request to the contact and records the round
+        trip time if it responds. Returns a (value, contacts) tuple.
+        """
+        if self.adaptive_timeouts:
+            timeout = contact.rpc_timeout(self.rpc_timeout)
+        else:
+            timeout = self.rpc_timeout
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        if self.find_value:
+            request = self.transport.find_value(contact, self.key)
+            result = await asyncio.wait_for(request, timeout)
+        else:
+            request = self.transport.find_node(contact, self.key)
+            result = None, await asyncio.wait_for(request, timeout)
+        contact.record_rtt(loop.time() - start)
+        return result
+
+    async def _lookup(self):
+        """
+        The lookup itself (see the run method).
+        """
+        contacts = self.routing_table.find_close_nodes(self.key)
+        if not contacts:
+            raise RoutingTableEmpty()
+        for contact in contacts:
+            self._add_to_shortlist(contact)
+        try:
+            while True:
+                closest = [contact for _, contact in
+                           self._shortlist[:constants.K]]
+                if all(c.network_id_int in self._responded for c in closest):
+                    # The K closest contacts have all responded.
+                    break
+                candidates = [c for c in closest
+                              if c.network_id_int not in self._contacted]
+                if self.latency_aware:
+                    sort_peer_nodes_by_latency(candidates, self.key)
+                for contact in candidates:
+                    if len(self._pending) >= constants.ALPHA:
+                        break
+                    self._contacted.add(contact.network_id_int)
+                    task = asyncio.ensure_future(self._request(contact))
+                    self._pending[task] = contact
+                done, _ = await asyncio.wait(
+                    self._pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    contact = self._pending.pop(task)
+                    try:
+                        value, contacts = task.result()
+                    except asyncio.TimeoutError:
+                        self._remove_from_shortlist(contact)
+                        if (not self.adaptive_timeouts or
+                                contact.record_timeout(self.rpc_timeout)):
+                            self.routing_table.remove_contact(
+                                contact.network_id_int)
+                        continue
+                    except Exception:
+                        self._remove_from_shortlist(contact)
+                        self.routing_table.remove_contact(
+                            contact.network_id_int)
+                        continue
+                    self._responded.add(contact.network_id_int)
+                    self.routing_table.add_contact(contact)
+                    if value is not None:
+                        return value
+                    for new_contact in contacts:
+                        self._add_to_shortlist(new_contact)
+        finally:
+            for task in self._pending:
+                task.cancel()
+            self._pending = {}
+        if self.find_value:
+            raise ValueNotFound()
+        return [contact for _, contact in self._shortlist[:constants.K]]
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Contains a simple collector of counters and latency histograms used to
+instrument parts of the DHT (such as the routing table).
+"""
+import bisect
+import threading
+from collections import Counter
+
+#: The upper bounds (in seconds) of the buckets in a latency histogram. The
+#: final bucket counts everything slower than the last bound.
+LATENCY_BOUNDS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05,
+                  0.1, 0.5, 1.0)
+
+
+class Histogram(object):
+    """
+    Counts observed values (usually latencies in seconds) in buckets with the
+    specified upper bounds. Also keeps track of the total number and sum of
+    the observed values.
+    """
+
+    def __init__(self, bounds=LATENCY_BOUNDS):
+        """
+        The bounds are the sorted upper bounds of the buckets.
+        """
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+
+    def observe(self, value):
+        """
+        Records the value in the appropriate bucket.
+        """
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def report(self):
+        """
+        Returns a dict containing the bucket bounds and counts along with the
+        total number and sum of the observed values.
+        """
+        return {
+            'bounds': list(self.bounds),
+            'counts': list(self.counts),
+            'count': self.count,
+            'sum': self.total,
+        }
+
+
+class Metrics(object):
+    """
+    Collects named counters and histograms. An instance is passed to the
+    objects to be instrumented (which do nothing when they have no metrics
+    object, so instrumentation costs almost nothing when disabled). Safe to
+    share between threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = Counter()
+        self._histograms = {}
+
+    def increment(self, name, count=1):
+        """
+        Adds count to the named counter.
+        """
+        with self._lock:
+            self._counters[name] += count
+
+    def observe(self, name, value):
+        """
+        Records the value (usually a duration in seconds) in the named
+        histogram.
+        """
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def report(self):
+        """
+        Returns a dict containing the current value of each counter and the
+        state of each histogram (suitable for exporting to a monitoring
+        system).
+        """
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'histograms': dict((name, histogram.report()) for
+                                   name, histogram in
+                                   self._histograms.items()),
+            }
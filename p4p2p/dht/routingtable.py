@@ -3,11 +3,48 @@
 Code to implement routing tables.
 """
 
+import json
 import time
 import random
+import bisect
+import heapq
+import threading
 from . import constants
-from .bucket import BucketFull, Bucket
-from .utils import sort_peer_nodes
+from .bucket import BucketFull, Bucket, _key
+from .contact import PeerNode
+from .utils import sort_peer_nodes_by_latency
+
+
+#: The version of the format of routing table snapshots.
+SNAPSHOT_VERSION = 1
+
+
+def _contact_to_list(contact):
+    """
+    Returns the attributes of the contact (PeerNode) that are stored in a
+    routing table snapshot.
+    """
+    return [contact.network_id, contact.public_key, contact.ip_address,
+            contact.port, contact.version, contact.last_seen,
+            contact.failed_RPCs, contact.srtt, contact.rttvar]
+
+
+def _contact_from_list(data):
+    """
+    Returns a contact (PeerNode) created from the attributes stored in a
+    routing table snapshot.
+    """
+    (network_id, public_key, ip_address, port, version, last_seen,
+     failed_RPCs) = data[:7]
+    contact = PeerNode(public_key, ip_address, port, version, last_seen)
+    if contact.network_id != network_id:
+        contact.network_id = network_id
+    contact.failed_RPCs = failed_RPCs
+    if len(data) > 7:
+        # Snapshots taken before round trip times were tracked don't include
+        # them.
+        contact.srtt, contact.rttvar = data[7:9]
+    return contact
 
 
 class RoutingTableEmpty(Exception):
@@ -29,36 +66,97 @@ class RoutingTable(object):
     512-bit ID space with no overlap."
     """
 
-    def __init__(self, parent_node_id):
+    def __init__(self, parent_node_id, metrics=None, b=constants.B):
         """
         The parent_node_id is the 512-bit ID of the node to which this routing
-        table belongs.
+        table belongs. If a Metrics instance is passed as metrics then it
+        will be used to count events (such as bucket splits) and time
+        find_close_nodes.
+
+        The symbol size b is the number of bits of a key resolved by each step
+        of a lookup (see _can_split).
         """
+        if b < 1:
+            raise ValueError('The symbol size b must be at least 1.')
+        self.metrics = metrics
+        self._b = b
         # Create the initial (single) bucket covering the range of the
         # entire 512-bit ID space
         self._buckets = [Bucket(range_min=0, range_max=2 ** 512)]
+        # The sorted lower bounds of each bucket's range (kept in step with
+        # self._buckets) so the bucket for a key can be found with a binary
+        # search rather than checking each bucket in turn.
+        self._bucket_mins = [0]
         self._parent_node_id = parent_node_id
-        # Cache containing nodes eligible to replace stale bucket entries
-        self._replacement_cache = {}
-        # Set of nodes (network_ids) that have been blacklisted due to "bad"
-        # behaviour.
+        # The integer form of the parent's node ID used when comparing it with
+        # bucket ranges and other node IDs.
+        if isinstance(parent_node_id, str):
+            self._parent_node_int = int(parent_node_id, 0)
+        else:
+            self._parent_node_int = parent_node_id
+        # Set of nodes (integer network_ids) that have been blacklisted due to
+        # "bad" behaviour.
         self._blacklist = set()
+        # A heap of (due, range_min) tuples (one for each bucket) ordered by
+        # the time each bucket is next due to be refreshed. Touching a bucket
+        # only updates its last_accessed timestamp: if the bucket has been
+        # used by the time its entry reaches the top of the heap the entry is
+        # simply rescheduled.
+        self._refresh_queue = [(self._refresh_due(0), 0)]
+
+    @property
+    def parent_node_int(self):
+        """
+        The integer form of the ID of the node to which this routing table
+        belongs.
+        """
+        return self._parent_node_int
 
     def _bucket_index(self, key):
         """
         Returns the index of the bucket responsible for the specified key
-        string.
+        (expressed as either a hex string or an integer).
         """
         if isinstance(key, str):
             key = int(key, 0)
         # Bound check for key too small.
         if key < 0:
             raise ValueError('Key out of range')
-        for i, bucket in enumerate(self._buckets):
-            if bucket.key_in_range(key):
-                return i
-        # Key was too big given the key space.
-        raise ValueError('Key out of range.')
+        index = bisect.bisect_right(self._bucket_mins, key) - 1
+        if key >= self._buckets[index].range_max:
+            # Key was too big given the key space.
+            raise ValueError('Key out of range.')
+        return index
+
+    def _bucket_depth(self, bucket):
+        """
+        Returns the depth of the bucket in the routing table's binary tree
+        (the length of the ID prefix shared by all keys in its range).
+        """
+        return 513 - (bucket.range_max - bucket.range_min).bit_length()
+
+    def _can_split(self, bucket):
+        """
+        Returns a boolean to indicate if the (full) bucket may be split.
+
+        Strict Kademlia only splits a bucket if its range includes the host
+        node's id. Section 4.2 of the Kademlia paper describes accelerated
+        lookups that resolve b bits of the target key per step rather than
+        one. This needs a bucket for each of the 2^b - 1 possible values of
+        the next b bits of a key (other than those of the host node's id) so
+        splitting is relaxed to also allow any bucket whose depth isn't a
+        multiple of b to be split. When b is 1 this is strict Kademlia.
+        """
+        if bucket.key_in_range(self._parent_node_int):
+            return True
+        return self._bucket_depth(bucket) % self._b != 0
+
+    def _bucket_for_update(self, bucket_index):
+        """
+        Returns the bucket at the specified index so it can be changed (for
+        example, by adding a contact or splitting it).
+        """
+        return self._buckets[bucket_index]
 
     def _random_key_in_bucket_range(self, bucket_index):
         """
@@ -68,28 +166,60 @@ class RoutingTable(object):
                                     self._buckets[bucket_index].range_max)
         return hex(keyValue)
 
+    def _refresh_due(self, last_accessed):
+        """
+        Returns the time a bucket last accessed at the specified time is next
+        due to be refreshed (including a random amount of jitter).
+        """
+        return (last_accessed + constants.REFRESH_TIMEOUT +
+                random.randint(0, constants.REFRESH_JITTER))
+
     def _split_bucket(self, old_bucket_index):
         """
         Splits the specified bucket into two new buckets which together
         cover the same range in the key/ID space.
         """
         # Resize the range of the current (old) bucket.
-        old_bucket = self._buckets[old_bucket_index]
-        split_point = int(old_bucket.range_max - (
-            old_bucket.range_max - old_bucket.range_min) / 2)
+        old_bucket = self._bucket_for_update(old_bucket_index)
+        split_point = old_bucket.range_max - (
+            old_bucket.range_max - old_bucket.range_min) // 2
         # Create a new bucket to cover the range split off from the old
         # bucket.
         new_bucket = Bucket(split_point, old_bucket.range_max)
         old_bucket.range_max = split_point
         # Now, add the new bucket into the routing table.
         self._buckets.insert(old_bucket_index + 1, new_bucket)
-        # Finally, copy all nodes that belong to the new bucket into it...
-        for contact in old_bucket._contacts:
-            if new_bucket.key_in_range(contact.network_id):
+        self._bucket_mins.insert(old_bucket_index + 1, split_point)
+        heapq.heappush(self._refresh_queue,
+                       (self._refresh_due(new_bucket.last_accessed),
+                        split_point))
+        # Copy all nodes that belong to the new bucket into it...
+        for contact in old_bucket._contacts.values():
+            if new_bucket.key_in_range(contact.network_id_int):
                 new_bucket.add_contact(contact)
-        # ...and remove them from the old bucket
-        for contact in new_bucket._contacts:
+        # ...and remove them from the old bucket.
+        for contact in new_bucket._contacts.values():
             old_bucket.remove_contact(contact)
+        # Do the same for the replacement cache (preserving the order in which
+        # the cached contacts were seen).
+        for contact in old_bucket.get_replacements():
+            if new_bucket.key_in_range(contact.network_id_int):
+                new_bucket.add_replacement(contact)
+                old_bucket.remove_replacement(contact)
+        # Finally, use the most recently seen cached contacts to fill any
+        # space made in either bucket by the split.
+        promoted = 0
+        for bucket in (old_bucket, new_bucket):
+            while len(bucket) < constants.K:
+                replacement = bucket.pop_replacement()
+                if replacement is None:
+                    break
+                bucket.add_contact(replacement)
+                promoted += 1
+        if self.metrics is not None:
+            self.metrics.increment('splits')
+            if promoted:
+                self.metrics.increment('replacement_promotions', promoted)
 
     def blacklist(self, contact):
         """
@@ -99,32 +229,36 @@ class RoutingTable(object):
         Once blacklisted a contact is never allowed to be in the routing
         table or replacement cache.
         """
-        self.remove_contact(contact.network_id, forced=True)
-        self._blacklist.add(contact.network_id)
+        self.remove_contact(contact.network_id_int, forced=True)
+        self._blacklist.add(contact.network_id_int)
 
     def add_contact(self, contact):
         """
         Add the given contact (PeerNode) to the correct bucket; if it already
         exists, its status will be updated.
         """
-        if contact.network_id in self._blacklist:
+        if contact.network_id_int in self._blacklist:
+            if self.metrics is not None:
+                self.metrics.increment('blacklist_hits')
             return
-        if contact.network_id == self._parent_node_id:
+        if contact.network_id_int == self._parent_node_int:
             return
         # Initialize/reset the "failed RPC" counter since adding it to the
         # routing table is the result of a successful RPC.
         contact.failed_RPCs = 0
-        bucket_index = self._bucket_index(contact.network_id)
-        try:
-            self._buckets[bucket_index].add_contact(contact)
-        except BucketFull:
-            # The bucket is full; see if it can be split (by checking if its
-            # range includes the host node's id)
-            if self._buckets[bucket_index].key_in_range(self._parent_node_id):
-                self._split_bucket(bucket_index)
-                # Retry the insertion attempt
-                self.add_contact(contact)
-            else:
+        while True:
+            bucket_index = self._bucket_index(contact.network_id_int)
+            bucket = self._bucket_for_update(bucket_index)
+            try:
+                bucket.add_contact(contact)
+                return
+            except BucketFull:
+                # The bucket is full; see if it can be split (see
+                # _can_split)
+                if self._can_split(bucket):
+                    self._split_bucket(bucket_index)
+                    # Retry the insertion attempt
+                    continue
                 # We can't split the k-bucket
                 #
                 # NOTE: This implementation follows section 4.1 of the 13 page
@@ -135,16 +269,85 @@ class RoutingTable(object):
                 # Put the new contact in our replacement cache for the
                 # corresponding k-bucket (or update it's position if it exists
                 # already).
-                if not bucket_index in self._replacement_cache:
-                    self._replacement_cache[bucket_index] = []
-                if contact in self._replacement_cache[bucket_index]:
-                    self._replacement_cache[bucket_index].remove(contact)
-                elif len(self._replacement_cache[bucket_index]) >= constants.K:
-                    # Use k to limit the size of the contact replacement cache.
-                    self._replacement_cache[bucket_index].pop(0)
-                self._replacement_cache[bucket_index].append(contact)
+                bucket.add_replacement(contact)
+                if self.metrics is not None:
+                    self.metrics.increment('bucket_full')
+                return
+
+    def add_contacts(self, contacts):
+        """
+        Add many contacts (PeerNode instances) at once, for example when
+        bootstrapping from a seed list or handling a FIND_NODE response. The
+        end result is the same as calling add_contact with each contact in
+        turn but the contacts are first grouped by the bucket they belong to,
+        so each bucket is split (as many times as needed) and filled in one
+        pass.
 
-    def find_close_nodes(self, key, network_id=None):
+        Returns a dict containing the number of contacts that were "added" to
+        a bucket, "refreshed" (already in a bucket), "cached" (put in a
+        bucket's replacement cache) and "rejected" (blacklisted or this
+        node).
+        """
+        summary = {'added': 0, 'refreshed': 0, 'cached': 0, 'rejected': 0}
+        # Group the contacts by bucket index, preserving the order in which
+        # they were passed in.
+        groups = {}
+        blacklist_hits = 0
+        for contact in contacts:
+            if contact.network_id_int in self._blacklist:
+                blacklist_hits += 1
+                continue
+            if contact.network_id_int == self._parent_node_int:
+                summary['rejected'] += 1
+                continue
+            contact.failed_RPCs = 0
+            bucket_index = self._bucket_index(contact.network_id_int)
+            groups.setdefault(bucket_index, []).append(contact)
+        # Splitting a bucket only changes the indexes of the buckets after it
+        # so the groups are dealt with from the highest bucket index down.
+        pending = sorted(groups.items())
+        while pending:
+            bucket_index, group = pending.pop()
+            bucket = self._bucket_for_update(bucket_index)
+            if self._can_split(bucket):
+                new_ids = set(c.network_id_int for c in group)
+                new_ids.difference_update(bucket._contacts)
+                if len(bucket) + len(new_ids) > constants.K:
+                    # Too many contacts to fit in the bucket so split it and
+                    # deal with each half separately.
+                    self._split_bucket(bucket_index)
+                    split_point = self._bucket_mins[bucket_index + 1]
+                    lower = []
+                    upper = []
+                    for contact in group:
+                        if contact.network_id_int < split_point:
+                            lower.append(contact)
+                        else:
+                            upper.append(contact)
+                    if lower:
+                        pending.append((bucket_index, lower))
+                    if upper:
+                        pending.append((bucket_index + 1, upper))
+                    continue
+            for contact in group:
+                if contact.network_id_int in bucket._contacts:
+                    summary['refreshed'] += 1
+                elif len(bucket) < constants.K:
+                    summary['added'] += 1
+                else:
+                    bucket.add_replacement(contact)
+                    summary['cached'] += 1
+                    continue
+                bucket.add_contact(contact)
+        summary['rejected'] += blacklist_hits
+        if self.metrics is not None:
+            if blacklist_hits:
+                self.metrics.increment('blacklist_hits', blacklist_hits)
+            if summary['cached']:
+                self.metrics.increment('bucket_full', summary['cached'])
+        return summary
+
+    def find_close_nodes(self, key, network_id=None, latency_aware=False):
         """
         Finds up to "K" number of known nodes closest to the node/value with
         the specified key. If network_id is supplied the referenced node will
@@ -154,46 +357,87 @@ class RoutingTable(object):
         return fewer than "K" contacts if not enough contacts are known.
 
         The result is ordered from closest to furthest away from the target
-        key.
+        key. If latency_aware is True then contacts of the same distance rank
+        (sharing the same length prefix with the key) are instead ordered
+        fastest first (see utils.sort_peer_nodes_by_latency) so a lookup
+        querying the first ALPHA contacts prefers faster peers. The contacts
+        returned are the same either way.
+
+        The routing table is a binary tree, so visiting its leaves depth
+        first (always descending into the child that shares the target key's
+        next bit before the other child) visits the buckets in order of their
+        XOR distance from the key. The search stops as soon as the K closest
+        contacts found so far are all closer than the next part of the tree to
+        be visited.
         """
-        bucket_index = self._bucket_index(key)
-        closest_nodes = self._buckets[bucket_index].get_contacts(
-            constants.K, network_id)
-        # How far away to jump beyond the containing bucket of the given key.
-        bucket_jump = 1
-        number_of_buckets = len(self._buckets)
-        # Flags that indicate if it's possible to jump higher or lower through
-        # the buckets.
-        can_go_lower = bucket_index - bucket_jump >= 0
-        can_go_higher = bucket_index + bucket_jump < number_of_buckets
-        while (len(closest_nodes) <
-               constants.K and (can_go_lower or can_go_higher)):
-            # Continue to fill the closestNodes list with contacts from the
-            # nearest unchecked neighbouring buckets. Have chosen to opt for
-            # readability rather than conciseness.
-            if can_go_lower:
-                # Neighbours lower in the key index.
-                remaining_slots = constants.K - len(closest_nodes)
-                jump_to_neighbour = bucket_index - bucket_jump
-                neighbour = self._buckets[jump_to_neighbour]
-                contacts = neighbour.get_contacts(remaining_slots, network_id)
-                closest_nodes.extend(contacts)
-                can_go_lower = bucket_index - (bucket_jump + 1) >= 0
-            if can_go_higher:
-                # Neighbours higher in the key index.
-                remaining_slots = constants.K - len(closest_nodes)
-                jump_to_neighbour = bucket_index + bucket_jump
-                neighbour = self._buckets[jump_to_neighbour]
-                contacts = neighbour.get_contacts(remaining_slots, network_id)
-                closest_nodes.extend(contacts)
-                can_go_higher = (bucket_index + (bucket_jump + 1) <
-                                 number_of_buckets)
-            bucket_jump += 1
-
-        # Order the nodes from closest to furthest away from the target key and
-        # ensure we only return K contacts (in certain circumstances K+1
-        # results are generated).
-        return sort_peer_nodes(closest_nodes, key)
+        if self.metrics is None:
+            result = self._find_close_nodes(key, network_id)
+        else:
+            start = time.perf_counter()
+            result = self._find_close_nodes(key, network_id)
+            self.metrics.observe('find_close_nodes',
+                                 time.perf_counter() - start)
+        if latency_aware:
+            sort_peer_nodes_by_latency(result, key)
+        return result
+
+    def _find_close_nodes(self, key, network_id):
+        """
+        Does the work of find_close_nodes.
+        """
+        if isinstance(key, str):
+            key = int(key, 0)
+        # Validates the key is within the key space.
+        self._bucket_index(key)
+        exclude = None if network_id is None else _key(network_id)
+        # A bounded max-heap (of negated distances) of the closest contacts
+        # found so far. The counter breaks ties so contacts are never
+        # compared.
+        closest = []
+        counter = 0
+        # Stack of (range_min, size) blocks of the key space yet to visit.
+        blocks = [(0, 2 ** 512)]
+        while blocks:
+            block_min, block_size = blocks.pop()
+            if len(closest) == constants.K:
+                # Nothing in this block (and hence any block still on the
+                # stack) can be closer than the contacts already found.
+                block_distance = (key ^ block_min) & ~(block_size - 1)
+                if block_distance >= -closest[0][0]:
+                    break
+            block_max = block_min + block_size
+            bucket_index = bisect.bisect_right(self._bucket_mins,
+                                               block_min) - 1
+            bucket = self._buckets[bucket_index]
+            if bucket.range_max < block_max:
+                # The block spans more than one bucket so visit the half of
+                # the block containing the key first (it's pushed last).
+                half = block_size // 2
+                if key & half:
+                    blocks.append((block_min, half))
+                    blocks.append((block_min + half, half))
+                else:
+                    blocks.append((block_min + half, half))
+                    blocks.append((block_min, half))
+                continue
+            whole_bucket = (bucket.range_min == block_min and
+                            bucket.range_max == block_max)
+            for contact in bucket._contacts.values():
+                contact_id = contact.network_id_int
+                if contact_id == exclude:
+                    continue
+                if not (whole_bucket or block_min <= contact_id < block_max):
+                    continue
+                contact_distance = contact_id ^ key
+                counter += 1
+                if len(closest) < constants.K:
+                    heapq.heappush(closest,
+                                   (-contact_distance, counter, contact))
+                elif contact_distance < -closest[0][0]:
+                    heapq.heapreplace(closest,
+                                      (-contact_distance, counter, contact))
+        closest.sort(reverse=True)
+        return [contact for _, _, contact in closest]
 
     def get_contact(self, network_id):
         """
@@ -212,16 +456,36 @@ class RoutingTable(object):
         in order to refresh those buckets in the routing table. If the
         "force" parameter is True then all buckets with the specified range
         will be refreshed, regardless of the time they were last accessed.
+
+        Only the buckets whose (jittered) refresh time has passed are
+        checked and each bucket returned is not due again for another
+        REFRESH_TIMEOUT seconds (unless forced).
         """
-        bucket_index = start_index
-        refresh_IDs = []
         now = int(time.time())
-        for bucket in self._buckets[start_index:]:
-            last_refreshed = now - bucket.last_accessed
-            if force or last_refreshed >= constants.REFRESH_TIMEOUT:
+        if force:
+            return [self._random_key_in_bucket_range(bucket_index)
+                    for bucket_index in range(start_index,
+                                              len(self._buckets))]
+        refresh_IDs = []
+        skipped = []
+        queue = self._refresh_queue
+        while queue and queue[0][0] <= now:
+            entry = heapq.heappop(queue)
+            range_min = entry[1]
+            bucket_index = self._bucket_index(range_min)
+            last_accessed = self._buckets[bucket_index].last_accessed
+            if now - last_accessed < constants.REFRESH_TIMEOUT:
+                # The bucket has been used since the entry was scheduled.
+                heapq.heappush(queue,
+                               (self._refresh_due(last_accessed), range_min))
+            elif bucket_index < start_index:
+                skipped.append(entry)
+            else:
                 search_ID = self._random_key_in_bucket_range(bucket_index)
                 refresh_IDs.append(search_ID)
-            bucket_index += 1
+                heapq.heappush(queue, (self._refresh_due(now), range_min))
+        for entry in skipped:
+            heapq.heappush(queue, entry)
         return refresh_IDs
 
     def remove_contact(self, network_id, forced=False):
@@ -237,27 +501,34 @@ class RoutingTable(object):
         bucket then the most up-to-date contact in the replacement cache will
         be used as a replacement.
         """
-        bucket_index = self._bucket_index(network_id)
+        bucket = self._bucket_for_update(self._bucket_index(network_id))
         try:
-            contact = self._buckets[bucket_index].get_contact(network_id)
+            contact = bucket.get_contact(network_id)
         except ValueError:
             # Fail silently since the contact isn't in the routing table
-            # anyway.
+            # anyway (but make sure a forced removal also clears it from the
+            # replacement cache).
+            if forced:
+                bucket.remove_replacement(network_id)
             return
         contact.failed_RPCs += 1
         if forced or contact.failed_RPCs >= constants.ALLOWED_RPC_FAILS:
-            # Remove the contact from the bucket.
-            self._buckets[bucket_index].remove_contact(network_id)
-            if bucket_index in self._replacement_cache:
-                # If required, remove the old contact from the replacement
-                # cache.
-                if contact in self._replacement_cache[bucket_index]:
-                    self._replacement_cache[bucket_index].remove(contact)
-                # If possible, replace the stale contact with the most recent
-                # contact stored in the replacement cache.
-                if len(self._replacement_cache[bucket_index]) > 0:
-                    self._buckets[bucket_index].add_contact(
-                        self._replacement_cache[bucket_index].pop())
+            # Remove the contact from the bucket and, if required, the
+            # replacement cache.
+            bucket.remove_contact(network_id)
+            bucket.remove_replacement(network_id)
+            # If possible, replace the stale contact with the most recent
+            # contact stored in the replacement cache.
+            replacement = bucket.pop_replacement()
+            if replacement is not None:
+                bucket.add_contact(replacement)
+            if self.metrics is not None:
+                if forced:
+                    self.metrics.increment('forced_removals')
+                else:
+                    self.metrics.increment('evictions')
+                if replacement is not None:
+                    self.metrics.increment('replacement_promotions')
 
     def touch_bucket(self, key):
         """
@@ -269,3 +540,252 @@ class RoutingTable(object):
         """
         bucket_index = self._bucket_index(key)
         self._buckets[bucket_index].last_accessed = int(time.time())
+
+    def stats(self):
+        """
+        Returns a dict describing the current state of the routing table for
+        monitoring: the number of buckets, contacts, cached contacts and
+        blacklisted nodes along with a list containing the following details
+        for each bucket:
+
+        * depth - the length of the ID prefix shared by the bucket's range.
+        * contacts - the number of contacts in the bucket.
+        * fill - the fraction of the bucket's K slots that are in use.
+        * replacements - the number of contacts in the replacement cache.
+        * last_accessed - when the bucket was last accessed.
+        * staleness - the number of seconds since the bucket was accessed.
+        """
+        now = int(time.time())
+        buckets = []
+        for bucket in self._buckets:
+            contact_count = len(bucket)
+            buckets.append({
+                'depth': self._bucket_depth(bucket),
+                'contacts': contact_count,
+                'fill': contact_count / constants.K,
+                'replacements': len(bucket._replacement_cache),
+                'last_accessed': bucket.last_accessed,
+                'staleness': now - bucket.last_accessed,
+            })
+        return {
+            'buckets': buckets,
+            'bucket_count': len(buckets),
+            'contact_count': sum(b['contacts'] for b in buckets),
+            'replacement_count': sum(b['replacements'] for b in buckets),
+            'blacklist_count': len(self._blacklist),
+        }
+
+    def snapshot(self):
+        """
+        Returns a dict (that can be serialized as JSON) describing the state
+        of the routing table: the parent node's ID, the symbol size b, the
+        blacklist and, for each bucket, its range, last_accessed timestamp,
+        contacts and replacement cache (in least to most recently seen
+        order).
+
+        Numbers in the 512-bit key space are expressed as hex strings and
+        each contact as a list of its network_id, public_key, ip_address,
+        port, version, last_seen, failed_RPCs, srtt and rttvar.
+        """
+        buckets = []
+        for bucket in self._buckets:
+            buckets.append({
+                'range_min': hex(bucket.range_min),
+                'range_max': hex(bucket.range_max),
+                'last_accessed': bucket.last_accessed,
+                'contacts': [_contact_to_list(c)
+                             for c in bucket._contacts.values()],
+                'replacements': [_contact_to_list(c) for c in
+                                 bucket._replacement_cache.values()],
+            })
+        return {
+            'version': SNAPSHOT_VERSION,
+            'parent_node_id': self._parent_node_id,
+            'b': self._b,
+            'blacklist': ['0x%0128x' % network_id
+                          for network_id in sorted(self._blacklist)],
+            'buckets': buckets,
+        }
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """
+        Returns a new routing table with the state described by the snapshot
+        (a dict returned by the snapshot method). The buckets are rebuilt
+        directly rather than by adding each contact in turn. Raises a
+        ValueError if the snapshot is not valid.
+        """
+        if snapshot.get('version') != SNAPSHOT_VERSION:
+            raise ValueError('Unsupported routing table snapshot version.')
+        buckets = []
+        range_max = 0
+        for bucket_data in snapshot['buckets']:
+            bucket = Bucket(int(bucket_data['range_min'], 0),
+                            int(bucket_data['range_max'], 0))
+            if (bucket.range_min != range_max or
+                    bucket.range_max <= bucket.range_min):
+                raise ValueError('Bucket ranges are not contiguous.')
+            range_max = bucket.range_max
+            bucket.last_accessed = bucket_data['last_accessed']
+            for data in bucket_data['contacts']:
+                contact = _contact_from_list(data)
+                bucket._contacts[contact.network_id_int] = contact
+            for data in bucket_data['replacements']:
+                contact = _contact_from_list(data)
+                bucket._replacement_cache[contact.network_id_int] = contact
+            buckets.append(bucket)
+        if range_max != 2 ** 512:
+            raise ValueError('Bucket ranges do not cover the key space.')
+        routing_table = cls(snapshot['parent_node_id'],
+                            b=snapshot.get('b', constants.B))
+        blacklist = set(int(network_id, 0)
+                        for network_id in snapshot['blacklist'])
+        routing_table._restore(buckets, blacklist)
+        return routing_table
+
+    def _restore(self, buckets, blacklist):
+        """
+        Replaces the buckets and blacklist of the routing table.
+        """
+        self._buckets = buckets
+        self._bucket_mins = [bucket.range_min for bucket in buckets]
+        self._blacklist = blacklist
+        self._refresh_queue = [
+            (self._refresh_due(bucket.last_accessed), bucket.range_min)
+            for bucket in buckets]
+        heapq.heapify(self._refresh_queue)
+
+    def save(self, filename):
+        """
+        Writes a snapshot of the routing table to the named file (so the node
+        can be restarted without having to rediscover the network).
+        """
+        with open(filename, 'w') as f:
+            json.dump(self.snapshot(), f, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Returns a new routing table with the state saved in the named file.
+        """
+        with open(filename) as f:
+            return cls.from_snapshot(json.load(f))
+
+
+class ConcurrentRoutingTable(RoutingTable):
+    """
+    A routing table that may be safely shared between threads.
+
+    Changes to the routing table are serialized by a lock and made using
+    copy-on-write: a bucket is copied before it is changed for the first time
+    during an update and, once the update is complete, a new (read only)
+    snapshot of the routing table is published. Lookups (find_close_nodes
+    and get_contact) use the most recently published snapshot, so they never
+    take the lock, never block each other and never see a partially split
+    bucket. Since get_refresh_list updates the refresh schedule it is
+    treated as an update.
+    """
+
+    def __init__(self, parent_node_id, metrics=None, b=constants.B):
+        """
+        The parent_node_id is the 512-bit ID of the node to which this routing
+        table belongs. See RoutingTable for details of metrics and b.
+        """
+        super().__init__(parent_node_id, metrics, b)
+        # Serializes changes to the routing table. Re-entrant since some
+        # updates are built from others (e.g. blacklist calls
+        # remove_contact).
+        self._lock = threading.RLock()
+        # The ids of the buckets that are not part of the published snapshot
+        # (so can be changed in place) during the current update.
+        self._private_buckets = set()
+        self._publish()
+
+    def _bucket_for_update(self, bucket_index):
+        """
+        Returns the bucket at the specified index so it can be changed. If the
+        bucket is part of the published snapshot then it is replaced by a copy
+        first.
+        """
+        bucket = self._buckets[bucket_index]
+        if id(bucket) not in self._private_buckets:
+            bucket = bucket.copy()
+            self._buckets[bucket_index] = bucket
+            self._private_buckets.add(id(bucket))
+        return bucket
+
+    def _publish(self):
+        """
+        Publishes the current state of the routing table as the snapshot used
+        for lookups.
+        """
+        snapshot = RoutingTable(self._parent_node_id, self.metrics, self._b)
+        snapshot._buckets = list(self._buckets)
+        snapshot._bucket_mins = list(self._bucket_mins)
+        snapshot._blacklist = self._blacklist
+        self._private_buckets = set()
+        # Replacing the reference is atomic so readers see either the old or
+        # the new snapshot.
+        self._snapshot = snapshot
+
+    def _restore(self, buckets, blacklist):
+        with self._lock:
+            try:
+                super()._restore(buckets, blacklist)
+            finally:
+                self._publish()
+
+    def snapshot(self):
+        with self._lock:
+            return super().snapshot()
+
+    def blacklist(self, contact):
+        with self._lock:
+            try:
+                super().blacklist(contact)
+            finally:
+                self._publish()
+
+    def add_contact(self, contact):
+        with self._lock:
+            try:
+                super().add_contact(contact)
+            finally:
+                self._publish()
+
+    def add_contacts(self, contacts):
+        with self._lock:
+            try:
+                return super().add_contacts(contacts)
+            finally:
+                self._publish()
+
+    def remove_contact(self, network_id, forced=False):
+        with self._lock:
+            try:
+                super().remove_contact(network_id, forced)
+            finally:
+                self._publish()
+
+    def touch_bucket(self, key):
+        # Only the bucket's last_accessed attribute changes (atomically) so
+        # the bucket is updated in place rather than copied.
+        with self._lock:
+            bucket_index = self._bucket_index(key)
+            self._buckets[bucket_index].last_accessed = int(time.time())
+
+    def find_close_nodes(self, key, network_id=None, latency_aware=False):
+        return self._snapshot.find_close_nodes(key, network_id,
+                                               latency_aware)
+
+    def get_contact(self, network_id):
+        return self._snapshot.get_contact(network_id)
+
+    def stats(self):
+        return self._snapshot.stats()
+
+    def get_refresh_list(self, start_index=0, force=False):
+        # Finding the buckets to refresh updates the refresh schedule so it
+        # takes the lock.
+        with self._lock:
+            return super().get_refresh_list(start_index, force)
@@ -8,12 +8,14 @@ from .constants import K
 
 def distance(key_one, key_two):
     """
-    Calculate the XOR result between two string representations of hex values.
-    Returned as an int.
+    Calculate the XOR result between two keys expressed as either string
+    representations of hex values or integers. Returned as an int.
     """
-    val_key_one = int(key_one, 0)
-    val_key_two = int(key_two, 0)
-    return val_key_one ^ val_key_two
+    if isinstance(key_one, str):
+        key_one = int(key_one, 0)
+    if isinstance(key_two, str):
+        key_two = int(key_two, 0)
+    return key_one ^ key_two
 
 
 def sort_peer_nodes(peer_nodes, target_key):
@@ -22,12 +24,41 @@ def sort_peer_nodes(peer_nodes, target_key):
     to the target key are at the head. If the list is longer than K then only
     the K closest contacts will be returned.
     """
+    if isinstance(target_key, str):
+        target_key = int(target_key, 0)
+
     # Key function
     def node_key(node):
         """
         Returns the node's distance to the target key.
         """
-        return distance(node.network_id, target_key)
+        return node.network_id_int ^ target_key
 
     peer_nodes.sort(key=node_key)
     return peer_nodes[:K]
+
+
+def sort_peer_nodes_by_latency(peer_nodes, target_key):
+    """
+    Given a list of peer nodes, sorts it so that peers in the same distance
+    "rank" from the target key (those whose distance from the key has the
+    same number of bits, i.e. sharing the same length prefix with the key)
+    are ordered fastest first by their smoothed round trip time. Peers with
+    no round trip time estimate come after the others in their rank. Ranks
+    closer to the target key come first. Returns the sorted list.
+    """
+    if isinstance(target_key, str):
+        target_key = int(target_key, 0)
+
+    # Key function
+    def node_key(node):
+        """
+        Returns the node's distance rank and round trip time.
+        """
+        rank = (node.network_id_int ^ target_key).bit_length()
+        if node.srtt is None:
+            return (rank, 1, 0)
+        return (rank, 0, node.srtt)
+
+    peer_nodes.sort(key=node_key)
+    return peer_nodes
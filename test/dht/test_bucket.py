@@ -27,7 +27,7 @@ class TestBucket(unittest.TestCase):
         self.assertEqual(range_max, bucket.range_max,
                          "Bucket rangeMax not initialised correctly.")
         # The contacts list exists and is empty
-        self.assertEqual([], bucket._contacts,
+        self.assertEqual([], bucket.get_contacts(),
                          "Bucket contact list not initialised correctly.")
         # Last access timestamp is correct
         self.assertEqual(0, bucket.last_accessed)
@@ -52,7 +52,7 @@ class TestBucket(unittest.TestCase):
         bucket.add_contact(contact2)
         self.assertEqual(2, len(bucket._contacts),
                          "K-bucket's contact list not the expected length.")
-        self.assertEqual(contact2, bucket._contacts[-1:][0],
+        self.assertEqual(contact2, bucket.get_contacts()[-1],
                          "K-bucket's most recent (last) contact wrong.")
 
     def test_add_existing_contact(self):
@@ -74,7 +74,7 @@ class TestBucket(unittest.TestCase):
         self.assertEqual(2, len(bucket._contacts),
                          "Too many contacts in the k-bucket.")
         # The end contact should be the most recently added contact.
-        self.assertEqual(contact1, bucket._contacts[-1:][0],
+        self.assertEqual(contact1, bucket.get_contacts()[-1],
                          "The expected most recent contact is wrong.")
 
     def test_add_contact_to_full_bucket(self):
@@ -108,6 +108,60 @@ class TestBucket(unittest.TestCase):
             self.assertTrue(bucket.get_contact(hex(i)),
                             "Could not get contact with id %d" % i)
 
+    def test_get_contact_int_or_peer_node(self):
+        """
+        Ensures a contact can be retrieved from the k-bucket with its id
+        expressed as an integer or as a PeerNode instance.
+        """
+        bucket = Bucket(12345, 98765)
+        contact = PeerNode(PUBLIC_KEY, "192.168.0.1", 9999, 123)
+        contact.network_id = hex(1)
+        bucket.add_contact(contact)
+        self.assertIs(contact, bucket.get_contact(1))
+        other = PeerNode(PUBLIC_KEY, "192.168.0.2", 8888, 123)
+        other.network_id = hex(1)
+        self.assertIs(contact, bucket.get_contact(other))
+
+    def test_add_existing_contact_replaces_instance(self):
+        """
+        Ensures that if a contact with the same id is re-added then the new
+        PeerNode instance (with the most up-to-date details) is stored.
+        """
+        bucket = Bucket(12345, 98765)
+        contact1 = PeerNode(PUBLIC_KEY, "192.168.0.1", 9999, 123)
+        contact1.network_id = hex(1)
+        bucket.add_contact(contact1)
+        contact2 = PeerNode(PUBLIC_KEY, "192.168.0.2", 8888, 123)
+        contact2.network_id = hex(2)
+        bucket.add_contact(contact2)
+        updated = PeerNode(PUBLIC_KEY, "192.168.0.3", 7777, 123)
+        updated.network_id = hex(1)
+        bucket.add_contact(updated)
+        self.assertEqual(2, len(bucket))
+        self.assertIs(contact2, bucket.get_contacts()[0])
+        self.assertIs(updated, bucket.get_contacts()[1])
+
+    def test_add_existing_contact_keeps_rtt(self):
+        """
+        Ensures that if a contact is re-added as a new PeerNode instance
+        without a round trip time estimate then the estimate from the existing
+        instance is kept (but a new estimate is not overwritten).
+        """
+        bucket = Bucket(0, 2 ** 512)
+        contact = PeerNode(PUBLIC_KEY, "192.168.0.1", 9999, 123)
+        contact.record_rtt(0.1)
+        contact.record_timeout()
+        bucket.add_contact(contact)
+        updated = PeerNode(PUBLIC_KEY, "192.168.0.1", 9999, 123)
+        bucket.add_contact(updated)
+        self.assertEqual(0.1, updated.srtt)
+        self.assertEqual(0.05, updated.rttvar)
+        self.assertEqual(1, updated.timeouts)
+        newer = PeerNode(PUBLIC_KEY, "192.168.0.1", 9999, 123)
+        newer.record_rtt(0.3)
+        bucket.add_contact(newer)
+        self.assertEqual(0.3, newer.srtt)
+
     def test_get_contact_with_bad_id(self):
         """
         Ensures a ValueError exception is raised if one attempts to get a
@@ -188,7 +242,7 @@ class TestBucket(unittest.TestCase):
             bucket.add_contact(contact)
         for i in range(K):
             bucket.remove_contact(hex(i))
-            self.assertFalse(hex(i) in bucket._contacts,
+            self.assertFalse(i in bucket._contacts,
                              "Could not remove contact with id %s" % hex(i))
 
     def test_remove_contact_with_bad_id(self):
@@ -204,6 +258,68 @@ class TestBucket(unittest.TestCase):
         with self.assertRaises(ValueError):
             bucket.remove_contact("54321")
 
+    def test_add_replacement(self):
+        """
+        Ensures contacts are added to the end of the replacement cache and an
+        existing contact is moved to the end.
+        """
+        bucket = Bucket(12345, 98765)
+        contacts = []
+        for i in range(3):
+            contact = PeerNode(PUBLIC_KEY, "192.168.0.%d" % i, 9999, 123)
+            contact.network_id = hex(i)
+            bucket.add_replacement(contact)
+            contacts.append(contact)
+        self.assertEqual(contacts, bucket.get_replacements())
+        bucket.add_replacement(contacts[0])
+        self.assertEqual(contacts[1:] + contacts[:1],
+                         bucket.get_replacements())
+
+    def test_add_replacement_full(self):
+        """
+        Ensures the replacement cache holds at most K contacts and discards
+        the least recently seen contact when full.
+        """
+        bucket = Bucket(12345, 98765)
+        for i in range(K + 1):
+            contact = PeerNode(PUBLIC_KEY, "192.168.0.%d" % i, 9999, 123)
+            contact.network_id = hex(i)
+            bucket.add_replacement(contact)
+        replacements = bucket.get_replacements()
+        self.assertEqual(K, len(replacements))
+        self.assertEqual(hex(1), replacements[0].network_id)
+        self.assertEqual(hex(K), replacements[-1].network_id)
+
+    def test_remove_replacement(self):
+        """
+        Ensures a contact is removed from the replacement cache and removing
+        an unknown contact is silently ignored.
+        """
+        bucket = Bucket(12345, 98765)
+        contact = PeerNode(PUBLIC_KEY, "192.168.0.1", 9999, 123)
+        contact.network_id = hex(1)
+        bucket.add_replacement(contact)
+        bucket.remove_replacement(hex(2))
+        self.assertEqual([contact], bucket.get_replacements())
+        bucket.remove_replacement(hex(1))
+        self.assertEqual([], bucket.get_replacements())
+
+    def test_pop_replacement(self):
+        """
+        Ensures the most recently seen contact is popped from the replacement
+        cache and None is returned when the cache is empty.
+        """
+        bucket = Bucket(12345, 98765)
+        self.assertEqual(None, bucket.pop_replacement())
+        contact1 = PeerNode(PUBLIC_KEY, "192.168.0.1", 9999, 123)
+        contact1.network_id = hex(1)
+        contact2 = PeerNode(PUBLIC_KEY, "192.168.0.2", 9999, 123)
+        contact2.network_id = hex(2)
+        bucket.add_replacement(contact1)
+        bucket.add_replacement(contact2)
+        self.assertIs(contact2, bucket.pop_replacement())
+        self.assertEqual([contact1], bucket.get_replacements())
+
     def test_key_in_range_yes(self):
         """
         Ensures that a key within the appropriate range is identified as such.
@@ -211,6 +327,31 @@ class TestBucket(unittest.TestCase):
         bucket = Bucket(1, 9)
         self.assertTrue(bucket.key_in_range(2))
 
+    def test_copy(self):
+        """
+        Ensures a copy of a bucket has the same range, contacts, replacement
+        cache and last_accessed timestamp but can be changed independently of
+        the original.
+        """
+        bucket = Bucket(1, 2 ** 512)
+        contact1 = PeerNode(PUBLIC_KEY, "192.168.0.1", 9999, 0)
+        contact1.network_id = hex(2)
+        contact2 = PeerNode(PUBLIC_KEY, "192.168.0.2", 9999, 0)
+        contact2.network_id = hex(3)
+        bucket.add_contact(contact1)
+        bucket.add_replacement(contact2)
+        bucket.last_accessed = 123
+        result = bucket.copy()
+        self.assertEqual(1, result.range_min)
+        self.assertEqual(2 ** 512, result.range_max)
+        self.assertEqual([contact1], result.get_contacts())
+        self.assertEqual([contact2], result.get_replacements())
+        self.assertEqual(123, result.last_accessed)
+        result.remove_contact(contact1)
+        result.pop_replacement()
+        self.assertEqual([contact1], bucket.get_contacts())
+        self.assertEqual([contact2], bucket.get_replacements())
+
     def test_key_in_range_no_too_low(self):
         """
         Ensures a key just below the k-bucket's range is identified as out of
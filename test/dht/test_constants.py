@@ -29,6 +29,15 @@ class TestConstants(unittest.TestCase):
                               "constants.K must be an integer.")
         self.assertEqual(0, constants.K % 2)
 
+    def test_B(self):
+        """
+        The symbol size defines the number of bits of a key resolved by each
+        step of a lookup.
+        """
+        self.assertIsInstance(constants.B, int,
+                              "constants.B must be an integer.")
+        self.assertTrue(constants.B >= 1, "constants.B must be at least 1.")
+
     def test_LOOKUP_TIMEOUT(self):
         """
         The lookup timeout defines the default maximum amount of time a node
@@ -45,6 +54,35 @@ class TestConstants(unittest.TestCase):
         self.assertIsInstance(constants.RPC_TIMEOUT, int,
                               "constants.RPC_TIMEOUT must be an integer.")
 
+    def test_RPC_TIMEOUT_MIN(self):
+        """
+        The minimum rpc timeout defines the shortest adaptive timeout (in
+        seconds) given to a peer.
+        """
+        self.assertIsInstance(constants.RPC_TIMEOUT_MIN, (int, float),
+                              "constants.RPC_TIMEOUT_MIN must be a number.")
+        self.assertTrue(0 < constants.RPC_TIMEOUT_MIN < constants.RPC_TIMEOUT)
+
+    def test_RPC_TIMEOUT_INITIAL(self):
+        """
+        The initial rpc timeout defines the adaptive timeout (in seconds)
+        given to a peer whose round trip time is unknown.
+        """
+        self.assertIsInstance(constants.RPC_TIMEOUT_INITIAL, (int, float),
+                              "constants.RPC_TIMEOUT_INITIAL must be a " +
+                              "number.")
+        self.assertTrue(constants.RPC_TIMEOUT_MIN <=
+                        constants.RPC_TIMEOUT_INITIAL <=
+                        constants.RPC_TIMEOUT)
+
+    def test_RPC_TIMEOUT_K(self):
+        """
+        Defines how many round trip time variations are added to a peer's
+        smoothed round trip time to give its adaptive timeout.
+        """
+        self.assertIsInstance(constants.RPC_TIMEOUT_K, int,
+                              "constants.RPC_TIMEOUT_K must be an integer.")
+
     def test_REFRESH_TIMEOUT(self):
         """
         The refresh timeout defines how long to wait (in seconds) before an
@@ -53,6 +91,15 @@ class TestConstants(unittest.TestCase):
         self.assertIsInstance(constants.REFRESH_TIMEOUT, int,
                               "constants.REFRESH_TIMEOUT must be an integer.")
 
+    def test_REFRESH_JITTER(self):
+        """
+        The refresh jitter defines the maximum random delay (in seconds) added
+        to the time a k-bucket is next due to be refreshed.
+        """
+        self.assertIsInstance(constants.REFRESH_JITTER, int,
+                              "constants.REFRESH_JITTER must be an integer.")
+        self.assertTrue(constants.REFRESH_JITTER < constants.REFRESH_TIMEOUT)
+
     def test_REPLICATE_INTERVAL(self):
         """
         The replication interval defines how long to wait (in seconds) before a
@@ -81,6 +128,32 @@ class TestConstants(unittest.TestCase):
                               "constants.ALLOWED_RPC_FAILS must be an " +
                               "integer.")
 
+    def test_KEY_CACHE_SIZE(self):
+        """
+        The key cache size defines the maximum number of parsed RSA keys that
+        are remembered.
+        """
+        self.assertIsInstance(constants.KEY_CACHE_SIZE, int,
+                              "constants.KEY_CACHE_SIZE must be an integer.")
+
+    def test_VERIFICATION_CACHE_SIZE(self):
+        """
+        The verification cache size defines the maximum number of successful
+        verifications that are remembered.
+        """
+        self.assertIsInstance(constants.VERIFICATION_CACHE_SIZE, int,
+                              "constants.VERIFICATION_CACHE_SIZE must be an " +
+                              "integer.")
+
+    def test_NETWORK_ID_CACHE_SIZE(self):
+        """
+        The network ID cache size defines the maximum number of public keys
+        whose network IDs are remembered.
+        """
+        self.assertIsInstance(constants.NETWORK_ID_CACHE_SIZE, int,
+                              "constants.NETWORK_ID_CACHE_SIZE must be an " +
+                              "integer.")
+
     def test_DUPLICATION_COUNT(self):
         """
         The duplication count defines the number of nodes to attempt to use to
@@ -4,12 +4,68 @@ Ensures details of contacts (peer nodes on the network) are represented
 correctly.
 """
 from hashlib import sha512
-from p4p2p.dht.contact import PeerNode
+from p4p2p.dht.contact import PeerNode, get_network_id, is_valid_network_id
 from p4p2p.version import get_version
+from p4p2p.dht import constants
 from .keys import PUBLIC_KEY
 import unittest
 
 
+class TestGetNetworkId(unittest.TestCase):
+    """
+    Ensures the get_network_id function works as expected.
+    """
+
+    def setUp(self):
+        """
+        Start each test with an empty cache.
+        """
+        get_network_id.cache_clear()
+
+    def test_get_network_id(self):
+        """
+        Ensures the network id is the SHA512 of the public key.
+        """
+        digest = sha512(PUBLIC_KEY.encode('ascii')).digest()
+        self.assertEqual(int.from_bytes(digest, 'big'),
+                         get_network_id(PUBLIC_KEY))
+
+    def test_cached(self):
+        """
+        Ensures the network id for a public key is only calculated once and
+        the hits and misses are counted.
+        """
+        get_network_id(PUBLIC_KEY)
+        PeerNode(PUBLIC_KEY, '192.168.0.1', 9999, get_version())
+        PeerNode(''.join(list(PUBLIC_KEY)), '192.168.0.1', 9999,
+                 get_version())
+        info = get_network_id.cache_info()
+        self.assertEqual(1, info.misses)
+        self.assertEqual(2, info.hits)
+        self.assertEqual(1, info.currsize)
+
+    def test_cache_bounded(self):
+        """
+        Ensures the cache doesn't grow beyond its maximum size.
+        """
+        info = get_network_id.cache_info()
+        for i in range(info.maxsize + 10):
+            get_network_id(str(i))
+        self.assertEqual(info.maxsize, get_network_id.cache_info().currsize)
+
+    def test_is_valid_network_id(self):
+        """
+        Ensures a network id (as a hex string or integer) is only valid if it
+        matches the public key.
+        """
+        network_id = get_network_id(PUBLIC_KEY)
+        self.assertTrue(is_valid_network_id(PUBLIC_KEY, network_id))
+        self.assertTrue(is_valid_network_id(PUBLIC_KEY, hex(network_id)))
+        self.assertFalse(is_valid_network_id(PUBLIC_KEY, network_id + 1))
+        self.assertFalse(is_valid_network_id(PUBLIC_KEY, hex(1)))
+        self.assertFalse(is_valid_network_id(PUBLIC_KEY, 'foo'))
+
+
 class TestPeerNode(unittest.TestCase):
     """
     Ensures the PeerNode class works as expected.
@@ -57,6 +113,136 @@ class TestPeerNode(unittest.TestCase):
         contact2 = PeerNode(PUBLIC_KEY, address, port, version, last_seen)
         self.assertTrue(contact1 == contact2)
 
+    def test_init_network_id_int_and_bytes(self):
+        """
+        Ensures the integer and raw bytes forms of the network id are stored
+        alongside the hex string representation.
+        """
+        digest = sha512(PUBLIC_KEY.encode('ascii')).digest()
+        contact = PeerNode(PUBLIC_KEY, '192.168.0.1', 9999, get_version())
+        self.assertEqual(int(contact.network_id, 0), contact.network_id_int)
+        self.assertEqual(int.from_bytes(digest, 'big'),
+                         contact.network_id_int)
+        self.assertEqual(digest, contact.network_id_bytes)
+
+    def test_set_network_id(self):
+        """
+        Ensures that setting the network id as a hex string also updates the
+        integer and raw bytes forms.
+        """
+        contact = PeerNode(PUBLIC_KEY, '192.168.0.1', 9999, get_version())
+        contact.network_id = hex(1234)
+        self.assertEqual(hex(1234), contact.network_id)
+        self.assertEqual(1234, contact.network_id_int)
+        self.assertEqual(64, len(contact.network_id_bytes))
+        self.assertEqual(1234, int.from_bytes(contact.network_id_bytes,
+                                              'big'))
+
+    def test_set_canonical_network_id(self):
+        """
+        Ensures a network id in the canonical form (including one with leading
+        zeros) round trips without being stored as a string.
+        """
+        contact = PeerNode(PUBLIC_KEY, '192.168.0.1', 9999, get_version())
+        network_id = '0x' + '00' + 'ab' * 63
+        contact.network_id = network_id
+        self.assertEqual(network_id, contact.network_id)
+        self.assertIsNone(contact._network_id)
+        self.assertEqual(int(network_id, 0), contact.network_id_int)
+
+    def test_slots(self):
+        """
+        Ensures PeerNode instances don't have a per-instance __dict__.
+        """
+        contact = PeerNode(PUBLIC_KEY, '192.168.0.1', 9999, get_version())
+        self.assertFalse(hasattr(contact, '__dict__'))
+        with self.assertRaises(AttributeError):
+            contact.foo = 'bar'
+
+    def test_public_key_interned(self):
+        """
+        Ensures contacts created from equal (but distinct) public key strings
+        share the same string object.
+        """
+        key1 = ''.join(list(PUBLIC_KEY))
+        key2 = ''.join(list(PUBLIC_KEY))
+        self.assertIsNot(key1, key2)
+        contact1 = PeerNode(key1, '192.168.0.1', 9999, get_version())
+        contact2 = PeerNode(key2, '192.168.0.1', 9999, get_version())
+        self.assertIs(contact1.public_key, contact2.public_key)
+
+    def test_init_rtt(self):
+        """
+        Ensures a new contact has no round trip time estimate.
+        """
+        contact = PeerNode(PUBLIC_KEY, '192.168.0.1', 9999, get_version())
+        self.assertIsNone(contact.srtt)
+        self.assertIsNone(contact.rttvar)
+
+    def test_record_rtt(self):
+        """
+        Ensures the smoothed round trip time and its variation are set from
+        the first round trip time and then updated as described in RFC 6298.
+        """
+        contact = PeerNode(PUBLIC_KEY, '192.168.0.1', 9999, get_version())
+        contact.record_rtt(0.1)
+        self.assertEqual(0.1, contact.srtt)
+        self.assertEqual(0.05, contact.rttvar)
+        contact.record_rtt(0.5)
+        self.assertAlmostEqual(0.75 * 0.05 + 0.25 * 0.4, contact.rttvar)
+        self.assertAlmostEqual(0.875 * 0.1 + 0.125 * 0.5, contact.srtt)
+
+    def test_rpc_timeout(self):
+        """
+        Ensures the adaptive timeout is the smoothed round trip time plus
+        RPC_TIMEOUT_K times its variation, within the minimum and maximum.
+        """
+        contact = PeerNode(PUBLIC_KEY, '192.168.0.1', 9999, get_version())
+        # Nothing is known about the peer.
+        self.assertEqual(constants.RPC_TIMEOUT_INITIAL, contact.rpc_timeout())
+        self.assertEqual(0.5, contact.rpc_timeout(0.5))
+        contact.srtt = 0.5
+        contact.rttvar = 0.1
+        expected = 0.5 + constants.RPC_TIMEOUT_K * 0.1
+        self.assertAlmostEqual(expected, contact.rpc_timeout())
+        self.assertEqual(0.5, contact.rpc_timeout(maximum=0.5))
+        self.assertEqual(2, contact.rpc_timeout(minimum=2))
+
+    def test_record_timeout(self):
+        """
+        Ensures each timeout doubles the adaptive timeout and that a timeout
+        only counts as a failure once the peer was given the maximum time.
+        A recorded round trip time resets the backoff.
+        """
+        contact = PeerNode(PUBLIC_KEY, '192.168.0.1', 9999, get_version())
+        self.assertTrue(contact.record_timeout(maximum=0.5))
+        self.assertEqual(0, contact.timeouts)
+        self.assertFalse(contact.record_timeout())
+        self.assertEqual(1, contact.timeouts)
+        self.assertEqual(2 * constants.RPC_TIMEOUT_INITIAL,
+                         contact.rpc_timeout())
+        contact.timeouts = 0
+        contact.srtt = 0.4
+        contact.rttvar = 0.1
+        self.assertFalse(contact.record_timeout(maximum=3))
+        self.assertEqual(1, contact.timeouts)
+        self.assertAlmostEqual(1.6, contact.rpc_timeout(maximum=3))
+        self.assertFalse(contact.record_timeout(maximum=3))
+        self.assertEqual(3, contact.rpc_timeout(maximum=3))
+        self.assertTrue(contact.record_timeout(maximum=3))
+        self.assertEqual(2, contact.timeouts)
+        contact.record_rtt(0.4)
+        self.assertEqual(0, contact.timeouts)
+
+    def test_eq_int(self):
+        """
+        Makes sure equality works between an integer representation of an ID
+        and a PeerNode object.
+        """
+        contact = PeerNode(PUBLIC_KEY, '192.168.0.1', 9999, get_version())
+        self.assertTrue(contact.network_id_int == contact)
+        self.assertFalse(contact.network_id_int + 1 == contact)
+
     def test_eq_wrong_type(self):
         """
         Ensure equality returns false if comparing a PeerNode with some other
@@ -67,7 +253,7 @@ class TestPeerNode(unittest.TestCase):
         version = get_version()
         last_seen = 123
         contact = PeerNode(PUBLIC_KEY, address, port, version, last_seen)
-        self.assertFalse(12345 == contact)
+        self.assertFalse(12345.0 == contact)
 
     def test_ne(self):
         """
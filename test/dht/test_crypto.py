@@ -2,9 +2,25 @@
 """
 Ensures the cryptographic signing and related functions work as expected.
 """
-from p4p2p.dht.crypto import get_signed_item, verify_item, _get_hash
+from p4p2p.dht.crypto import (get_signed_item, verify_item, _get_hash,
+                              _get_hash_v2, _get_unsigned_hash,
+                              verify_items, key_cache_info, clear_key_cache,
+                              HASH_VERSION, SCHEMES, SignatureScheme,
+                              Ed25519Scheme, VerificationCache,
+                              verification_cache, HashedTree,
+                              get_inclusion_proof, verify_inclusion_proof,
+                              Signer)
+from p4p2p.dht import crypto
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from hashlib import sha512
-from .keys import PRIVATE_KEY, PUBLIC_KEY, BAD_PUBLIC_KEY
+from .keys import (PRIVATE_KEY, PUBLIC_KEY, BAD_PUBLIC_KEY,
+                   ED25519_PRIVATE_KEY, ED25519_PUBLIC_KEY)
+import base64
+import copy
+import json
+import sys
+import threading
+import time
 import unittest
 import uuid
 
@@ -37,8 +53,64 @@ class TestGetSignedItem(unittest.TestCase):
         self.assertIsInstance(metadata['public_key'], str)
         self.assertIn('signature', metadata)
         self.assertIsInstance(metadata['signature'], str)
+        self.assertNotIn('hash_version', metadata)
         self.assertEqual(5, len(metadata))
 
+    def test_default_hash_version(self):
+        """
+        Ensure items are signed with version 1 of the canonical hash by
+        default (so nodes that haven't been upgraded can verify them).
+        """
+        self.assertEqual(1, HASH_VERSION)
+
+    def test_hash_version_2(self):
+        """
+        Ensure an item signed with version 2 of the canonical hash says so in
+        its metadata and is verifiable.
+        """
+        item = {
+            'foo': 'bar',
+            'baz': [1, 2, 3]
+        }
+        signed_item = get_signed_item(item, PUBLIC_KEY, PRIVATE_KEY,
+                                      hash_version=2)
+        self.assertEqual(2, signed_item['_p4p2p']['hash_version'])
+        self.assertEqual(6, len(signed_item['_p4p2p']))
+        self.assertTrue(verify_item(signed_item))
+
+    def test_scheme_ed25519(self):
+        """
+        Ensure an item signed with Ed25519 names the scheme in its metadata
+        and is verifiable.
+        """
+        item = {
+            'foo': 'bar',
+            'baz': [1, 2, 3]
+        }
+        signed_item = get_signed_item(item, ED25519_PUBLIC_KEY,
+                                      ED25519_PRIVATE_KEY, scheme='ed25519')
+        metadata = signed_item['_p4p2p']
+        self.assertEqual('ed25519', metadata['scheme'])
+        self.assertEqual(ED25519_PUBLIC_KEY, metadata['public_key'])
+        self.assertEqual(6, len(metadata))
+        self.assertTrue(verify_item(signed_item))
+
+    def test_unsupported_scheme(self):
+        """
+        Ensure a ValueError is raised for an unknown signature scheme.
+        """
+        with self.assertRaises(ValueError):
+            get_signed_item({'foo': 'bar'}, PUBLIC_KEY, PRIVATE_KEY,
+                            scheme='foo')
+
+    def test_unsupported_hash_version(self):
+        """
+        Ensure a ValueError is raised for an unknown hash version.
+        """
+        with self.assertRaises(ValueError):
+            get_signed_item({'foo': 'bar'}, PUBLIC_KEY, PRIVATE_KEY,
+                            hash_version=3)
+
     def test_expires(self):
         """
         Ensure the expires argument is handled and checked appropriately.
@@ -131,6 +203,789 @@ class TestVerifyItem(unittest.TestCase):
         signed_item['_p4p2p']['public_key'] = BAD_PUBLIC_KEY
         self.assertFalse(verify_item(item))
 
+    def test_modified_metadata(self):
+        """
+        The metadata of the item does not match the hash / signature.
+        """
+        item = {
+            'foo': 'bar',
+            'baz': [1, 2, 3]
+        }
+        signed_item = get_signed_item(item, PUBLIC_KEY, PRIVATE_KEY, 100)
+        signed_item['_p4p2p']['expires'] += 1
+        self.assertFalse(verify_item(signed_item))
+
+    def test_modified_ed25519_item(self):
+        """
+        The content of an Ed25519 signed item does not match the signature.
+        """
+        signed_item = get_signed_item({'foo': 'bar'}, ED25519_PUBLIC_KEY,
+                                      ED25519_PRIVATE_KEY, scheme='ed25519')
+        signed_item['foo'] = 'baz'
+        self.assertFalse(verify_item(signed_item))
+
+    def test_modified_scheme(self):
+        """
+        The scheme is part of the signed metadata and must match the type of
+        the public key.
+        """
+        signed_item = get_signed_item({'foo': 'bar'}, ED25519_PUBLIC_KEY,
+                                      ED25519_PRIVATE_KEY, scheme='ed25519')
+        del signed_item['_p4p2p']['scheme']
+        self.assertFalse(verify_item(signed_item))
+        signed_item['_p4p2p']['scheme'] = 'foo'
+        self.assertFalse(verify_item(signed_item))
+        signed_item = get_signed_item({'foo': 'bar'}, PUBLIC_KEY, PRIVATE_KEY)
+        signed_item['_p4p2p']['scheme'] = 'ed25519'
+        self.assertFalse(verify_item(signed_item))
+
+    def test_hash_versions(self):
+        """
+        Items are only verified if they were signed with one of the accepted
+        versions of the canonical hash.
+        """
+        item = {'foo': 'bar'}
+        v1_item = get_signed_item(item, PUBLIC_KEY, PRIVATE_KEY,
+                                  hash_version=1)
+        v2_item = get_signed_item(item, PUBLIC_KEY, PRIVATE_KEY,
+                                  hash_version=2)
+        self.assertTrue(verify_item(v1_item))
+        self.assertTrue(verify_item(v2_item))
+        self.assertFalse(verify_item(v1_item, hash_versions=(2, )))
+        self.assertTrue(verify_item(v2_item, hash_versions=(2, )))
+        self.assertFalse(verify_item(v2_item, hash_versions=(1, )))
+
+    def test_modified_hash_version(self):
+        """
+        The hash version is part of the signed metadata.
+        """
+        signed_item = get_signed_item({'foo': 'bar'}, PUBLIC_KEY, PRIVATE_KEY,
+                                      hash_version=2)
+        del signed_item['_p4p2p']['hash_version']
+        self.assertFalse(verify_item(signed_item))
+        signed_item['_p4p2p']['hash_version'] = 3
+        self.assertFalse(verify_item(signed_item))
+
+    def test_item_unaffected(self):
+        """
+        Ensure verifying an item doesn't change it.
+        """
+        item = {
+            'foo': 'bar',
+            'baz': [1, {'qux': [2, 3]}]
+        }
+        signed_item = get_signed_item(item, PUBLIC_KEY, PRIVATE_KEY)
+        expected = copy.deepcopy(signed_item)
+        self.assertTrue(verify_item(signed_item))
+        self.assertEqual(expected, signed_item)
+        self.assertTrue(verify_item(signed_item))
+
+
+class TestVerifyItems(unittest.TestCase):
+    """
+    Ensures the p4p2p.daemon.crypto.verify_items function works as expected.
+    """
+
+    def setUp(self):
+        """
+        A batch of good and bad items.
+        """
+        self.items = []
+        for i in range(10):
+            signed_item = get_signed_item({'foo': i}, PUBLIC_KEY, PRIVATE_KEY)
+            if i % 3 == 0:
+                signed_item['foo'] = 'modified'
+            self.items.append(signed_item)
+        self.items.append({'foo': 'unsigned'})
+        self.expected = [i % 3 != 0 for i in range(10)] + [False]
+
+    def test_verify_items_ordered(self):
+        """
+        Ensures the results are in the same order as the items and that bad
+        items don't affect the others.
+        """
+        with ThreadPoolExecutor(4) as executor:
+            result = list(verify_items(self.items, executor, chunksize=3))
+        self.assertEqual(self.items, [item for item, _ in result])
+        self.assertEqual(self.expected, [verified for _, verified in result])
+
+    def test_verify_items_unordered(self):
+        """
+        Ensures every item is verified when results are returned as they
+        complete.
+        """
+        with ThreadPoolExecutor(4) as executor:
+            result = list(verify_items(iter(self.items), executor,
+                                       ordered=False, chunksize=2))
+        self.assertEqual(len(self.items), len(result))
+        for item, verified in result:
+            self.assertEqual(self.expected[self.items.index(item)], verified)
+
+    def test_verify_items_empty(self):
+        """
+        Ensures an empty batch gives no results.
+        """
+        with ThreadPoolExecutor(4) as executor:
+            self.assertEqual([], list(verify_items([], executor)))
+
+    def test_verify_items_bounded(self):
+        """
+        Ensures the items are read as results are returned, with no more than
+        max_pending chunks waiting to be verified, in both orders.
+        """
+        for ordered in (True, False):
+            read = []
+
+            def items():
+                for item in self.items:
+                    read.append(item)
+                    yield item
+
+            with ThreadPoolExecutor(2) as executor:
+                results = verify_items(items(), executor, ordered=ordered,
+                                       chunksize=2, max_pending=2)
+                next(results)
+                self.assertEqual(4, len(read))
+                rest = list(results)
+            self.assertEqual(len(self.items), len(rest) + 1)
+            self.assertEqual(len(self.items), len(read))
+
+    def test_verify_items_cache(self):
+        """
+        Ensures items verified in a batch are remembered in the cache (of this
+        process) and that the digest remembered for each item's signature is
+        sent to the executor with the item.
+        """
+        cache = VerificationCache()
+        with ProcessPoolExecutor(2) as executor:
+            result = list(verify_items(self.items, executor, chunksize=3,
+                                       cache=cache))
+            self.assertEqual(self.expected, [v for _, v in result])
+            info = cache.info()
+            self.assertEqual(0, info['hits'])
+            self.assertEqual(10, info['misses'])
+            self.assertEqual(6, info['size'])
+            submitted = []
+            submit = executor.submit
+
+            def record(function, chunk, *args):
+                submitted.extend(chunk)
+                return submit(function, chunk, *args)
+
+            executor.submit = record
+            result = list(verify_items(copy.deepcopy(self.items), executor,
+                                       chunksize=3, cache=cache))
+        self.assertEqual(self.expected, [v for _, v in result])
+        self.assertEqual(6, cache.info()['hits'])
+        self.assertEqual(self.items, [item for item, _ in submitted])
+        for (item, digest), verified in zip(submitted, self.expected):
+            if verified:
+                self.assertEqual(_get_unsigned_hash(item).digest(), digest)
+            else:
+                self.assertIsNone(digest)
+
+    def test_verify_items_hashed_by_executor(self):
+        """
+        Ensures that (with the default cache) the items are only hashed by
+        the executor, never in the calling thread.
+        """
+        verification_cache.clear()
+        threads = []
+        get_unsigned_hash = crypto._get_unsigned_hash
+
+        def record(item):
+            threads.append(threading.current_thread())
+            return get_unsigned_hash(item)
+
+        crypto._get_unsigned_hash = record
+        try:
+            with ThreadPoolExecutor(2) as executor:
+                for i in range(2):
+                    result = list(verify_items(self.items, executor,
+                                               chunksize=3))
+                    self.assertEqual(self.expected,
+                                     [v for _, v in result])
+        finally:
+            crypto._get_unsigned_hash = get_unsigned_hash
+            verification_cache.clear()
+        self.assertEqual(20, len(threads))
+        self.assertNotIn(threading.current_thread(), threads)
+
+    def test_verify_digest(self):
+        """
+        Ensures the signature of an item isn't checked again if its digest
+        is the one given (of an item already verified with the signature).
+        """
+        signed_item = self.items[1]
+        digest = _get_unsigned_hash(signed_item).digest()
+        self.assertEqual((True, digest), crypto._verify_digest(signed_item))
+        bad_item = copy.deepcopy(signed_item)
+        signature = bad_item['_p4p2p']['signature']
+        replacement = 'B' if signature[8] == 'A' else 'A'
+        bad_item['_p4p2p']['signature'] = (signature[:8] + replacement +
+                                           signature[9:])
+        self.assertEqual((False, digest), crypto._verify_digest(bad_item))
+        self.assertEqual((True, digest),
+                         crypto._verify_digest(bad_item, digest=digest))
+        self.assertEqual((False, digest),
+                         crypto._verify_digest(bad_item, digest=b'other'))
+        self.assertEqual((False, None),
+                         crypto._verify_digest({'foo': 'unsigned'}))
+
+    def test_verify_items_default_cache(self):
+        """
+        Ensures the verification cache is used by default (so a batch
+        verified again is found in it).
+        """
+        verification_cache.clear()
+        with ThreadPoolExecutor(2) as executor:
+            list(verify_items(self.items, executor))
+            list(verify_items(self.items, executor))
+        info = verification_cache.info()
+        self.assertEqual(6, info['hits'])
+        self.assertEqual(14, info['misses'])
+        verification_cache.clear()
+
+    def test_verify_items_without_cache(self):
+        """
+        Ensures every item is verified (and none remembered) without a cache.
+        """
+        verification_cache.clear()
+        with ThreadPoolExecutor(2) as executor:
+            result = list(verify_items(self.items, executor, cache=None))
+        self.assertEqual(self.expected, [v for _, v in result])
+        self.assertEqual(0, verification_cache.info()['size'])
+
+    def test_verify_items_process_pool(self):
+        """
+        Ensures the items are verified by a process pool by default.
+        """
+        result = list(verify_items(self.items, chunksize=4))
+        self.assertEqual(self.expected, [verified for _, verified in result])
+
+    def test_verify_items_chunk_fails(self):
+        """
+        Ensures an item that can't be sent to a worker process only fails
+        itself.
+        """
+        bad_item = get_signed_item({'foo': 'bar'}, PUBLIC_KEY, PRIVATE_KEY)
+        bad_item['foo'] = lambda: None
+        items = self.items[:2] + [bad_item]
+        with ProcessPoolExecutor(2) as executor:
+            result = list(verify_items(items, executor))
+        self.assertEqual([False, True, False],
+                         [verified for _, verified in result])
+
+
+class TestSigner(unittest.TestCase):
+    """
+    Ensures the p4p2p.daemon.crypto.Signer class works as expected.
+    """
+
+    def test_sign_matches_get_signed_item(self):
+        """
+        Ensures an item signed by a Signer has the same metadata as one
+        signed with get_signed_item and is verified.
+        """
+        item = {'foo': 'bar', 'baz': [1, 2, 3]}
+        signer = Signer(PUBLIC_KEY, PRIVATE_KEY)
+        signed_item = signer.sign(item, expires=60)
+        expected = get_signed_item(item, PUBLIC_KEY, PRIVATE_KEY, 60)
+        self.assertEqual(set(expected['_p4p2p']),
+                         set(signed_item['_p4p2p']))
+        self.assertNotIn('_p4p2p', item)
+        metadata = signed_item['_p4p2p']
+        self.assertEqual(metadata['timestamp'] + 60, metadata['expires'])
+        self.assertTrue(verify_item(signed_item, cache=None))
+
+    def test_sign_with_timestamp(self):
+        """
+        Ensures the given timestamp is used.
+        """
+        signer = Signer(PUBLIC_KEY, PRIVATE_KEY)
+        signed_item = signer.sign({'foo': 'bar'}, timestamp=123.0)
+        self.assertEqual(123.0, signed_item['_p4p2p']['timestamp'])
+        self.assertEqual(0.0, signed_item['_p4p2p']['expires'])
+        self.assertTrue(verify_item(signed_item, cache=None))
+
+    def test_metadata_not_shared(self):
+        """
+        Ensures each signed item has its own metadata.
+        """
+        signer = Signer(PUBLIC_KEY, PRIVATE_KEY)
+        first = signer.sign({'foo': 1})
+        second = signer.sign({'foo': 2})
+        self.assertIsNot(first['_p4p2p'], second['_p4p2p'])
+        self.assertNotEqual(first['_p4p2p']['signature'],
+                            second['_p4p2p']['signature'])
+
+    def test_sign_ed25519(self):
+        """
+        Ensures items can be signed with another scheme.
+        """
+        signer = Signer(ED25519_PUBLIC_KEY, ED25519_PRIVATE_KEY,
+                        scheme='ed25519')
+        signed_item = signer.sign({'foo': 'bar'})
+        self.assertEqual('ed25519', signed_item['_p4p2p']['scheme'])
+        self.assertTrue(verify_item(signed_item, cache=None))
+
+    def test_sign_hash_version_2(self):
+        """
+        Ensures items can be signed with version 2 of the canonical hash.
+        """
+        signer = Signer(PUBLIC_KEY, PRIVATE_KEY, hash_version=2)
+        signed_item = signer.sign({'foo': 'bar'})
+        self.assertEqual(2, signed_item['_p4p2p']['hash_version'])
+        self.assertTrue(verify_item(signed_item, cache=None))
+
+    def test_sign_hashed_tree(self):
+        """
+        Ensures a HashedTree can be signed.
+        """
+        tree = HashedTree({'foo': {'bar': [1, 2]}})
+        signer = Signer(PUBLIC_KEY, PRIVATE_KEY, hash_version=2)
+        signed_item = signer.sign(tree)
+        self.assertEqual({'bar': [1, 2]}, signed_item['foo'])
+        self.assertTrue(verify_item(signed_item, cache=None))
+
+    def test_unsupported_scheme(self):
+        """
+        Ensures a ValueError is raised for an unknown scheme.
+        """
+        with self.assertRaises(ValueError):
+            Signer(PUBLIC_KEY, PRIVATE_KEY, scheme='foo')
+
+    def test_unsupported_hash_version(self):
+        """
+        Ensures a ValueError is raised for an unknown hash version.
+        """
+        with self.assertRaises(ValueError):
+            Signer(PUBLIC_KEY, PRIVATE_KEY, hash_version=3)
+
+    def test_sign_items(self):
+        """
+        Ensures the items are signed lazily, in order and with the same
+        timestamp.
+        """
+        items = [{'foo': i} for i in range(5)]
+        result = Signer(PUBLIC_KEY, PRIVATE_KEY).sign_items(iter(items), 60)
+        self.assertNotIsInstance(result, list)
+        result = list(result)
+        self.assertEqual(items, [dict((k, v) for k, v in item.items()
+                                      if k != '_p4p2p') for item in result])
+        self.assertEqual(1, len(set(item['_p4p2p']['timestamp']
+                                    for item in result)))
+        for item in result:
+            self.assertTrue(verify_item(item, cache=None))
+
+    def test_sign_items_timestamp(self):
+        """
+        Ensures the timestamp is the time sign_items was called (not when the
+        first signed item is taken) unless one is given.
+        """
+        signer = Signer(PUBLIC_KEY, PRIVATE_KEY)
+        with ThreadPoolExecutor(2) as executor:
+            for kwargs in ({}, {'executor': executor}):
+                before = time.time()
+                result = signer.sign_items([{'foo': 1}], **kwargs)
+                after = time.time()
+                time.sleep(0.01)
+                timestamp = next(result)['_p4p2p']['timestamp']
+                self.assertTrue(before <= timestamp <= after)
+                result = signer.sign_items([{'foo': 1}], timestamp=123.0,
+                                           **kwargs)
+                self.assertEqual(123.0, next(result)['_p4p2p']['timestamp'])
+
+    def test_sign_items_bad_arguments(self):
+        """
+        Ensures bad arguments are reported when sign_items is called.
+        """
+        signer = Signer(PUBLIC_KEY, PRIVATE_KEY)
+        with ThreadPoolExecutor(2) as executor:
+            self.assertRaises(TypeError, signer.sign_items, None)
+            self.assertRaises(ValueError, signer.sign_items, [],
+                              executor=executor, chunksize=0)
+            self.assertRaises(ValueError, signer.sign_items, [],
+                              executor=executor, max_pending=0)
+
+    def test_sign_items_executor(self):
+        """
+        Ensures the items are signed in chunks by the executor and returned
+        in order.
+        """
+        items = [{'foo': i} for i in range(10)]
+        signer = Signer(PUBLIC_KEY, PRIVATE_KEY)
+        with ThreadPoolExecutor(4) as executor:
+            result = list(signer.sign_items(items, executor=executor,
+                                            chunksize=3))
+        self.assertEqual(list(range(10)), [item['foo'] for item in result])
+        self.assertEqual(1, len(set(item['_p4p2p']['timestamp']
+                                    for item in result)))
+        for item in result:
+            self.assertTrue(verify_item(item, cache=None))
+
+    def test_sign_items_bounded(self):
+        """
+        Ensures the items are read as signed items are returned, with no more
+        than max_pending chunks waiting to be signed.
+        """
+        read = []
+
+        def items():
+            for i in range(10):
+                read.append(i)
+                yield {'foo': i}
+
+        signer = Signer(PUBLIC_KEY, PRIVATE_KEY)
+        with ThreadPoolExecutor(2) as executor:
+            result = signer.sign_items(items(), executor=executor,
+                                       chunksize=2, max_pending=2)
+            self.assertEqual(0, next(result)['foo'])
+            self.assertEqual(4, len(read))
+            rest = list(result)
+        self.assertEqual(list(range(1, 10)), [item['foo'] for item in rest])
+
+    def test_sign_items_process_pool(self):
+        """
+        Ensures the items can be signed in other processes.
+        """
+        items = [{'foo': i} for i in range(4)]
+        signer = Signer(ED25519_PUBLIC_KEY, ED25519_PRIVATE_KEY,
+                        scheme='ed25519')
+        with ProcessPoolExecutor(2) as executor:
+            result = list(signer.sign_items(items, executor=executor,
+                                            chunksize=2))
+        self.assertEqual(list(range(4)), [item['foo'] for item in result])
+        for item in result:
+            self.assertTrue(verify_item(item, cache=None))
+
+    def test_sign_items_empty(self):
+        """
+        Ensures nothing is returned for no items.
+        """
+        signer = Signer(PUBLIC_KEY, PRIVATE_KEY)
+        with ThreadPoolExecutor(2) as executor:
+            result = list(signer.sign_items([], executor=executor))
+        self.assertEqual([], result)
+        self.assertEqual([], list(signer.sign_items([])))
+
+
+class TestGetUnsignedHashFunction(unittest.TestCase):
+    """
+    Ensures the p4p2p.daemon.crypto._get_unsigned_hash function works as
+    expected.
+    """
+
+    def test_get_unsigned_hash(self):
+        """
+        Ensures the hash is that of the item without the signature in its
+        metadata.
+        """
+        item = {
+            'foo': 'bar',
+            'baz': [1, {'qux': None}]
+        }
+        for hash_version, get_hash in ((1, _get_hash), (2, _get_hash_v2)):
+            signed_item = get_signed_item(item, PUBLIC_KEY, PRIVATE_KEY,
+                                          hash_version=hash_version)
+            unsigned_item = copy.deepcopy(signed_item)
+            del unsigned_item['_p4p2p']['signature']
+            self.assertEqual(get_hash(unsigned_item).hexdigest(),
+                             _get_unsigned_hash(signed_item).hexdigest())
+            self.assertIn('signature', signed_item['_p4p2p'])
+
+
+class TestSchemes(unittest.TestCase):
+    """
+    Ensures the signature schemes work as expected.
+    """
+
+    def test_schemes(self):
+        """
+        Ensures the RSA and Ed25519 schemes are available by name.
+        """
+        self.assertEqual(set(['rsa', 'ed25519']), set(SCHEMES))
+        for name, scheme in SCHEMES.items():
+            self.assertEqual(name, scheme.name)
+
+    def test_sign_and_verify(self):
+        """
+        Ensures each scheme's signers and verifiers work together.
+        """
+        keys = {
+            'rsa': (PUBLIC_KEY, PRIVATE_KEY),
+            'ed25519': (ED25519_PUBLIC_KEY, ED25519_PRIVATE_KEY),
+        }
+        root_hash = _get_hash_v2({'foo': 'bar'})
+        other_hash = _get_hash_v2({'foo': 'baz'})
+        schemes = list(SCHEMES.items())
+        schemes.append(('ed25519', Ed25519Scheme(fast=False)))
+        for name, scheme in schemes:
+            public_key, private_key = keys[name]
+            signature = scheme.get_signer(private_key).sign(root_hash)
+            verifier = scheme.get_verifier(public_key)
+            self.assertTrue(verifier.verify(root_hash, signature))
+            self.assertFalse(verifier.verify(other_hash, signature))
+
+    def test_ed25519_wrong_key_type(self):
+        """
+        Ensures the Ed25519 scheme won't use other types of key.
+        """
+        for scheme in (Ed25519Scheme(fast=False), SCHEMES['ed25519']):
+            self.assertRaises(ValueError, scheme.get_verifier, PUBLIC_KEY)
+            self.assertRaises(ValueError, scheme.get_signer, PRIVATE_KEY)
+            self.assertRaises(ValueError, scheme.get_verifier,
+                              ED25519_PRIVATE_KEY)
+
+    @unittest.skipIf(crypto.ed25519 is None, 'cryptography not installed')
+    def test_ed25519_implementations_agree(self):
+        """
+        Ensures signatures made with the cryptography package and with
+        PyCryptodome are the same (and each verifies the other's).
+        """
+        fast = Ed25519Scheme(fast=True)
+        slow = Ed25519Scheme(fast=False)
+        root_hash = _get_hash_v2({'foo': 'bar'})
+        fast_signature = fast.get_signer(ED25519_PRIVATE_KEY).sign(root_hash)
+        slow_signature = slow.get_signer(ED25519_PRIVATE_KEY).sign(root_hash)
+        self.assertEqual(fast_signature, slow_signature)
+        self.assertTrue(slow.get_verifier(ED25519_PUBLIC_KEY).verify(
+            root_hash, fast_signature))
+        self.assertTrue(fast.get_verifier(ED25519_PUBLIC_KEY).verify(
+            root_hash, slow_signature))
+
+    def test_base_class(self):
+        """
+        Ensures the methods of the base class need implementing.
+        """
+        scheme = SignatureScheme()
+        self.assertRaises(NotImplementedError, scheme.get_signer, PRIVATE_KEY)
+        self.assertRaises(NotImplementedError, scheme.get_verifier,
+                          PUBLIC_KEY)
+
+
+class TestVerificationCache(unittest.TestCase):
+    """
+    Ensures successful verifications are remembered as expected.
+    """
+
+    def setUp(self):
+        verification_cache.clear()
+        clear_key_cache()
+
+    def tearDown(self):
+        verification_cache.clear()
+
+    def test_init(self):
+        """
+        Ensures a new cache is empty.
+        """
+        cache = VerificationCache(10)
+        self.assertEqual({'hits': 0, 'misses': 0, 'size': 0, 'maxsize': 10,
+                          'hit_rate': 0.0}, cache.info())
+
+    def key(self, name, digest=b'digest'):
+        """
+        Returns a (scheme, public_key, signature, digest) cache key.
+        """
+        return ('rsa', PUBLIC_KEY, name, digest)
+
+    def test_add_and_contains(self):
+        """
+        Ensures added keys are remembered (and hits and misses counted).
+        """
+        cache = VerificationCache(10)
+        self.assertNotIn(self.key('foo'), cache)
+        cache.add(self.key('foo'))
+        self.assertIn(self.key('foo'), cache)
+        self.assertIn(self.key('foo'), cache)
+        info = cache.info()
+        self.assertEqual(2, info['hits'])
+        self.assertEqual(1, info['misses'])
+        self.assertEqual(1, info['size'])
+        self.assertAlmostEqual(2 / 3, info['hit_rate'])
+
+    def test_other_digest(self):
+        """
+        Ensures a key with the same signature but a different digest isn't
+        found.
+        """
+        cache = VerificationCache(10)
+        cache.add(self.key('foo'))
+        self.assertNotIn(self.key('foo', b'other'), cache)
+        cache.add(self.key('foo', b'other'))
+        self.assertIn(self.key('foo', b'other'), cache)
+        self.assertNotIn(self.key('foo'), cache)
+        self.assertEqual(1, cache.info()['size'])
+
+    def test_get_digest(self):
+        """
+        Ensures the digest remembered for a signature is returned (without
+        counting a hit or miss).
+        """
+        cache = VerificationCache(10)
+        self.assertIsNone(cache.get_digest(self.key('foo')[:3]))
+        cache.add(self.key('foo'))
+        self.assertEqual(b'digest', cache.get_digest(self.key('foo')[:3]))
+        info = cache.info()
+        self.assertEqual(0, info['hits'] + info['misses'])
+
+    def test_maxsize(self):
+        """
+        Ensures the least recently used key is forgotten when the cache is
+        full.
+        """
+        cache = VerificationCache(2)
+        cache.add(self.key('a'))
+        cache.add(self.key('b'))
+        self.assertIn(self.key('a'), cache)
+        cache.add(self.key('c'))
+        self.assertIn(self.key('a'), cache)
+        self.assertNotIn(self.key('b'), cache)
+        self.assertIn(self.key('c'), cache)
+        self.assertEqual(2, cache.info()['size'])
+
+    def test_clear(self):
+        """
+        Ensures clearing the cache forgets everything and resets the stats.
+        """
+        cache = VerificationCache(2)
+        cache.add(self.key('a'))
+        self.assertIn(self.key('a'), cache)
+        cache.clear()
+        self.assertEqual(0, cache.info()['size'])
+        self.assertEqual(0, cache.info()['hits'])
+        self.assertNotIn(self.key('a'), cache)
+
+    def test_threads(self):
+        """
+        Ensures the cache can be shared between threads.
+        """
+        cache = VerificationCache(100)
+
+        def worker(start):
+            for i in range(1000):
+                key = self.key((start + i) % 150)
+                if key not in cache:
+                    cache.add(key)
+
+        threads = [threading.Thread(target=worker, args=(i * 10, ))
+                   for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        info = cache.info()
+        self.assertEqual(8000, info['hits'] + info['misses'])
+        self.assertEqual(100, info['size'])
+
+    def test_verify_item_cached(self):
+        """
+        Ensures an item verified again is found in the cache rather than
+        having its signature checked.
+        """
+        signed_item = get_signed_item({'foo': 'bar'}, PUBLIC_KEY, PRIVATE_KEY)
+        identical_item = copy.deepcopy(signed_item)
+        self.assertTrue(verify_item(signed_item))
+        self.assertTrue(verify_item(identical_item))
+        self.assertEqual(1, verification_cache.info()['hits'])
+        self.assertEqual(1, key_cache_info()['verifiers']['misses'])
+        self.assertEqual(0, key_cache_info()['verifiers']['hits'])
+
+    def test_verify_item_modified_after_caching(self):
+        """
+        Ensures a changed item isn't verified because the original was.
+        """
+        signed_item = get_signed_item({'foo': 'bar'}, PUBLIC_KEY, PRIVATE_KEY)
+        self.assertTrue(verify_item(signed_item))
+        signed_item['foo'] = 'baz'
+        self.assertFalse(verify_item(signed_item))
+        signed_item['foo'] = 'bar'
+        signed_item['_p4p2p']['public_key'] = BAD_PUBLIC_KEY
+        self.assertFalse(verify_item(signed_item))
+
+    def test_verify_item_failure_not_cached(self):
+        """
+        Ensures failed verifications aren't remembered.
+        """
+        signed_item = get_signed_item({'foo': 'bar'}, PUBLIC_KEY, PRIVATE_KEY)
+        signed_item['foo'] = 'baz'
+        self.assertFalse(verify_item(signed_item))
+        self.assertEqual(0, verification_cache.info()['size'])
+
+    def test_verify_item_no_cache(self):
+        """
+        Ensures the cache can be bypassed.
+        """
+        signed_item = get_signed_item({'foo': 'bar'}, PUBLIC_KEY, PRIVATE_KEY)
+        self.assertTrue(verify_item(signed_item, cache=None))
+        self.assertTrue(verify_item(signed_item, cache=None))
+        self.assertEqual(0, verification_cache.info()['size'])
+        self.assertEqual(1, key_cache_info()['verifiers']['hits'])
+
+
+class TestKeyCache(unittest.TestCase):
+    """
+    Ensures parsed keys are cached and the cache stats are reported.
+    """
+
+    def setUp(self):
+        clear_key_cache()
+
+    def tearDown(self):
+        clear_key_cache()
+
+    def test_key_cache_info_empty(self):
+        """
+        Ensures the stats of empty caches are as expected.
+        """
+        info = key_cache_info()
+        for name in ('signers', 'verifiers'):
+            self.assertEqual(0, info[name]['hits'])
+            self.assertEqual(0, info[name]['misses'])
+            self.assertEqual(0, info[name]['size'])
+            self.assertEqual(0.0, info[name]['hit_rate'])
+            self.assertIsInstance(info[name]['maxsize'], int)
+
+    def test_keys_parsed_once(self):
+        """
+        Ensures each key is only parsed the first time it is used.
+        """
+        item = {'foo': 'bar'}
+        signed_items = [get_signed_item(item, PUBLIC_KEY, PRIVATE_KEY)
+                        for i in range(4)]
+        for signed_item in signed_items:
+            self.assertTrue(verify_item(signed_item))
+        info = key_cache_info()
+        self.assertEqual(1, info['signers']['misses'])
+        self.assertEqual(3, info['signers']['hits'])
+        self.assertEqual(1, info['signers']['size'])
+        self.assertEqual(0.75, info['signers']['hit_rate'])
+        self.assertEqual(1, info['verifiers']['misses'])
+        self.assertEqual(3, info['verifiers']['hits'])
+        self.assertEqual(0.75, info['verifiers']['hit_rate'])
+
+    def test_bad_key_not_cached(self):
+        """
+        Ensures a public key that can't be parsed isn't cached (and the item
+        can't be verified).
+        """
+        signed_item = get_signed_item({'foo': 'bar'}, PUBLIC_KEY,
+                                      PRIVATE_KEY)
+        signed_item['_p4p2p']['public_key'] = 'not a key'
+        self.assertFalse(verify_item(signed_item))
+        self.assertEqual(0, key_cache_info()['verifiers']['size'])
+
+    def test_clear_key_cache(self):
+        """
+        Ensures clearing the cache empties it and resets the stats.
+        """
+        get_signed_item({'foo': 'bar'}, PUBLIC_KEY, PRIVATE_KEY)
+        clear_key_cache()
+        info = key_cache_info()
+        self.assertEqual(0, info['signers']['size'])
+        self.assertEqual(0, info['signers']['misses'])
+
 
 class TestGetHashFunction(unittest.TestCase):
     """
@@ -250,3 +1105,491 @@ class TestGetHashFunction(unittest.TestCase):
         expected = sha512(seed.encode('utf-8'))
         actual = _get_hash(to_hash)
         self.assertEqual(expected.hexdigest(), actual.hexdigest())
+
+
+class TestGetHashV2Function(unittest.TestCase):
+    """
+    Ensures the p4p2p.daemon.crypto._get_hash_v2 function works as expected.
+    """
+
+    def leaf(self, data):
+        """
+        Returns the digest of a scalar with the given tagged encoding.
+        """
+        return sha512(len(data).to_bytes(8, 'big') + data).digest()
+
+    def test_get_hash_v2_scalars(self):
+        """
+        Ensure scalars are hashed as their tagged, length prefixed encoding.
+        """
+        self.assertEqual(self.leaf(b'n'), _get_hash_v2(None).digest())
+        self.assertEqual(self.leaf(b't'), _get_hash_v2(True).digest())
+        self.assertEqual(self.leaf(b'f'), _get_hash_v2(False).digest())
+        self.assertEqual(self.leaf(b'i123'), _get_hash_v2(123).digest())
+        self.assertEqual(self.leaf(b'r1.5'), _get_hash_v2(1.5).digest())
+        self.assertEqual(self.leaf(b's\xc3\xa9t\xc3\xa9'),
+                         _get_hash_v2('\xe9t\xe9').digest())
+
+    def test_get_hash_v2_types_distinguished(self):
+        """
+        Ensure values with the same string form but of different types have
+        different hashes.
+        """
+        hashes = set(_get_hash_v2(value).hexdigest() for value in
+                     (1, '1', 1.0, '1.0', True, 'true', None, 'null', [],
+                      {}))
+        self.assertEqual(10, len(hashes))
+
+    def node(self, left, right):
+        """
+        Returns the digest of a node of a Merkle tree.
+        """
+        return sha512(b'm' + left + right).digest()
+
+    def entry(self, key, value_digest):
+        """
+        Returns the digest of a dict entry with the given key encoding.
+        """
+        return sha512(b'e' + self.leaf(key) + value_digest).digest()
+
+    def test_get_hash_v2_list(self):
+        """
+        Ensure a list is hashed as its length and the root of the Merkle tree
+        of the digests of its items (the last unpaired digest being carried
+        up).
+        """
+        to_hash = ['foo', 1, None]
+        root = self.node(self.node(self.leaf(b'sfoo'), self.leaf(b'i1')),
+                         self.leaf(b'n'))
+        expected = sha512(b'l' + (3).to_bytes(8, 'big') + root).hexdigest()
+        self.assertEqual(expected, _get_hash_v2(to_hash).hexdigest())
+
+    def test_get_hash_v2_nested_structure(self):
+        """
+        Ensure a dict is hashed as its length and the root of the Merkle
+        tree of its entries in key order (recursively).
+        """
+        to_hash = {'b': [None], 'a': {'c': False}, 'e': []}
+        child_list = sha512(b'l' + (1).to_bytes(8, 'big') +
+                            self.leaf(b'n')).digest()
+        child_dict = sha512(b'd' + (1).to_bytes(8, 'big') +
+                            self.entry(b'sc', self.leaf(b'f'))).digest()
+        empty_list = sha512(b'l' + (0).to_bytes(8, 'big')).digest()
+        root = self.node(self.node(self.entry(b'sa', child_dict),
+                                   self.entry(b'sb', child_list)),
+                         self.entry(b'se', empty_list))
+        expected = sha512(b'd' + (3).to_bytes(8, 'big') + root).hexdigest()
+        self.assertEqual(expected, _get_hash_v2(to_hash).hexdigest())
+
+    def test_get_hash_v2_exclude(self):
+        """
+        Ensure the excluded key of the excluded dict is treated as missing
+        (and the same key in other dicts is not).
+        """
+        inner = {'a': 1, 'b': 2}
+        to_hash = {'a': 1, 'b': inner}
+        expected = _get_hash_v2({'a': 1, 'b': {'a': 1}}).hexdigest()
+        actual = _get_hash_v2(to_hash, (inner, 'b')).hexdigest()
+        self.assertEqual(expected, actual)
+        self.assertEqual({'a': 1, 'b': 2}, inner)
+
+    def test_get_hash_v2_deeply_nested(self):
+        """
+        Ensure objects nested more deeply than Python's recursion limit can
+        be hashed.
+        """
+        to_hash = []
+        for i in range(sys.getrecursionlimit() * 2):
+            to_hash = [to_hash, {'i': i}]
+        self.assertEqual(128, len(_get_hash_v2(to_hash).hexdigest()))
+
+
+class TestHashedTree(unittest.TestCase):
+    """
+    Ensures the p4p2p.daemon.crypto.HashedTree class works as expected.
+    """
+
+    def setUp(self):
+        self.value = {
+            'foo': [1, 2.5, {'bar': None, 'baz': [True, False]}],
+            'qux': {'a': 'b', 'c': {'d': []}},
+            'quux': 'corge',
+        }
+        self.tree = HashedTree(self.value)
+
+    def assertDigestMatches(self):
+        """
+        Ensures the digest of the tree is the version 2 digest of its value.
+        """
+        expected = _get_hash_v2(self.tree.value)
+        self.assertEqual(expected.digest(), self.tree.digest())
+        self.assertEqual(expected.hexdigest(),
+                         self.tree.root_hash().hexdigest())
+
+    def test_init(self):
+        """
+        Ensures the tree holds the value (without copying it) and has the
+        expected digest.
+        """
+        self.assertIs(self.value, self.tree.value)
+        self.assertDigestMatches()
+        self.assertDigestMatches()
+
+    def test_init_not_dict(self):
+        """
+        Ensures only a dict can be held.
+        """
+        self.assertRaises(TypeError, HashedTree, [1, 2, 3])
+
+    def test_get(self):
+        """
+        Ensures parts of the value are returned by path.
+        """
+        self.assertEqual('b', self.tree.get(('qux', 'a')))
+        self.assertEqual(False, self.tree.get(['foo', 2, 'baz', 1]))
+        self.assertIs(self.value, self.tree.get(()))
+
+    def test_set(self):
+        """
+        Ensures setting parts of the value changes the value and the digest
+        (without changing the original value).
+        """
+        original = copy.deepcopy(self.value)
+        self.tree.set(('foo', 2, 'bar'), {'new': [1, 2]})
+        self.assertEqual({'new': [1, 2]}, self.tree.value['foo'][2]['bar'])
+        self.assertDigestMatches()
+        self.tree.set(('qux', 'e'), 'new key')
+        self.assertEqual('new key', self.tree.value['qux']['e'])
+        self.assertDigestMatches()
+        self.tree.set(('foo', 0), 'replaced')
+        self.assertEqual('replaced', self.tree.value['foo'][0])
+        self.assertDigestMatches()
+        self.tree.set(('new', ), [])
+        self.assertDigestMatches()
+        self.assertEqual(original, self.value)
+        self.assertIs(self.value['quux'], self.tree.value['quux'])
+
+    def test_set_only_changed_path(self):
+        """
+        Ensures only the digests of the containers on the path to the
+        changed part are recalculated.
+        """
+        self.tree.digest()
+        root = self.tree._root
+        qux = root.children['qux'][1]
+        foo = root.children['foo'][1]
+        qux_digest = qux.digest
+        self.tree.set(('foo', 2, 'bar'), 1)
+        self.assertIsNone(root.digest)
+        self.assertIsNone(foo.digest)
+        self.assertIs(qux_digest, qux.digest)
+        self.assertDigestMatches()
+
+    def test_set_updates_merkle_tree(self):
+        """
+        Ensures changing the value of an existing entry updates the Merkle
+        tree of its container (rather than rebuilding it) and adding or
+        deleting an entry rebuilds it.
+        """
+        tree = HashedTree({'items': list(range(100))})
+        tree.digest()
+        items = tree._root.children['items'][1]
+        levels = items.levels
+        for path, value in ((('items', 0), 'first'), (('items', 57), None),
+                            (('items', -1), [1, 2]), (('items', 63), {})):
+            tree.set(path, value)
+            self.assertEqual(_get_hash_v2(tree.value).digest(),
+                             tree.digest())
+            self.assertIs(levels, items.levels)
+        tree.delete(('items', 10))
+        self.assertIsNone(items.levels)
+        self.assertEqual(_get_hash_v2(tree.value).digest(), tree.digest())
+        self.assertEqual(99, len(items.levels[0]))
+
+    def test_set_bad_path(self):
+        """
+        Ensures a path that doesn't exist raises an error (and leaves the
+        tree unchanged).
+        """
+        self.assertRaises(KeyError, self.tree.set, ('missing', 'a'), 1)
+        self.assertRaises(IndexError, self.tree.set, ('foo', 3), 1)
+        self.assertRaises(KeyError, self.tree.set, ('quux', 'a'), 1)
+        self.assertRaises(KeyError, self.tree.set, (), 1)
+        self.assertDigestMatches()
+
+    def test_delete(self):
+        """
+        Ensures deleting parts of the value changes the value and the digest
+        (without changing the original value).
+        """
+        original = copy.deepcopy(self.value)
+        self.tree.delete(('qux', 'a'))
+        self.assertNotIn('a', self.tree.value['qux'])
+        self.assertDigestMatches()
+        self.tree.delete(('foo', 0))
+        self.assertEqual(2.5, self.tree.value['foo'][0])
+        self.assertDigestMatches()
+        self.tree.delete(('quux', ))
+        self.assertDigestMatches()
+        self.assertEqual(original, self.value)
+
+    def test_deeply_nested(self):
+        """
+        Ensures values nested more deeply than Python's recursion limit can
+        be held and changed.
+        """
+        value = {'leaf': 0}
+        path = []
+        for i in range(sys.getrecursionlimit() * 2):
+            value = {'child': value}
+            path.append('child')
+        tree = HashedTree(value)
+        tree.set(path + ['leaf'], 1)
+        self.assertEqual(_get_hash_v2(tree.value).digest(), tree.digest())
+
+    def test_root_hash_extra(self):
+        """
+        Ensures the extra entries are hashed as if they were in the value
+        (replacing any entry with the same key).
+        """
+        extra = {'_p4p2p': {'foo': 'bar'}, 'quux': 1}
+        expected = dict(self.value)
+        expected.update(extra)
+        self.assertEqual(_get_hash_v2(expected).hexdigest(),
+                         self.tree.root_hash(extra).hexdigest())
+        self.assertNotIn('_p4p2p', self.value)
+
+    def test_get_signed_item(self):
+        """
+        Ensures the value of the tree can be signed (before and after
+        changes) and the results verified.
+        """
+        for scheme, public_key, private_key in (
+                ('rsa', PUBLIC_KEY, PRIVATE_KEY),
+                ('ed25519', ED25519_PUBLIC_KEY, ED25519_PRIVATE_KEY)):
+            signed_item = get_signed_item(self.tree, public_key, private_key,
+                                          hash_version=2, scheme=scheme)
+            self.assertTrue(verify_item(signed_item, cache=None))
+            self.assertNotIn('_p4p2p', self.value)
+            self.tree.set(('qux', 'c', 'd'), [scheme])
+            signed_item = get_signed_item(self.tree, public_key, private_key,
+                                          hash_version=2, scheme=scheme)
+            self.assertEqual([scheme], signed_item['qux']['c']['d'])
+            self.assertTrue(verify_item(signed_item, cache=None))
+
+    def test_signed_items_unaffected(self):
+        """
+        Ensures items signed from the tree still verify (and are unchanged)
+        after the tree is changed.
+        """
+        self.tree.set(('qux', 'c', 'd'), [1])
+        first = get_signed_item(self.tree, PUBLIC_KEY, PRIVATE_KEY,
+                                hash_version=2)
+        expected = copy.deepcopy(first)
+        self.tree.set(('qux', 'c', 'd'), [2])
+        self.tree.set(('foo', 2, 'baz', 0), 99)
+        self.tree.delete(('qux', 'a'))
+        second = get_signed_item(self.tree, PUBLIC_KEY, PRIVATE_KEY,
+                                 hash_version=2)
+        self.assertEqual(expected, first)
+        self.assertTrue(verify_item(first, cache=None))
+        self.assertTrue(verify_item(second, cache=None))
+        self.assertEqual([2], second['qux']['c']['d'])
+
+    def test_get_signed_item_hash_version_1(self):
+        """
+        Ensures the value of the tree can be signed with version 1 of the
+        canonical hash.
+        """
+        signed_item = get_signed_item(self.tree, PUBLIC_KEY, PRIVATE_KEY,
+                                      hash_version=1)
+        self.assertTrue(verify_item(signed_item, cache=None))
+
+
+class TestInclusionProofs(unittest.TestCase):
+    """
+    Ensures the p4p2p.daemon.crypto.get_inclusion_proof and
+    verify_inclusion_proof functions work as expected.
+    """
+
+    def setUp(self):
+        self.value = {
+            'records': [{'id': i, 'payload': 'x' * 100} for i in range(10)],
+            'index': {'a': [1, 2], 'b': {'c': None}},
+            'name': 'test',
+        }
+        self.signed_item = get_signed_item(self.value, PUBLIC_KEY,
+                                           PRIVATE_KEY, 100, hash_version=2)
+
+    def round_trip(self, proof):
+        """
+        Returns the proof after being serialised as JSON and parsed again.
+        """
+        return json.loads(json.dumps(proof))
+
+    def test_proofs(self):
+        """
+        Ensures proofs for parts of the item verify (after being sent as
+        JSON).
+        """
+        for path in (('records', 3, 'payload'), ('records', 0), ('name', ),
+                     ('index', 'b', 'c'), ('index', 'a', 1), ('records', )):
+            proof = get_inclusion_proof(self.signed_item, path)
+            self.assertEqual(list(path), proof['path'])
+            value = self.signed_item
+            for key in path:
+                value = value[key]
+            self.assertEqual(value, proof['value'])
+            self.assertEqual(self.signed_item['_p4p2p'], proof['metadata'])
+            self.assertEqual(len(path), len(proof['levels']))
+            self.assertTrue(verify_inclusion_proof(self.round_trip(proof)))
+
+    def test_proof_size(self):
+        """
+        Ensures the proof only holds the digests on the path through the
+        Merkle tree of each container (not the other entries).
+        """
+        proof = get_inclusion_proof(self.signed_item,
+                                    ('records', 3, 'payload'))
+        levels = proof['levels']
+        self.assertEqual(['d', 'l', 'd'], [level['type'] for level in levels])
+        self.assertEqual([4, 10, 2], [level['count'] for level in levels])
+        self.assertEqual([3, 3, 1], [level['index'] for level in levels])
+        sizes = [len(base64.b64decode(level['path'])) for level in levels]
+        self.assertEqual([2 * 64, 4 * 64, 1 * 64], sizes)
+        self.assertEqual(0, levels[0]['metadata_index'])
+        self.assertEqual(2 * 64,
+                         len(base64.b64decode(levels[0]['metadata_path'])))
+
+    def test_proof_size_logarithmic(self):
+        """
+        Ensures the size of the proof grows with the logarithm of the number
+        of entries in each container.
+        """
+        value = {'records': list(range(1000))}
+        signed_item = get_signed_item(value, PUBLIC_KEY, PRIVATE_KEY,
+                                      hash_version=2)
+        for index in (0, 500, 999):
+            proof = get_inclusion_proof(signed_item, ('records', index))
+            level = proof['levels'][1]
+            size = len(base64.b64decode(level['path']))
+            self.assertLessEqual(size, 10 * 64)
+            self.assertTrue(verify_inclusion_proof(self.round_trip(proof)))
+
+    def test_proof_with_tree(self):
+        """
+        Ensures a HashedTree holding the item gives the same proof.
+        """
+        tree = HashedTree(copy.deepcopy(self.value))
+        tree.set(('index', 'b', 'c'), 'changed')
+        signed_item = get_signed_item(tree, ED25519_PUBLIC_KEY,
+                                      ED25519_PRIVATE_KEY, hash_version=2,
+                                      scheme='ed25519')
+        path = ('index', 'b', 'c')
+        proof = get_inclusion_proof(signed_item, path, tree)
+        self.assertEqual(get_inclusion_proof(signed_item, path), proof)
+        self.assertEqual('changed', proof['value'])
+        self.assertTrue(verify_inclusion_proof(self.round_trip(proof)))
+
+    def test_proof_with_tree_of_signed_item(self):
+        """
+        Ensures a HashedTree holding an item that was signed before (so has
+        out of date metadata) gives a proof that verifies when the item is
+        signed again.
+        """
+        tree = HashedTree(copy.deepcopy(self.signed_item))
+        tree.set(('name', ), 'changed')
+        signed_item = get_signed_item(tree, PUBLIC_KEY, PRIVATE_KEY,
+                                      hash_version=2)
+        proof = get_inclusion_proof(signed_item, ('name', ), tree)
+        self.assertEqual(get_inclusion_proof(signed_item, ('name', )), proof)
+        self.assertTrue(verify_inclusion_proof(self.round_trip(proof)))
+
+    def test_bad_paths(self):
+        """
+        Ensures there are no proofs for paths that don't exist, the whole
+        item or the metadata.
+        """
+        self.assertRaises(KeyError, get_inclusion_proof, self.signed_item,
+                          ('missing', ))
+        self.assertRaises(IndexError, get_inclusion_proof, self.signed_item,
+                          ('records', 10))
+        self.assertRaises(KeyError, get_inclusion_proof, self.signed_item,
+                          ('name', 'a'))
+        self.assertRaises(ValueError, get_inclusion_proof, self.signed_item,
+                          ())
+        self.assertRaises(ValueError, get_inclusion_proof, self.signed_item,
+                          ('_p4p2p', 'timestamp'))
+
+    def test_hash_version_1(self):
+        """
+        Ensures there are no proofs for version 1 items.
+        """
+        signed_item = get_signed_item(self.value, PUBLIC_KEY, PRIVATE_KEY,
+                                      hash_version=1)
+        self.assertRaises(ValueError, get_inclusion_proof, signed_item,
+                          ('name', ))
+
+    def test_modified_value(self):
+        """
+        Ensures a proof for a changed value doesn't verify.
+        """
+        proof = get_inclusion_proof(self.signed_item, ('records', 3))
+        proof['value']['id'] = 4
+        self.assertFalse(verify_inclusion_proof(proof))
+
+    def test_modified_path(self):
+        """
+        Ensures the proof doesn't verify for a different path.
+        """
+        proof = get_inclusion_proof(self.signed_item, ('records', 3, 'id'))
+        proof['path'] = ['records', 4, 'id']
+        self.assertFalse(verify_inclusion_proof(proof))
+        proof['path'] = ['records', 3, 'payload']
+        self.assertFalse(verify_inclusion_proof(proof))
+        proof['path'] = ['records', 3]
+        self.assertFalse(verify_inclusion_proof(proof))
+
+    def test_modified_levels(self):
+        """
+        Ensures a proof with changed digests, indexes or lengths doesn't
+        verify.
+        """
+        proof = get_inclusion_proof(self.signed_item, ('records', 3, 'id'))
+        path = base64.b64decode(proof['levels'][1]['path'])
+        for change in ({'count': 11}, {'count': 9}, {'index': 2},
+                       {'type': 'd'}, {'type': 'x'}, {'path': ''},
+                       {'path': path[64:] + path[:64]}, {'path': path[64:]},
+                       {'path': path + path[:64]}):
+            if type(change.get('path')) is bytes:
+                change['path'] = base64.b64encode(change['path']).decode()
+            modified = copy.deepcopy(proof)
+            modified['levels'][1].update(change)
+            self.assertFalse(verify_inclusion_proof(modified))
+        root = proof['levels'][0]
+        for change in ({'metadata_index': 1}, {'metadata_index': 2},
+                       {'metadata_path': root['path']}, {'index': 0},
+                       {'metadata_path': ''}):
+            modified = copy.deepcopy(proof)
+            modified['levels'][0].update(change)
+            self.assertFalse(verify_inclusion_proof(modified))
+
+    def test_modified_metadata(self):
+        """
+        Ensures a proof with changed metadata doesn't verify.
+        """
+        proof = get_inclusion_proof(self.signed_item, ('name', ))
+        proof['metadata']['expires'] += 1
+        self.assertFalse(verify_inclusion_proof(proof))
+        proof = get_inclusion_proof(self.signed_item, ('name', ))
+        proof['metadata']['public_key'] = BAD_PUBLIC_KEY
+        self.assertFalse(verify_inclusion_proof(proof))
+
+    def test_malformed_proof(self):
+        """
+        Ensures a malformed proof doesn't verify.
+        """
+        self.assertFalse(verify_inclusion_proof({}))
+        proof = get_inclusion_proof(self.signed_item, ('name', ))
+        proof['levels'] = []
+        self.assertFalse(verify_inclusion_proof(proof))
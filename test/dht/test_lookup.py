@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+"""
+Ensures the iterative lookup (used to find nodes and values in the DHT) works
+as expected.
+"""
+from p4p2p.dht.lookup import NodeLookup, Transport, ValueNotFound
+from p4p2p.dht.routingtable import RoutingTable, RoutingTableEmpty
+from p4p2p.dht.contact import PeerNode
+from p4p2p.dht.utils import sort_peer_nodes
+from p4p2p.dht import constants
+from .keys import PUBLIC_KEY
+import asyncio
+import random
+import unittest
+
+
+class MemoryTransport(Transport):
+    """
+    An in-memory network of peers. Each peer knows about every other working
+    peer and answers a FIND_NODE with the K closest to the key.
+    """
+
+    def __init__(self, peers, values=None, failing=None, slow=None,
+                 delays=None):
+        self.peers = peers
+        self.delays = delays or {}
+        self.values = values or {}
+        self.failing = failing or set()
+        self.slow = slow or set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = []
+        self.cancelled = 0
+
+    async def _respond(self, contact, key):
+        self.requests.append(contact.network_id_int)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if contact.network_id_int in self.slow:
+                await asyncio.sleep(10)
+            else:
+                await asyncio.sleep(self.delays.get(contact.network_id_int,
+                                                    0))
+            if contact.network_id_int in self.failing:
+                raise ConnectionError('No route to host.')
+            others = [p for p in self.peers if p != contact and
+                      p.network_id_int not in self.failing]
+            return sort_peer_nodes(others, key)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.in_flight -= 1
+
+    async def find_node(self, contact, key):
+        return await self._respond(contact, key)
+
+    async def find_value(self, contact, key):
+        contacts = await self._respond(contact, key)
+        if contact.network_id_int in self.values:
+            return self.values[contact.network_id_int], []
+        return None, contacts
+
+
+class TestNodeLookup(unittest.TestCase):
+    """
+    Ensures the NodeLookup class works as expected.
+    """
+
+    def setUp(self):
+        """
+        Common vars.
+        """
+        rand = random.Random(8)
+        self.peers = []
+        for i in range(200):
+            contact = PeerNode(PUBLIC_KEY, '192.168.0.%d' % i, 9999, 0)
+            contact.network_id = hex(rand.getrandbits(512))
+            self.peers.append(contact)
+        self.key = rand.getrandbits(512)
+        self.routing_table = RoutingTable(hex(rand.getrandbits(512)))
+        # The local node only knows about a few peers far from the key.
+        far_peers = sorted(self.peers,
+                           key=lambda p: p.network_id_int ^ self.key)
+        self.far_peers = far_peers[-5:]
+        for contact in self.far_peers:
+            self.routing_table.add_contact(contact)
+        self.expected = sort_peer_nodes(list(self.peers), self.key)
+
+    def run_lookup(self, lookup):
+        return asyncio.run(lookup.run())
+
+    def test_init(self):
+        """
+        Ensures an object is created as expected.
+        """
+        transport = MemoryTransport(self.peers)
+        lookup = NodeLookup(hex(self.key), self.routing_table, transport)
+        self.assertEqual(self.key, lookup.key)
+        self.assertEqual(self.routing_table, lookup.routing_table)
+        self.assertEqual(transport, lookup.transport)
+        self.assertFalse(lookup.find_value)
+        self.assertEqual(constants.LOOKUP_TIMEOUT, lookup.timeout)
+        self.assertEqual(constants.RPC_TIMEOUT, lookup.rpc_timeout)
+        self.assertTrue(lookup.adaptive_timeouts)
+
+    def test_find_node(self):
+        """
+        Ensures the K closest nodes in the network are found, in order, with
+        no more than ALPHA requests in flight at any time.
+        """
+        transport = MemoryTransport(self.peers)
+        lookup = NodeLookup(self.key, self.routing_table, transport)
+        result = self.run_lookup(lookup)
+        self.assertEqual(self.expected, result)
+        self.assertEqual(constants.ALPHA, transport.max_in_flight)
+        # Nobody is asked twice.
+        self.assertEqual(len(transport.requests), len(set(transport.requests)))
+        # The responding peers are added to the routing table.
+        for contact in result:
+            self.assertEqual(contact,
+                             self.routing_table.get_contact(
+                                 contact.network_id))
+
+    def test_find_node_records_rtt(self):
+        """
+        Ensures the round trip times of responding peers are recorded.
+        """
+        closest = self.expected[0]
+        transport = MemoryTransport(self.peers,
+                                    delays={closest.network_id_int: 0.02})
+        lookup = NodeLookup(self.key, self.routing_table, transport)
+        result = self.run_lookup(lookup)
+        self.assertTrue(closest.srtt >= 0.02)
+        self.assertEqual(closest.srtt / 2, closest.rttvar)
+        for contact in result:
+            self.assertIsNotNone(contact.srtt)
+
+    def test_find_node_latency_aware(self):
+        """
+        Ensures that with latency_aware set the fastest known peers in the
+        same distance rank are asked first without changing the result.
+        """
+        # The peers the local node knows about are all of the same rank.
+        ranks = set((p.network_id_int ^ self.key).bit_length()
+                    for p in self.far_peers)
+        self.assertEqual(1, len(ranks))
+        for contact in self.far_peers:
+            contact.record_rtt(1)
+        # The peer furthest from the key is the fastest.
+        fastest = self.far_peers[-1]
+        fastest.srtt = 0.001
+        results = []
+        for latency_aware in (False, True):
+            # Start each lookup from a routing table only knowing far_peers.
+            routing_table = RoutingTable(self.routing_table._parent_node_id)
+            for contact in self.far_peers:
+                routing_table.add_contact(contact)
+            transport = MemoryTransport(self.peers)
+            lookup = NodeLookup(self.key, routing_table, transport,
+                                latency_aware=latency_aware)
+            results.append(self.run_lookup(lookup))
+            first_requests = transport.requests[:constants.ALPHA]
+            self.assertEqual(latency_aware,
+                             fastest.network_id_int in first_requests)
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(self.expected, results[1])
+
+    def test_find_node_cancels_outstanding_requests(self):
+        """
+        Ensures requests still outstanding when the K closest nodes have
+        responded are cancelled rather than waited for.
+        """
+        # Two of the first ALPHA peers asked never respond in time.
+        slow = set(p.network_id_int for p in self.far_peers[1:3])
+        transport = MemoryTransport(self.peers, slow=slow)
+        lookup = NodeLookup(self.key, self.routing_table, transport,
+                            rpc_timeout=5)
+        result = self.run_lookup(lookup)
+        self.assertEqual(self.expected, result)
+        self.assertEqual(2, transport.cancelled)
+        self.assertEqual(0, transport.in_flight)
+
+    def test_find_node_with_failing_peers(self):
+        """
+        Ensures failing peers are left out of the result and reported to the
+        routing table.
+        """
+        failing = set(p.network_id_int for p in self.expected[:5])
+        transport = MemoryTransport(self.peers, failing=failing)
+        self.routing_table.add_contact(self.expected[0])
+        lookup = NodeLookup(self.key, self.routing_table, transport)
+        result = self.run_lookup(lookup)
+        expected = sort_peer_nodes(
+            [p for p in self.peers if p.network_id_int not in failing],
+            self.key)
+        self.assertEqual(expected, result)
+        self.assertEqual(1, self.expected[0].failed_RPCs)
+
+    def test_find_node_with_timeouts(self):
+        """
+        Ensures peers that take longer than rpc_timeout to respond are treated
+        as failed.
+        """
+        slow = set(p.network_id_int for p in self.expected[:3])
+        transport = MemoryTransport(self.peers, slow=slow)
+        lookup = NodeLookup(self.key, self.routing_table, transport,
+                            rpc_timeout=0.01)
+        result = self.run_lookup(lookup)
+        self.assertEqual(self.expected[3:], result[:constants.K - 3])
+        for contact in self.expected[:3]:
+            self.assertNotIn(contact, result)
+
+    def test_find_node_with_adaptive_timeouts(self):
+        """
+        Ensures a peer with a known round trip time that doesn't respond is
+        only waited for as long as its adaptive timeout and isn't reported to
+        the routing table as failed.
+        """
+        stalled = self.expected[0]
+        stalled.record_rtt(0.001)
+        self.routing_table.add_contact(stalled)
+        transport = MemoryTransport(self.peers,
+                                    slow=set([stalled.network_id_int]))
+        lookup = NodeLookup(self.key, self.routing_table, transport,
+                            timeout=2, rpc_timeout=5)
+        result = self.run_lookup(lookup)
+        self.assertNotIn(stalled, result)
+        self.assertEqual(self.expected[1:], result[:constants.K - 1])
+        self.assertEqual(0, stalled.failed_RPCs)
+        self.assertEqual(1, stalled.timeouts)
+
+    def test_find_node_with_fixed_timeouts(self):
+        """
+        Ensures that without adaptive timeouts every timeout is reported to
+        the routing table as failed.
+        """
+        stalled = self.expected[0]
+        stalled.record_rtt(0.001)
+        self.routing_table.add_contact(stalled)
+        transport = MemoryTransport(self.peers,
+                                    slow=set([stalled.network_id_int]))
+        lookup = NodeLookup(self.key, self.routing_table, transport,
+                            rpc_timeout=0.3, adaptive_timeouts=False)
+        removed = []
+        remove_contact = self.routing_table.remove_contact
+
+        def record(network_id, forced=False):
+            removed.append(network_id)
+            remove_contact(network_id, forced)
+
+        self.routing_table.remove_contact = record
+        result = self.run_lookup(lookup)
+        self.assertNotIn(stalled, result)
+        self.assertEqual(1, stalled.failed_RPCs)
+        self.assertEqual(0, stalled.timeouts)
+        # The integer form of the network ID is used (no hex round trip).
+        self.assertEqual([stalled.network_id_int], removed)
+
+    def test_lookup_timeout(self):
+        """
+        Ensures the lookup as a whole is abandoned after the timeout.
+        """
+        slow = set(p.network_id_int for p in self.peers)
+        transport = MemoryTransport(self.peers, slow=slow)
+        lookup = NodeLookup(self.key, self.routing_table, transport,
+                            timeout=0.01)
+        self.assertRaises(asyncio.TimeoutError, self.run_lookup, lookup)
+        self.assertEqual(0, transport.in_flight)
+
+    def test_empty_routing_table(self):
+        """
+        Ensures RoutingTableEmpty is raised if there's nobody to ask.
+        """
+        transport = MemoryTransport(self.peers)
+        lookup = NodeLookup(self.key, RoutingTable('0xdeadbeef'), transport)
+        self.assertRaises(RoutingTableEmpty, self.run_lookup, lookup)
+
+    def test_find_value(self):
+        """
+        Ensures the value is returned as soon as a peer returns it.
+        """
+        values = {self.expected[2].network_id_int: {'foo': 'bar'}}
+        transport = MemoryTransport(self.peers, values=values)
+        lookup = NodeLookup(self.key, self.routing_table, transport,
+                            find_value=True)
+        self.assertEqual({'foo': 'bar'}, self.run_lookup(lookup))
+        self.assertEqual(0, transport.in_flight)
+
+    def test_find_value_not_found(self):
+        """
+        Ensures ValueNotFound is raised if no peer has the value.
+        """
+        transport = MemoryTransport(self.peers)
+        lookup = NodeLookup(self.key, self.routing_table, transport,
+                            find_value=True)
+        self.assertRaises(ValueNotFound, self.run_lookup, lookup)
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Ensures the counters and histograms used to instrument the DHT work as
+expected.
+"""
+from p4p2p.dht.metrics import Histogram, Metrics, LATENCY_BOUNDS
+import unittest
+
+
+class TestHistogram(unittest.TestCase):
+    """
+    Ensures the Histogram class works as expected.
+    """
+
+    def test_init(self):
+        """
+        Ensures an object is created as expected.
+        """
+        histogram = Histogram()
+        self.assertEqual(LATENCY_BOUNDS, histogram.bounds)
+        self.assertEqual([0] * (len(LATENCY_BOUNDS) + 1), histogram.counts)
+        self.assertEqual(0, histogram.count)
+        self.assertEqual(0, histogram.total)
+
+    def test_observe(self):
+        """
+        Ensures values are counted in the bucket with the lowest bound that is
+        greater than or equal to the value (or the final bucket if the value
+        is too big for all the bounds).
+        """
+        histogram = Histogram((1, 10))
+        for value in (0.5, 1, 5, 10, 11, 100):
+            histogram.observe(value)
+        self.assertEqual([2, 2, 2], histogram.counts)
+        self.assertEqual(6, histogram.count)
+        self.assertEqual(127.5, histogram.total)
+
+    def test_report(self):
+        """
+        Ensures the report describes the state of the histogram.
+        """
+        histogram = Histogram((1, 10))
+        histogram.observe(2)
+        expected = {
+            'bounds': [1, 10],
+            'counts': [0, 1, 0],
+            'count': 1,
+            'sum': 2,
+        }
+        self.assertEqual(expected, histogram.report())
+
+
+class TestMetrics(unittest.TestCase):
+    """
+    Ensures the Metrics class works as expected.
+    """
+
+    def test_increment(self):
+        """
+        Ensures counters start at zero and are incremented by the specified
+        amount.
+        """
+        metrics = Metrics()
+        metrics.increment('foo')
+        metrics.increment('foo', 3)
+        metrics.increment('bar')
+        self.assertEqual({'foo': 4, 'bar': 1}, metrics.report()['counters'])
+
+    def test_observe(self):
+        """
+        Ensures values are recorded in the named histogram.
+        """
+        metrics = Metrics()
+        metrics.observe('foo', 0.002)
+        metrics.observe('foo', 0.003)
+        result = metrics.report()['histograms']
+        self.assertEqual(['foo'], list(result))
+        self.assertEqual(2, result['foo']['count'])
+        self.assertEqual(2, sum(result['foo']['counts']))
+
+    def test_report_empty(self):
+        """
+        Ensures a new Metrics object reports no counters or histograms.
+        """
+        expected = {'counters': {}, 'histograms': {}}
+        self.assertEqual(expected, Metrics().report())
@@ -3,18 +3,47 @@
 Ensures the routing table (a binary tree used to link buckets with key ranges
 in the DHT) works as expected.
 """
-from p4p2p.dht.routingtable import RoutingTable
+from p4p2p.dht.routingtable import RoutingTable, ConcurrentRoutingTable
 from p4p2p.dht.contact import PeerNode
 from p4p2p.dht.bucket import Bucket
+from p4p2p.dht.metrics import Metrics
 from p4p2p.dht.utils import distance
 from p4p2p.dht import constants
 from p4p2p.version import get_version
 import unittest
+import os
+import random
+import tempfile
+import threading
 import time
 from mock import MagicMock
 from .keys import PUBLIC_KEY
 
 
+def make_populated_table(cls=RoutingTable):
+    """
+    Returns a routing table (of the specified class) with several buckets,
+    full replacement caches and a blacklisted contact.
+    """
+    rand = random.Random(9)
+    parent_node_id = rand.getrandbits(512)
+    r = cls(hex(parent_node_id))
+    contacts = []
+    for i in range(300):
+        contact = PeerNode(PUBLIC_KEY, '192.168.0.%d' % (i % 256), 9000 + i,
+                           get_version(), i)
+        contact.network_id = hex(parent_node_id ^ rand.getrandbits(
+            rand.randint(400, 512)))
+        if i % 3:
+            contact.record_rtt(rand.random())
+        contacts.append(contact)
+    r.add_contacts(contacts)
+    contacts[0].failed_RPCs = 2
+    r.blacklist(contacts[1])
+    r.touch_bucket(hex(parent_node_id))
+    return r
+
+
 class TestRoutingTable(unittest.TestCase):
     """
     Ensures the RoutingTable class works as expected.
@@ -105,6 +134,21 @@ class TestRoutingTable(unittest.TestCase):
             big_id = 2 ** 512
             r.find_close_nodes(big_id)
 
+    def test_bucket_index_many_buckets(self):
+        """
+        Ensures the index returned for a key is that of the bucket whose range
+        contains the key once the routing table has been split many times.
+        """
+        parent_node_id = '0xdeadbeef'
+        r = RoutingTable(parent_node_id)
+        for i in range(100):
+            r._split_bucket(0)
+        self.assertEqual(101, len(r._buckets))
+        self.assertEqual([b.range_min for b in r._buckets], r._bucket_mins)
+        for i, bucket in enumerate(r._buckets):
+            self.assertEqual(i, r._bucket_index(bucket.range_min))
+            self.assertEqual(i, r._bucket_index(bucket.range_max - 1))
+
     def test_random_key_in_bucket_range(self):
         """
         Ensures the returned key is within the expected bucket range.
@@ -149,10 +193,10 @@ class TestRoutingTable(unittest.TestCase):
         # order (most recently added at the head of the list).
         self.assertEqual(2, len(bucket1._contacts))
         self.assertEqual(2, len(bucket2._contacts))
-        self.assertEqual(contact1, bucket1._contacts[0])
-        self.assertEqual(contact2, bucket1._contacts[1])
-        self.assertEqual(contact3, bucket2._contacts[0])
-        self.assertEqual(contact4, bucket2._contacts[1])
+        self.assertEqual(contact1, bucket1.get_contacts()[0])
+        self.assertEqual(contact2, bucket1.get_contacts()[1])
+        self.assertEqual(contact3, bucket2.get_contacts()[0])
+        self.assertEqual(contact4, bucket2.get_contacts()[1])
         # Split the new bucket again, ensuring that only the target bucket is
         # modified.
         r._split_bucket(1)
@@ -162,23 +206,88 @@ class TestRoutingTable(unittest.TestCase):
         self.assertEqual(2, len(bucket1._contacts))
         # bucket2 only contains the lower half of its original contacts.
         self.assertEqual(1, len(bucket2._contacts))
-        self.assertEqual(contact3, bucket2._contacts[0])
+        self.assertEqual(contact3, bucket2.get_contacts()[0])
         # bucket3 now contains the upper half of the original contacts.
         self.assertEqual(1, len(bucket3._contacts))
-        self.assertEqual(contact4, bucket3._contacts[0])
+        self.assertEqual(contact4, bucket3.get_contacts()[0])
         # Split the bucket at position 0 and ensure the resulting buckets are
         # in the correct position with the correct content.
         r._split_bucket(0)
         self.assertEqual(4, len(r._buckets))
         bucket1, bucket2, bucket3, bucket4 = r._buckets
         self.assertEqual(1, len(bucket1._contacts))
-        self.assertEqual(contact1, bucket1._contacts[0])
+        self.assertEqual(contact1, bucket1.get_contacts()[0])
         self.assertEqual(1, len(bucket2._contacts))
-        self.assertEqual(contact2, bucket2._contacts[0])
+        self.assertEqual(contact2, bucket2.get_contacts()[0])
         self.assertEqual(1, len(bucket3._contacts))
-        self.assertEqual(contact3, bucket3._contacts[0])
+        self.assertEqual(contact3, bucket3.get_contacts()[0])
         self.assertEqual(1, len(bucket4._contacts))
-        self.assertEqual(contact4, bucket4._contacts[0])
+        self.assertEqual(contact4, bucket4.get_contacts()[0])
+
+    def test_split_bucket_replacement_cache(self):
+        """
+        Ensures that when a bucket is split its cached replacements follow
+        their contacts into the correct bucket and are used to fill any space
+        made by the split.
+        """
+        parent_node_id = '0xdeadbeef'
+        r = RoutingTable(parent_node_id)
+        bucket = Bucket(0, 100)
+        for i in range(constants.K):
+            contact = PeerNode(PUBLIC_KEY, '192.168.0.%d' % i, 9999, 0)
+            contact.network_id = hex(i)
+            bucket.add_contact(contact)
+        cached = []
+        for i in range(60, 60 + constants.K):
+            contact = PeerNode(PUBLIC_KEY, '192.168.0.%d' % i, 9999, 0)
+            contact.network_id = hex(i)
+            bucket.add_replacement(contact)
+            cached.append(contact)
+        r._buckets[0] = bucket
+        r._split_bucket(0)
+        bucket1, bucket2 = r._buckets
+        # The lower bucket is still full and has no replacements in range.
+        self.assertEqual(constants.K, len(bucket1))
+        self.assertEqual([], bucket1.get_replacements())
+        # The upper bucket was filled from the replacement cache.
+        self.assertEqual(constants.K, len(bucket2))
+        self.assertEqual([], bucket2.get_replacements())
+        self.assertEqual(list(reversed(cached)), bucket2.get_contacts())
+
+    def test_add_contact_replacement_cache_after_split(self):
+        """
+        Ensures contacts cached as replacements for a bucket stay with that
+        bucket when another bucket is split (so the bucket indexes change).
+        """
+        parent_node_id = hex(2 ** 509)
+        r = RoutingTable(parent_node_id)
+        # Fill the upper half of the key space and split the table.
+        for i in range(constants.K):
+            contact = PeerNode(PUBLIC_KEY, '192.168.0.%d' % i, 9999, 0)
+            contact.network_id = hex(2 ** 511 + i)
+            r.add_contact(contact)
+        contact = PeerNode(PUBLIC_KEY, '192.168.1.0', 9999, 0)
+        contact.network_id = hex(2 ** 510)
+        r.add_contact(contact)
+        self.assertEqual(2, len(r._buckets))
+        # The upper bucket can't be split since it doesn't contain the parent
+        # node so the contact is cached.
+        extra = PeerNode(PUBLIC_KEY, '192.168.0.100', 9999, 0)
+        extra.network_id = hex(2 ** 511 + constants.K)
+        r.add_contact(extra)
+        self.assertEqual([extra], r._buckets[1].get_replacements())
+        # Cause the lower bucket to split.
+        for i in range(1, constants.K + 1):
+            contact = PeerNode(PUBLIC_KEY, '192.168.1.%d' % i, 9999, 0)
+            contact.network_id = hex(2 ** 510 + i * 2 ** 500)
+            r.add_contact(contact)
+        self.assertEqual(3, len(r._buckets))
+        self.assertEqual([extra], r._buckets[2].get_replacements())
+        # Removing a contact from the upper bucket uses its replacement.
+        r.remove_contact(hex(2 ** 511), forced=True)
+        self.assertIn(extra, r._buckets[2].get_contacts())
+        for bucket in r._buckets[:2]:
+            self.assertNotIn(extra, bucket.get_contacts())
 
     def test_blacklist(self):
         """
@@ -191,7 +300,15 @@ class TestRoutingTable(unittest.TestCase):
         r.remove_contact = MagicMock()
         r.blacklist(contact)
         r.remove_contact.called_once_with(contact, True)
-        self.assertIn(contact.network_id, r._blacklist)
+        self.assertIn(contact.network_id_int, r._blacklist)
+
+    def test_parent_node_int(self):
+        """
+        Ensures the integer form of the parent node's ID is available.
+        """
+        for parent_node_id in ('0xdeadbeef', 0xdeadbeef):
+            r = RoutingTable(parent_node_id)
+            self.assertEqual(0xdeadbeef, r.parent_node_int)
 
     def test_add_contact_with_parent_node_id(self):
         """
@@ -277,8 +394,8 @@ class TestRoutingTable(unittest.TestCase):
         contact.network_id = hex(20)
         r.add_contact(contact)
         self.assertEqual(len(r._buckets[0]), 20)
-        self.assertTrue(0 in r._replacement_cache)
-        self.assertEqual(contact, r._replacement_cache[0][0])
+        self.assertEqual(1, len(r._buckets[0].get_replacements()))
+        self.assertEqual(contact, r._buckets[0].get_replacements()[0])
 
     def test_add_contact_with_full_replacement_cache(self):
         """
@@ -295,16 +412,18 @@ class TestRoutingTable(unittest.TestCase):
             contact.network_id = hex(i)
             r.add_contact(contact)
         # Sanity check of the replacement cache.
-        self.assertEqual(len(r._replacement_cache[0]), 20)
-        self.assertEqual(hex(20), r._replacement_cache[0][0].network_id)
+        self.assertEqual(len(r._buckets[0].get_replacements()), 20)
+        replacements = r._buckets[0].get_replacements()
+        self.assertEqual(hex(20), replacements[0].network_id)
         # Create a new contact that will be added to the replacement cache.
         new_contact = PeerNode(PUBLIC_KEY, "192.168.0.20", 9999, self.version,
                                0)
         new_contact.network_id = hex(40)
         r.add_contact(new_contact)
-        self.assertEqual(len(r._replacement_cache[0]), 20)
-        self.assertEqual(new_contact, r._replacement_cache[0][19])
-        self.assertEqual(hex(21), r._replacement_cache[0][0].network_id)
+        self.assertEqual(len(r._buckets[0].get_replacements()), 20)
+        self.assertEqual(new_contact, r._buckets[0].get_replacements()[19])
+        replacements = r._buckets[0].get_replacements()
+        self.assertEqual(hex(21), replacements[0].network_id)
 
     def test_add_contact_with_existing_contact_in_replacement_cache(self):
         """
@@ -321,16 +440,175 @@ class TestRoutingTable(unittest.TestCase):
             contact.network_id = hex(i)
             r.add_contact(contact)
         # Sanity check of the replacement cache.
-        self.assertEqual(len(r._replacement_cache[0]), 20)
-        self.assertEqual(hex(20), r._replacement_cache[0][0].network_id)
+        self.assertEqual(len(r._buckets[0].get_replacements()), 20)
+        replacements = r._buckets[0].get_replacements()
+        self.assertEqual(hex(20), replacements[0].network_id)
         # Create a new contact that will be added to the replacement cache.
         new_contact = PeerNode(PUBLIC_KEY, '192.168.0.20', 9999, self.version,
                                0)
         new_contact.network_id = hex(20)
         r.add_contact(new_contact)
-        self.assertEqual(len(r._replacement_cache[0]), 20)
-        self.assertEqual(new_contact, r._replacement_cache[0][19])
-        self.assertEqual(hex(21), r._replacement_cache[0][0].network_id)
+        self.assertEqual(len(r._buckets[0].get_replacements()), 20)
+        self.assertEqual(new_contact, r._buckets[0].get_replacements()[19])
+        replacements = r._buckets[0].get_replacements()
+        self.assertEqual(hex(21), replacements[0].network_id)
+
+    def test_add_contact_many_splits(self):
+        """
+        Ensures a contact whose ID only differs from the parent node's in the
+        last bit can be added (requiring a split for every bit of the key
+        space) without exceeding the recursion limit.
+        """
+        parent_node_id = hex(2 ** 511)
+        r = RoutingTable(parent_node_id)
+        for i in range(constants.K):
+            contact = PeerNode(PUBLIC_KEY, '192.168.0.%d' % i, 9999, 0)
+            contact.network_id = hex(2 ** 511 + 2 + i)
+            r.add_contact(contact)
+        contact = PeerNode(PUBLIC_KEY, '192.168.1.1', 9999, 0)
+        contact.network_id = hex(2 ** 511 + 1)
+        r.add_contact(contact)
+        self.assertEqual(contact, r.get_contact(hex(2 ** 511 + 1)))
+        self.assertTrue(len(r._buckets) > 500)
+
+    def test_init_bad_symbol_size(self):
+        """
+        Ensures the symbol size b must be at least 1.
+        """
+        self.assertRaises(ValueError, RoutingTable, '0xdeadbeef', b=0)
+
+    def test_add_contact_relaxed_split(self):
+        """
+        Ensures that with a symbol size of 2 a full bucket that doesn't
+        include the parent node's id is split if its depth is odd but not if
+        its depth is even.
+        """
+        r = RoutingTable(hex(2 ** 511), b=2)
+        # Fill the upper half with contacts so it splits off from the lower
+        # half (depth 1).
+        for i in range(constants.K + 1):
+            contact = PeerNode(PUBLIC_KEY, '192.168.0.%d' % i, 9999, 0)
+            contact.network_id = hex(2 ** 511 + 2 ** 500 * (i + 1))
+            r.add_contact(contact)
+        self.assertEqual(0, r._buckets[0].range_min)
+        self.assertEqual(2 ** 511, r._buckets[0].range_max)
+        # Fill the lower half with contacts from both of its quarters.
+        for i in range(constants.K + 1):
+            contact = PeerNode(PUBLIC_KEY, '192.168.1.%d' % i, 9999, 0)
+            contact.network_id = hex(i * 2 ** 506 + 1)
+            r.add_contact(contact)
+        # The lower half was split into quarters (depth 2) and the quarters
+        # are full but can't be split again.
+        self.assertEqual(2 ** 510, r._buckets[0].range_max)
+        self.assertEqual(2 ** 511, r._buckets[1].range_max)
+        self.assertEqual(constants.K + 1,
+                         len(r._buckets[0]) + len(r._buckets[1]))
+        for i in range(constants.K + 1):
+            contact = PeerNode(PUBLIC_KEY, '192.168.2.%d' % i, 9999, 0)
+            contact.network_id = hex(i + 2)
+            r.add_contact(contact)
+        self.assertEqual(2 ** 510, r._buckets[0].range_max)
+        self.assertEqual(constants.K, len(r._buckets[0]))
+        self.assertTrue(len(r._buckets[0].get_replacements()) > 0)
+
+    def test_add_contact_strict_split(self):
+        """
+        Ensures that with a symbol size of 1 (strict Kademlia) a full bucket
+        that doesn't include the parent node's id is never split.
+        """
+        r = RoutingTable(hex(2 ** 511), b=1)
+        for i in range(constants.K + 1):
+            contact = PeerNode(PUBLIC_KEY, '192.168.0.%d' % i, 9999, 0)
+            contact.network_id = hex(2 ** 511 + 2 ** 500 * (i + 1))
+            r.add_contact(contact)
+        for i in range(constants.K + 5):
+            contact = PeerNode(PUBLIC_KEY, '192.168.1.%d' % i, 9999, 0)
+            contact.network_id = hex(i * 2 ** 505 + 1)
+            r.add_contact(contact)
+        self.assertEqual(2 ** 511, r._buckets[0].range_max)
+        self.assertEqual(constants.K, len(r._buckets[0]))
+        self.assertEqual(5, len(r._buckets[0].get_replacements()))
+
+    def test_add_contacts(self):
+        """
+        Ensures adding many contacts at once results in the same routing table
+        (buckets, contacts and replacement caches) as adding each contact in
+        turn (with symbol sizes from 1 to 3).
+        """
+        rand = random.Random(6)
+        for trial in range(10):
+            parent_node_id = hex(rand.getrandbits(512))
+            contacts = []
+            for i in range(rand.randint(0, 500)):
+                contact = PeerNode(PUBLIC_KEY, '192.168.0.%d' % i, 9999,
+                                   self.version, 0)
+                if i % 2:
+                    contact_id = (int(parent_node_id, 0) ^
+                                  rand.getrandbits(rand.randint(480, 512)))
+                elif contacts and i % 5 == 0:
+                    # A duplicate of an earlier contact.
+                    contact_id = rand.choice(contacts).network_id_int
+                else:
+                    contact_id = rand.getrandbits(512)
+                contact.network_id = hex(contact_id)
+                contacts.append(contact)
+            b = trial % 3 + 1
+            expected = RoutingTable(parent_node_id, b=b)
+            for contact in contacts:
+                expected.add_contact(contact)
+            r = RoutingTable(parent_node_id, b=b)
+            summary = r.add_contacts(contacts)
+            self.assertEqual(len(contacts), sum(summary.values()))
+            self.assertEqual(
+                [(b.range_min, b.range_max) for b in expected._buckets],
+                [(b.range_min, b.range_max) for b in r._buckets])
+            self.assertEqual(expected._bucket_mins, r._bucket_mins)
+            for expected_bucket, bucket in zip(expected._buckets, r._buckets):
+                self.assertEqual(
+                    set(expected_bucket._contacts), set(bucket._contacts))
+                self.assertEqual(
+                    set(expected_bucket._replacement_cache),
+                    set(bucket._replacement_cache))
+
+    def test_add_contacts_summary(self):
+        """
+        Ensures the summary returned by add_contacts counts the contacts that
+        were added, refreshed, cached and rejected.
+        """
+        parent_node_id = hex(2 ** 511)
+        r = RoutingTable(parent_node_id)
+        blacklisted = PeerNode(PUBLIC_KEY, '192.168.0.1', 9999, 0)
+        blacklisted.network_id = hex(1)
+        r.blacklist(blacklisted)
+        parent = PeerNode(PUBLIC_KEY, '192.168.0.2', 9999, 0)
+        parent.network_id = parent_node_id
+        contacts = [blacklisted, parent]
+        # Enough contacts in the lower half of the key space (which can't be
+        # split) to fill the bucket and cache five.
+        for i in range(constants.K + 5):
+            contact = PeerNode(PUBLIC_KEY, '192.168.1.%d' % i, 9999, 0)
+            contact.network_id = hex(2 + i)
+            contact.failed_RPCs = 3
+            contacts.append(contact)
+        # Contacts in the upper half of the key space.
+        for i in range(3):
+            contact = PeerNode(PUBLIC_KEY, '192.168.2.%d' % i, 9999, 0)
+            contact.network_id = hex(2 ** 511 + 1 + i)
+            contacts.append(contact)
+        # Seen again.
+        contacts.append(contacts[2])
+        result = r.add_contacts(contacts)
+        expected = {
+            'added': constants.K + 3,
+            'refreshed': 1,
+            'cached': 5,
+            'rejected': 2,
+        }
+        self.assertEqual(expected, result)
+        self.assertEqual(2, len(r._buckets))
+        self.assertEqual(5, len(r._buckets[0].get_replacements()))
+        self.assertEqual(contacts[2], r._buckets[0].get_contacts()[-1])
+        self.assertEqual(0, contacts[2].failed_RPCs)
 
     def test_find_close_nodes_single_bucket(self):
         """
@@ -394,6 +672,22 @@ class TestRoutingTable(unittest.TestCase):
         result = r.find_close_nodes(hex(1), network_id=contact.network_id)
         self.assertEqual(constants.K - 1, len(result))
 
+    def test_find_close_nodes_exclude_integer_id(self):
+        """
+        Ensure the excluded node may be referenced by its integer network ID
+        (as well as a hex string or PeerNode).
+        """
+        r = RoutingTable('0xdeadbeef')
+        for i in range(5):
+            contact = PeerNode(PUBLIC_KEY, "192.168.0.%d" % i, 9999,
+                               self.version, 0)
+            contact.network_id = hex(i)
+            r.add_contact(contact)
+        for exclude in (3, hex(3), r.get_contact(hex(3))):
+            result = r.find_close_nodes(hex(1), network_id=exclude)
+            self.assertEqual(4, len(result))
+            self.assertNotIn(3, [c.network_id_int for c in result])
+
     def test_find_close_nodes_in_correct_order(self):
         """
         Ensures that the nearest nodes are returned in the correct order: from
@@ -420,6 +714,102 @@ class TestRoutingTable(unittest.TestCase):
         distances = [distance(x.network_id, target_key) for x in result]
         self.assertEqual(sorted(distances), distances)
 
+    def test_find_close_nodes_matches_brute_force(self):
+        """
+        Ensures the result of find_close_nodes is always the same as sorting
+        every contact in the routing table by distance from the target key,
+        for randomly populated routing tables (with symbol sizes from 1 to 3)
+        and randomly chosen keys.
+        """
+        rand = random.Random(512)
+        for trial in range(20):
+            parent_node_id = hex(rand.getrandbits(512))
+            r = RoutingTable(parent_node_id, b=trial % 3 + 1)
+            for i in range(rand.randint(0, 300)):
+                contact = PeerNode(PUBLIC_KEY, '192.168.0.%d' % i, 9999,
+                                   self.version, 0)
+                # Cluster some contacts near the parent node to cause splits.
+                if i % 2:
+                    contact_id = (int(parent_node_id, 0) ^
+                                  rand.getrandbits(rand.randint(480, 512)))
+                else:
+                    contact_id = rand.getrandbits(512)
+                contact.network_id = hex(contact_id)
+                r.add_contact(contact)
+            contacts = [c for b in r._buckets for c in b.get_contacts()]
+            for j in range(10):
+                if contacts and j % 2:
+                    target_key = hex(rand.choice(contacts).network_id_int ^
+                                     rand.getrandbits(rand.randint(1, 512)))
+                else:
+                    target_key = hex(rand.getrandbits(512))
+                exclude = rand.choice(contacts) if contacts else None
+                expected = sorted(
+                    [c for c in contacts if c != exclude],
+                    key=lambda c: distance(c.network_id, target_key))
+                expected = expected[:constants.K]
+                result = r.find_close_nodes(target_key, exclude)
+                self.assertEqual(expected, result)
+                self.assertEqual(
+                    [c.network_id for c in expected],
+                    [c.network_id for c in result])
+
+    def test_find_close_nodes_unaligned_buckets(self):
+        """
+        Ensures the closest contacts are found even if the bucket ranges are
+        not aligned to powers of two.
+        """
+        parent_node_id = '0xdeadbeef'
+        r = RoutingTable(parent_node_id)
+        r._buckets = [Bucket(0, 100), Bucket(100, 2 ** 512)]
+        r._bucket_mins = [0, 100]
+        contacts = []
+        for i in range(0, 200, 5):
+            contact = PeerNode(PUBLIC_KEY, '192.168.0.%d' % i, 9999,
+                               self.version, 0)
+            contact.network_id = hex(i)
+            r._buckets[r._bucket_index(i)].add_contact(contact)
+            contacts.append(contact)
+        for target in range(200):
+            expected = sorted(contacts,
+                              key=lambda c: c.network_id_int ^ target)
+            result = r.find_close_nodes(target)
+            self.assertEqual([c.network_id for c in expected[:constants.K]],
+                             [c.network_id for c in result])
+
+    def test_find_close_nodes_latency_aware(self):
+        """
+        Ensures that with latency_aware set the same contacts are returned but
+        those of the same distance rank are ordered fastest first (with those
+        without a round trip time estimate last).
+        """
+        rand = random.Random(15)
+        r = make_populated_table()
+        contacts = [c for b in r._buckets for c in b.get_contacts()]
+        target_key = r._parent_node_int
+        expected = r.find_close_nodes(target_key)
+        result = r.find_close_nodes(target_key, latency_aware=True)
+        self.assertEqual(set(c.network_id_int for c in expected),
+                         set(c.network_id_int for c in result))
+        self.assertNotEqual(expected, result)
+        for contact in contacts:
+            contact.srtt = None
+        self.assertEqual(expected,
+                         r.find_close_nodes(target_key, latency_aware=True))
+        # Make the furthest contacts in the most common rank the fastest.
+        ranks = [(c.network_id_int ^ target_key).bit_length()
+                 for c in expected]
+        rank = max(ranks, key=ranks.count)
+        start = ranks.index(rank)
+        same_rank = expected[start:start + ranks.count(rank)]
+        self.assertTrue(len(same_rank) > 1)
+        for i, contact in enumerate(reversed(same_rank)):
+            contact.record_rtt(i + rand.random() / 2)
+        result = r.find_close_nodes(target_key, latency_aware=True)
+        self.assertEqual(expected[:start], result[:start])
+        self.assertEqual(list(reversed(same_rank)),
+                         result[start:start + len(same_rank)])
+
     def test_get_contact(self):
         """
         Ensures that the correct contact is returned.
@@ -449,17 +839,81 @@ class TestRoutingTable(unittest.TestCase):
         """
         parent_node_id = '0xdeadbeef'
         r = RoutingTable(parent_node_id)
-        bucket1 = Bucket(1, 2)
+        r._split_bucket(0)
         # Set the lastAccessed flag on bucket 1 to be out of date
-        bucket1.last_accessed = int(time.time()) - 3700
-        r._buckets[0] = bucket1
-        bucket2 = Bucket(2, 3)
-        bucket2.last_accessed = int(time.time())
-        r._buckets.append(bucket2)
-        expected = 1
+        r._buckets[0].last_accessed = int(time.time()) - 3700
+        r._buckets[1].last_accessed = int(time.time())
+        result = r.get_refresh_list(0)
+        self.assertEqual(1, len(result))
+        self.assertTrue(r._buckets[0].key_in_range(result[0]))
+
+    def test_get_refresh_list_schedules_next_refresh(self):
+        """
+        Ensures a bucket returned for refreshing is not returned again until
+        it is next due (REFRESH_TIMEOUT plus up to REFRESH_JITTER seconds
+        later).
+        """
+        r = RoutingTable('0xdeadbeef')
+        now = int(time.time())
+        self.assertEqual(1, len(r.get_refresh_list()))
+        self.assertEqual([], r.get_refresh_list())
+        self.assertEqual(1, len(r._refresh_queue))
+        due, range_min = r._refresh_queue[0]
+        self.assertEqual(0, range_min)
+        self.assertTrue(now + constants.REFRESH_TIMEOUT <= due <=
+                        now + 1 + constants.REFRESH_TIMEOUT +
+                        constants.REFRESH_JITTER)
+
+    def test_get_refresh_list_touched_bucket(self):
+        """
+        Ensures a bucket that was touched since it was scheduled is not
+        returned and is rescheduled relative to when it was last accessed.
+        """
+        r = RoutingTable('0xdeadbeef')
+        r.touch_bucket('0xabc')
+        last_accessed = r._buckets[0].last_accessed
+        self.assertEqual([], r.get_refresh_list())
+        due, range_min = r._refresh_queue[0]
+        self.assertTrue(last_accessed + constants.REFRESH_TIMEOUT <= due <=
+                        last_accessed + constants.REFRESH_TIMEOUT +
+                        constants.REFRESH_JITTER)
+
+    def test_get_refresh_list_jitter(self):
+        """
+        Ensures buckets last accessed at the same time are not all scheduled
+        to be refreshed at the same time.
+        """
+        r = RoutingTable(hex(2 ** 511))
+        for i in range(20):
+            r._split_bucket(r._bucket_index(hex(2 ** 511)))
+        due_times = set(due for due, _ in r._refresh_queue)
+        self.assertTrue(len(due_times) > 1)
+
+    def test_get_refresh_list_start_index(self):
+        """
+        Ensures stale buckets before the start index are not returned but
+        remain due.
+        """
+        r = RoutingTable(hex(2 ** 511))
+        r._split_bucket(0)
+        result = r.get_refresh_list(1)
+        self.assertEqual(1, len(result))
+        self.assertTrue(r._buckets[1].key_in_range(result[0]))
         result = r.get_refresh_list(0)
         self.assertEqual(1, len(result))
-        self.assertEqual(expected, int(result[0], 0))
+        self.assertTrue(r._buckets[0].key_in_range(result[0]))
+        self.assertEqual(2, len(r._refresh_queue))
+
+    def test_split_bucket_schedules_refresh(self):
+        """
+        Ensures the new bucket created by a split is added to the refresh
+        schedule.
+        """
+        r = RoutingTable('0xdeadbeef')
+        r._split_bucket(0)
+        self.assertEqual([0, 2 ** 511],
+                         sorted(range_min for _, range_min in
+                                r._refresh_queue))
 
     def test_get_forced_refresh_list(self):
         """
@@ -502,7 +956,7 @@ class TestRoutingTable(unittest.TestCase):
 
         r.remove_contact('0xb')
         self.assertEqual(len(r._buckets[0]), 1)
-        self.assertEqual(contact1, r._buckets[0]._contacts[0])
+        self.assertEqual(contact1, r._buckets[0].get_contacts()[0])
 
     def test_remove_contact_with_unknown_contact(self):
         """
@@ -519,7 +973,7 @@ class TestRoutingTable(unittest.TestCase):
         result = r.remove_contact('0xb')
         self.assertEqual(None, result)
         self.assertEqual(len(r._buckets[0]), 1)
-        self.assertEqual(contact1, r._buckets[0]._contacts[0])
+        self.assertEqual(contact1, r._buckets[0].get_contacts()[0])
 
     def test_remove_contact_with_cached_replacement(self):
         """
@@ -539,16 +993,16 @@ class TestRoutingTable(unittest.TestCase):
         # Add something into the cache.
         contact3 = PeerNode(PUBLIC_KEY, '192.168.0.3', 9999, self.version, 0)
         contact3.network_id = '0x3'
-        r._replacement_cache[0] = [contact3, ]
+        r._buckets[0].add_replacement(contact3)
         # Sanity check
         self.assertEqual(len(r._buckets[0]), 2)
-        self.assertEqual(len(r._replacement_cache[0]), 1)
+        self.assertEqual(len(r._buckets[0].get_replacements()), 1)
 
         r.remove_contact('0xb')
         self.assertEqual(len(r._buckets[0]), 2)
-        self.assertEqual(contact1, r._buckets[0]._contacts[0])
-        self.assertEqual(contact3, r._buckets[0]._contacts[1])
-        self.assertEqual(len(r._replacement_cache[0]), 0)
+        self.assertEqual(contact1, r._buckets[0].get_contacts()[0])
+        self.assertEqual(contact3, r._buckets[0].get_contacts()[1])
+        self.assertEqual(len(r._buckets[0].get_replacements()), 0)
 
     def test_remove_contact_with_not_enough_RPC_fails(self):
         """
@@ -603,15 +1057,14 @@ class TestRoutingTable(unittest.TestCase):
         contact2.network_id = '0xb'
         r.add_contact(contact1)
         r.add_contact(contact2)
-        r._replacement_cache[0] = []
-        r._replacement_cache[0].append(contact2)
+        r._buckets[0].add_replacement(contact2)
         # Sanity check
         self.assertEqual(len(r._buckets[0]), 2)
-        self.assertEqual(len(r._replacement_cache[0]), 1)
+        self.assertEqual(len(r._buckets[0].get_replacements()), 1)
 
         r.remove_contact('0xb', forced=True)
         self.assertEqual(len(r._buckets[0]), 1)
-        self.assertNotIn(contact2, r._replacement_cache[0])
+        self.assertNotIn(contact2, r._buckets[0].get_replacements())
 
     def test_touch_bucket(self):
         """
@@ -627,3 +1080,383 @@ class TestRoutingTable(unittest.TestCase):
         # do for the purposes of testing.
         r.touch_bucket('0xabc')
         self.assertNotEqual(0, r._buckets[0].last_accessed)
+
+    def assertSameTable(self, expected, actual):
+        """
+        Ensures the two routing tables have the same state.
+        """
+        self.assertEqual(expected._parent_node_id, actual._parent_node_id)
+        self.assertEqual(expected._parent_node_int, actual._parent_node_int)
+        self.assertEqual(expected._blacklist, actual._blacklist)
+        self.assertEqual(expected._bucket_mins, actual._bucket_mins)
+        self.assertEqual(len(expected._buckets), len(actual._buckets))
+        for old, new in zip(expected._buckets, actual._buckets):
+            self.assertEqual(old.range_min, new.range_min)
+            self.assertEqual(old.range_max, new.range_max)
+            self.assertEqual(old.last_accessed, new.last_accessed)
+            for old_contacts, new_contacts in (
+                    (old.get_contacts(), new.get_contacts()),
+                    (old.get_replacements(), new.get_replacements())):
+                self.assertEqual([repr(c) for c in old_contacts],
+                                 [repr(c) for c in new_contacts])
+                self.assertEqual([(c.srtt, c.rttvar) for c in old_contacts],
+                                 [(c.srtt, c.rttvar) for c in new_contacts])
+                for c in new_contacts:
+                    self.assertEqual(int(c.network_id, 0), c.network_id_int)
+
+    def test_metrics(self):
+        """
+        Ensures splits, bucket full events, replacement cache promotions,
+        blacklist hits, evictions and forced removals are counted and
+        find_close_nodes is timed.
+        """
+        metrics = Metrics()
+        r = RoutingTable(hex(2 ** 511), metrics)
+        contacts = []
+        # The first K fill the initial bucket, the next causes a split and
+        # the final five go in the (unsplittable) lower bucket's replacement
+        # cache.
+        for i in range(constants.K + 6):
+            contact = PeerNode(PUBLIC_KEY, '192.168.0.%d' % i, 9999, 0)
+            if i == constants.K:
+                contact.network_id = hex(2 ** 511 + 1)
+            else:
+                contact.network_id = hex(i + 1)
+            contacts.append(contact)
+            r.add_contact(contact)
+        for i in range(constants.ALLOWED_RPC_FAILS):
+            r.remove_contact(contacts[0].network_id)
+        r.blacklist(contacts[1])
+        r.add_contact(contacts[1])
+        r.add_contacts([contacts[1], contacts[2]])
+        r.find_close_nodes(hex(1))
+        result = metrics.report()
+        expected = {
+            'splits': 1,
+            'bucket_full': 5,
+            'replacement_promotions': 2,
+            'evictions': 1,
+            'forced_removals': 1,
+            'blacklist_hits': 2,
+        }
+        self.assertEqual(expected, result['counters'])
+        self.assertEqual(1, result['histograms']['find_close_nodes']['count'])
+
+    def test_metrics_disabled(self):
+        """
+        Ensures the routing table works without a Metrics object.
+        """
+        r = make_populated_table()
+        self.assertIsNone(r.metrics)
+        self.assertTrue(len(r.find_close_nodes(hex(1))) > 0)
+
+    def test_stats(self):
+        """
+        Ensures the stats describe the fill level, depth and staleness of each
+        bucket.
+        """
+        r = RoutingTable(hex(2 ** 511))
+        for i in range(constants.K + 1):
+            contact = PeerNode(PUBLIC_KEY, '192.168.0.%d' % i, 9999, 0)
+            contact.network_id = hex(2 ** 510 + i)
+            r.add_contact(contact)
+        r.touch_bucket(hex(1))
+        r.blacklist(contact)
+        result = r.stats()
+        self.assertEqual(2, result['bucket_count'])
+        self.assertEqual(constants.K, result['contact_count'])
+        self.assertEqual(0, result['replacement_count'])
+        self.assertEqual(1, result['blacklist_count'])
+        lower, upper = result['buckets']
+        self.assertEqual(1, lower['depth'])
+        self.assertEqual(constants.K, lower['contacts'])
+        self.assertEqual(1.0, lower['fill'])
+        self.assertEqual(r._buckets[0].last_accessed, lower['last_accessed'])
+        self.assertTrue(0 <= lower['staleness'] <= 1)
+        self.assertEqual(1, upper['depth'])
+        self.assertEqual(0, upper['contacts'])
+        self.assertEqual(0.0, upper['fill'])
+        self.assertEqual(0, upper['last_accessed'])
+        self.assertTrue(upper['staleness'] > constants.REFRESH_TIMEOUT)
+
+    def test_snapshot(self):
+        """
+        Ensures a routing table's snapshot describes its state.
+        """
+        r = make_populated_table()
+        result = r.snapshot()
+        self.assertEqual(1, result['version'])
+        self.assertEqual(r._parent_node_id, result['parent_node_id'])
+        self.assertEqual(constants.B, result['b'])
+        self.assertEqual(['0x%0128x' % network_id
+                          for network_id in sorted(r._blacklist)],
+                         result['blacklist'])
+        self.assertEqual(len(r._buckets), len(result['buckets']))
+        bucket = r._buckets[0]
+        contact = bucket.get_contacts()[0]
+        bucket_data = result['buckets'][0]
+        self.assertEqual(hex(bucket.range_min), bucket_data['range_min'])
+        self.assertEqual(hex(bucket.range_max), bucket_data['range_max'])
+        self.assertEqual(bucket.last_accessed, bucket_data['last_accessed'])
+        self.assertEqual(len(bucket), len(bucket_data['contacts']))
+        self.assertEqual([contact.network_id, contact.public_key,
+                          contact.ip_address, contact.port, contact.version,
+                          contact.last_seen, contact.failed_RPCs,
+                          contact.srtt, contact.rttvar],
+                         bucket_data['contacts'][0])
+        self.assertEqual(len(bucket.get_replacements()),
+                         len(bucket_data['replacements']))
+
+    def test_from_snapshot(self):
+        """
+        Ensures a routing table created from a snapshot has the same state as
+        the original.
+        """
+        r = make_populated_table()
+        result = RoutingTable.from_snapshot(r.snapshot())
+        self.assertSameTable(r, result)
+        self.assertEqual(sorted(b.range_min for b in r._buckets),
+                         sorted(range_min for _, range_min in
+                                result._refresh_queue))
+        key = hex(random.getrandbits(512))
+        self.assertEqual(r.find_close_nodes(key), result.find_close_nodes(key))
+
+    def test_from_snapshot_blacklist(self):
+        """
+        Ensures blacklisted network IDs (in any hex form) are restored so the
+        contacts can't be added again.
+        """
+        snapshot = RoutingTable('0xdeadbeef').snapshot()
+        snapshot['blacklist'] = ['0x2']
+        r = RoutingTable.from_snapshot(snapshot)
+        self.assertEqual({2}, r._blacklist)
+        contact = PeerNode(PUBLIC_KEY, '192.168.0.1', 9999, get_version(), 0)
+        contact.network_id = hex(2)
+        r.add_contact(contact)
+        self.assertEqual(0, len(r._buckets[0]))
+
+    def test_from_snapshot_without_rtt(self):
+        """
+        Ensures contacts in snapshots taken before round trip times were
+        recorded are restored without a round trip time estimate.
+        """
+        r = make_populated_table()
+        snapshot = r.snapshot()
+        for bucket_data in snapshot['buckets']:
+            for data in bucket_data['contacts']:
+                del data[7:]
+        result = RoutingTable.from_snapshot(snapshot)
+        for bucket in result._buckets:
+            for contact in bucket.get_contacts():
+                self.assertIsNone(contact.srtt)
+                self.assertIsNone(contact.rttvar)
+
+    def test_from_snapshot_symbol_size(self):
+        """
+        Ensures the symbol size is restored from the snapshot (and defaults to
+        B if the snapshot doesn't include it).
+        """
+        snapshot = RoutingTable('0xdeadbeef', b=3).snapshot()
+        self.assertEqual(3, RoutingTable.from_snapshot(snapshot)._b)
+        del snapshot['b']
+        self.assertEqual(constants.B,
+                         RoutingTable.from_snapshot(snapshot)._b)
+
+    def test_from_snapshot_bad_version(self):
+        """
+        Ensures snapshots in an unknown format are rejected.
+        """
+        snapshot = RoutingTable('0xdeadbeef').snapshot()
+        snapshot['version'] = 2
+        self.assertRaises(ValueError, RoutingTable.from_snapshot, snapshot)
+
+    def test_from_snapshot_bad_ranges(self):
+        """
+        Ensures snapshots whose buckets don't exactly cover the key space are
+        rejected.
+        """
+        r = make_populated_table()
+        snapshot = r.snapshot()
+        del snapshot['buckets'][1]
+        self.assertRaises(ValueError, RoutingTable.from_snapshot, snapshot)
+        snapshot = r.snapshot()
+        del snapshot['buckets'][-1]
+        self.assertRaises(ValueError, RoutingTable.from_snapshot, snapshot)
+
+    def test_save_and_load(self):
+        """
+        Ensures a routing table saved to a file can be loaded again.
+        """
+        r = make_populated_table()
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'routingtable.json')
+            r.save(filename)
+            result = RoutingTable.load(filename)
+        self.assertIsInstance(result, RoutingTable)
+        self.assertSameTable(r, result)
+
+
+class TestConcurrentRoutingTable(unittest.TestCase):
+    """
+    Ensures the ConcurrentRoutingTable class works as expected.
+    """
+
+    def make_contact(self, network_id):
+        """
+        Returns a PeerNode with the specified (integer) network ID.
+        """
+        contact = PeerNode(PUBLIC_KEY, '192.168.0.1', 9999, 0)
+        contact.network_id = hex(network_id)
+        return contact
+
+    def test_lookups_use_published_snapshot(self):
+        """
+        Ensures changes made during an update are only visible to lookups once
+        the update is complete and the buckets in the previous snapshot are
+        left untouched.
+        """
+        r = ConcurrentRoutingTable(hex(2 ** 511))
+        for i in range(constants.K):
+            r.add_contact(self.make_contact(i + 1))
+        old_snapshot = r._snapshot
+        old_bucket = old_snapshot._buckets[0]
+        # Causes a split.
+        r.add_contact(self.make_contact(2 ** 511 + 1))
+        self.assertEqual(1, len(old_snapshot._buckets))
+        self.assertEqual(2 ** 512, old_bucket.range_max)
+        self.assertEqual(constants.K, len(old_bucket))
+        self.assertIsNot(old_snapshot, r._snapshot)
+        self.assertEqual(2, len(r._snapshot._buckets))
+        self.assertEqual(hex(2 ** 511 + 1),
+                         r.get_contact(hex(2 ** 511 + 1)).network_id)
+        self.assertEqual(constants.K, len(r.find_close_nodes(hex(1))))
+
+    def test_blacklist(self):
+        """
+        Ensures a blacklisted contact is removed from the published snapshot
+        and can't be added again.
+        """
+        r = ConcurrentRoutingTable(hex(2 ** 511))
+        contact = self.make_contact(1)
+        r.add_contact(contact)
+        r.blacklist(contact)
+        self.assertRaises(ValueError, r.get_contact, hex(1))
+        r.add_contact(contact)
+        self.assertRaises(ValueError, r.get_contact, hex(1))
+
+    def test_touch_bucket(self):
+        """
+        Ensures touching a bucket updates the bucket used by lookups.
+        """
+        r = ConcurrentRoutingTable(hex(2 ** 511))
+        r.touch_bucket(hex(1))
+        self.assertNotEqual(0, r._snapshot._buckets[0].last_accessed)
+        self.assertEqual([], r.get_refresh_list())
+
+    def test_stress(self):
+        """
+        Runs many reader and writer threads against the same routing table.
+        Contacts added before the threads start are never removed so readers
+        must always be able to find them, however many buckets are split
+        while they look.
+        """
+        rand = random.Random(7)
+        parent_node_id = rand.getrandbits(512)
+        r = ConcurrentRoutingTable(hex(parent_node_id))
+        permanent = [self.make_contact(parent_node_id ^ (1 << i))
+                     for i in range(0, 512, 32)]
+        r.add_contacts(permanent)
+        errors = []
+        stop = threading.Event()
+
+        def writer(seed):
+            rand = random.Random(seed)
+            added = []
+            try:
+                for i in range(300):
+                    contact_id = parent_node_id ^ rand.getrandbits(
+                        rand.randint(1, 512))
+                    if contact_id in permanent:
+                        continue
+                    contact = self.make_contact(contact_id)
+                    if i % 10 == 0:
+                        r.add_contacts([contact, self.make_contact(
+                            rand.getrandbits(512))])
+                    else:
+                        r.add_contact(contact)
+                    added.append(contact)
+                    if i % 3 == 0:
+                        r.remove_contact(rand.choice(added).network_id,
+                                         forced=True)
+                    if i % 7 == 0:
+                        r.touch_bucket(contact.network_id)
+            except Exception as ex:  # pragma: no cover
+                errors.append(ex)
+
+        def reader(seed):
+            rand = random.Random(seed)
+            try:
+                while not stop.is_set():
+                    contact = rand.choice(permanent)
+                    self.assertEqual(contact,
+                                     r.get_contact(contact.network_id))
+                    result = r.find_close_nodes(contact.network_id)
+                    self.assertEqual(contact, result[0])
+                    distances = [c.network_id_int ^ contact.network_id_int
+                                 for c in result]
+                    self.assertEqual(sorted(distances), distances)
+                    self.assertTrue(len(result) <= constants.K)
+                    r.get_refresh_list(force=True)
+            except Exception as ex:  # pragma: no cover
+                errors.append(ex)
+
+        writers = [threading.Thread(target=writer, args=(i, ))
+                   for i in range(4)]
+        readers = [threading.Thread(target=reader, args=(i, ))
+                   for i in range(100, 108)]
+        for thread in readers + writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        stop.set()
+        for thread in readers:
+            thread.join()
+        self.assertEqual([], errors)
+        # The final state is consistent.
+        for contact in permanent:
+            self.assertEqual(contact, r.get_contact(contact.network_id))
+        buckets = r._snapshot._buckets
+        self.assertEqual(0, buckets[0].range_min)
+        self.assertEqual(2 ** 512, buckets[-1].range_max)
+        for bucket, next_bucket in zip(buckets, buckets[1:]):
+            self.assertEqual(bucket.range_max, next_bucket.range_min)
+        for bucket in buckets:
+            for contact in bucket.get_contacts():
+                self.assertTrue(bucket.key_in_range(contact.network_id_int))
+
+    def test_save_and_load(self):
+        """
+        Ensures a saved routing table is loaded as a ConcurrentRoutingTable
+        whose lookups use the loaded buckets.
+        """
+        r = make_populated_table(ConcurrentRoutingTable)
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'routingtable.json')
+            r.save(filename)
+            result = ConcurrentRoutingTable.load(filename)
+        self.assertIsInstance(result, ConcurrentRoutingTable)
+        self.assertEqual(r.snapshot(), result.snapshot())
+        self.assertEqual(r.snapshot(), result._snapshot.snapshot())
+
+    def test_stats_and_metrics(self):
+        """
+        Ensures stats describe the published snapshot and lookups on the
+        snapshot are timed.
+        """
+        metrics = Metrics()
+        r = make_populated_table(ConcurrentRoutingTable)
+        self.assertEqual(r._snapshot.stats(), r.stats())
+        r = ConcurrentRoutingTable(hex(2 ** 511), metrics)
+        r.find_close_nodes(hex(1))
+        result = metrics.report()['histograms']['find_close_nodes']
+        self.assertEqual(1, result['count'])
@@ -3,7 +3,8 @@
 Ensures the generic functions used in various places within the daemon work
 as expected.
 """
-from p4p2p.dht.utils import distance, sort_peer_nodes
+from p4p2p.dht.utils import (distance, sort_peer_nodes,
+                             sort_peer_nodes_by_latency)
 from p4p2p.dht.contact import PeerNode
 from p4p2p.dht import constants
 from p4p2p.version import get_version
@@ -32,6 +33,17 @@ class TestUtils(unittest.TestCase):
         actual = distance(key1, key2)
         self.assertEqual(expected, actual)
 
+    def test_distance_int(self):
+        """
+        Ensures keys expressed as integers (or a mixture of integers and
+        strings) return the correct distance.
+        """
+        key1 = 0xdeadbeef
+        key2 = 0xbeefdead
+        expected = key1 ^ key2
+        self.assertEqual(expected, distance(key1, key2))
+        self.assertEqual(expected, distance(hex(key1), key2))
+
     def test_sort_peer_nodes(self):
         """
         Ensures that the sort_peer_nodes function returns the list ordered in
@@ -56,6 +68,28 @@ class TestUtils(unittest.TestCase):
         distances = [distance(x.network_id, target_key) for x in result]
         self.assertEqual(sorted(distances), distances)
 
+    def test_sort_peer_nodes_by_latency(self):
+        """
+        Ensures contacts are ordered by distance rank from the target key and,
+        within each rank, fastest first with contacts that have no round trip
+        time estimate last.
+        """
+        target_key = 0
+        # Rank 2 (distance 2 or 3) and rank 3 (distances 4 to 7).
+        details = [(2, None), (3, 0.2), (4, 0.3), (5, None), (6, 0.1),
+                   (7, 0.5)]
+        contacts = []
+        for network_id, rtt in details:
+            contact = PeerNode(PUBLIC_KEY, "192.168.0.1", 9999,
+                               self.version, 0)
+            contact.network_id = hex(network_id)
+            if rtt is not None:
+                contact.record_rtt(rtt)
+            contacts.append(contact)
+        result = sort_peer_nodes_by_latency(list(contacts), hex(target_key))
+        self.assertEqual([3, 2, 6, 4, 7, 5],
+                         [c.network_id_int for c in result])
+
     def test_sort_peer_nodes_no_longer_than_k(self):
         """
         Ensure that no more than constants.K contacts are returned from the
@@ -70,3 +104,17 @@ class TestUtils(unittest.TestCase):
         target_key = hex(2 ** 256)
         result = sort_peer_nodes(contacts, target_key)
         self.assertEqual(constants.K, len(result))
+
+    def test_sort_peer_nodes_int_target_key(self):
+        """
+        Ensures the target key may be expressed as an integer.
+        """
+        contacts = []
+        for i in range(512):
+            contact = PeerNode(PUBLIC_KEY, "192.168.0.%d" % i, 9999,
+                               self.version, 0)
+            contact.network_id = hex(2 ** i)
+            contacts.append(contact)
+        expected = sort_peer_nodes(contacts[:], hex(2 ** 256))
+        result = sort_peer_nodes(contacts[:], 2 ** 256)
+        self.assertEqual(expected, result)